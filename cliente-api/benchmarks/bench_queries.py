@@ -0,0 +1,78 @@
+"""
+Micro-benchmark do custo por chamada das consultas do ClienteService
+
+Compara as consultas no estilo legado (db.query(...) montado a cada
+chamada) com as consultas atuais do ClienteService (statements 2.0
+construidos uma unica vez e executados com bind params). Usa SQLite em
+memoria para que o tempo medido seja dominado pelo overhead em Python.
+
+Uso:
+    python benchmarks/bench_queries.py --clientes 50 --repeticoes 20000
+"""
+import argparse
+import sys
+import timeit
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from sqlalchemy import insert
+from sqlalchemy.orm import sessionmaker
+
+from database.connection import criar_engine
+from database.migrations import aplicar_migracoes
+from models.cliente import Cliente
+from services.cliente_service import ClienteService
+
+
+class ClienteServiceLegado(ClienteService):
+    """Consultas como eram antes: Query ORM reconstruida a cada chamada"""
+
+    def listar_todos(self):
+        return self.db.query(Cliente).order_by(Cliente.nome).all()
+
+    def buscar_por_id(self, cliente_id):
+        return self.db.query(Cliente).filter(Cliente.id == cliente_id).first()
+
+    def buscar_por_nome(self, nome):
+        return self.db.query(Cliente).filter(
+            Cliente.nome.ilike(f"%{nome.strip()}%")
+        ).order_by(Cliente.nome).all()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--clientes", type=int, default=50)
+    parser.add_argument("--repeticoes", type=int, default=20000)
+    args = parser.parse_args()
+
+    engine = criar_engine("sqlite:///:memory:")
+    aplicar_migracoes(engine)
+    with engine.begin() as conexao:
+        conexao.execute(insert(Cliente.__table__), [
+            {"nome": f"Cliente {i:05d}", "email": f"cliente{i}@email.com"}
+            for i in range(args.clientes)
+        ])
+    db = sessionmaker(bind=engine)()
+
+    casos = [
+        ("buscar_por_id", lambda s: s.buscar_por_id(args.clientes // 2)),
+        ("buscar_por_nome", lambda s: s.buscar_por_nome("0001")),
+        ("listar_todos", lambda s: s.listar_todos()),
+    ]
+
+    print(f"{'consulta':<18} {'legado (us)':>12} {'atual (us)':>12} {'ganho':>7}")
+    for nome, chamada in casos:
+        tempos = []
+        for classe in (ClienteServiceLegado, ClienteService):
+            service = classe(db)
+            chamada(service)
+            segundos = min(timeit.repeat(
+                lambda: chamada(service), number=args.repeticoes, repeat=3
+            ))
+            tempos.append(segundos / args.repeticoes * 1e6)
+        print(f"{nome:<18} {tempos[0]:>12.1f} {tempos[1]:>12.1f} {tempos[0] / tempos[1]:>6.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""
+Memoria e latencia do diretorio de clientes em memoria
+
+Carrega N clientes sinteticos no DiretorioClientes (sem banco), mede a
+memoria alocada com tracemalloc e o tempo por chamada das consultas
+servidas pelo snapshot.
+
+Uso:
+    python benchmarks/bench_snapshot.py --clientes 1000000
+"""
+import argparse
+import random
+import sys
+import time
+import timeit
+import tracemalloc
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from services.diretorio_clientes import DiretorioClientes
+
+PRIMEIROS_NOMES = [
+    "Ana", "Bruno", "Carla", "Daniel", "Eduarda", "Felipe", "Gabriela", "Hugo",
+    "Isabela", "Joao", "Karina", "Lucas", "Maria", "Nicolas", "Olivia", "Pedro",
+    "Rafaela", "Samuel", "Tatiana", "Vitor",
+]
+SOBRENOMES = [
+    "Silva", "Souza", "Oliveira", "Santos", "Lima", "Pereira", "Costa",
+    "Ferreira", "Almeida", "Ribeiro", "Carvalho", "Gomes", "Martins", "Rocha",
+]
+
+
+def gerar_linhas(quantidade: int):
+    inicio = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    aleatorio = random.Random(42)
+    for cliente_id in range(1, quantidade + 1):
+        nome = (
+            f"{aleatorio.choice(PRIMEIROS_NOMES)} {aleatorio.choice(SOBRENOMES)} "
+            f"{aleatorio.choice(SOBRENOMES)}"
+        )
+        yield (
+            cliente_id, nome, f"cliente{cliente_id}@email.com",
+            f"11{cliente_id:09d}", inicio + timedelta(seconds=cliente_id), None, 1
+        )
+
+
+def medir(chamada, repeticoes: int) -> float:
+    """Tempo por chamada, em microssegundos"""
+    segundos = min(timeit.repeat(chamada, number=repeticoes, repeat=3))
+    return segundos / repeticoes * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--clientes", type=int, default=1_000_000)
+    parser.add_argument("--repeticoes", type=int, default=20000)
+    parser.add_argument("--sem-memoria", action="store_true",
+                        help="nao mede a memoria (a medicao faz uma carga extra)")
+    args = parser.parse_args()
+
+    # A memoria e medida em uma carga separada: o tracemalloc deixa a
+    # alocacao varias vezes mais lenta e distorceria o tempo de carga
+    if not args.sem_memoria:
+        tracemalloc.start()
+        medido = DiretorioClientes()
+        medido.carregar_linhas(gerar_linhas(args.clientes), carga_completa=True)
+        memoria, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        del medido
+        por_milhao = memoria / args.clientes * 1_000_000 / 2**20
+        print(f"memoria: {memoria / 2**20:.1f} MiB ({por_milhao:.1f} MiB por 1M clientes)")
+
+    linhas = list(gerar_linhas(args.clientes))
+    diretorio = DiretorioClientes()
+    inicio = time.perf_counter()
+    diretorio.carregar_linhas(linhas, carga_completa=True)
+    carga = time.perf_counter() - inicio
+    del linhas
+    print(f"clientes: {len(diretorio)}  carga completa: {carga:.1f}s")
+
+    alvo = args.clientes // 2
+    poucas = max(1, args.repeticoes // 1000)
+    casos = [
+        ("buscar_por_id", lambda: diretorio.buscar_por_id(alvo), args.repeticoes),
+        ("buscar_por_email", lambda: diretorio.buscar_por_email(f"cliente{alvo}@email.com"),
+         args.repeticoes),
+        ("insercao incremental", None, args.repeticoes // 10),
+        ("buscar_por_nome", lambda: diretorio.buscar_por_nome("gabriela rocha"), poucas),
+        ("listar_todos", lambda: diretorio.listar(), poucas),
+    ]
+
+    proximo_id = args.clientes
+
+    def inserir():
+        nonlocal proximo_id
+        proximo_id += 1
+        diretorio.carregar_linhas([
+            (proximo_id, "Maria Silva Costa", f"novo{proximo_id}@email.com", None, None, None, 1)
+        ])
+
+    print(f"{'consulta':<22} {'us/chamada':>12}")
+    for nome, chamada, repeticoes in casos:
+        if chamada is None:
+            chamada = inserir
+        print(f"{nome:<22} {medir(chamada, repeticoes):>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
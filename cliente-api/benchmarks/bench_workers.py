@@ -0,0 +1,99 @@
+"""
+Benchmark de escalabilidade do modo multi-processo (gunicorn)
+
+Sobe o servidor com 1, 2, 4, ... ate N workers e mede as requisicoes por
+segundo atendidas em cada configuracao.
+
+Uso:
+    python benchmarks/bench_workers.py --max-workers 8 --path /clientes
+
+Para endpoints que acessam o banco, exporte DATABASE_URL (ou as variaveis
+DB_*) apontando para um banco ja migrado. O gerador de carga roda na mesma
+maquina; para resultados acima de poucos cores, use uma maquina separada.
+"""
+import argparse
+import os
+import signal
+import subprocess
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import httpx
+
+RAIZ = Path(__file__).resolve().parent.parent
+
+
+def _gerar_carga(url: str, duracao: float) -> int:
+    """Executa requisicoes sequenciais durante `duracao` segundos"""
+    total = 0
+    with httpx.Client() as cliente:
+        fim = time.perf_counter() + duracao
+        while time.perf_counter() < fim:
+            cliente.get(url).raise_for_status()
+            total += 1
+    return total
+
+
+def _aguardar_servidor(url: str, limite: float = 30.0):
+    fim = time.monotonic() + limite
+    while time.monotonic() < fim:
+        try:
+            httpx.get(url, timeout=1.0)
+            return
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    raise RuntimeError(f"Servidor nao respondeu em {limite}s")
+
+
+def medir(workers: int, porta: int, path: str, clientes: int, duracao: float) -> float:
+    """Sobe o gunicorn com `workers` processos e retorna requisicoes/s"""
+    env = {
+        **os.environ,
+        "WEB_CONCURRENCY": str(workers),
+        "BIND": f"127.0.0.1:{porta}",
+    }
+    servidor = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "main:app"],
+        cwd=RAIZ, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        base = f"http://127.0.0.1:{porta}"
+        _aguardar_servidor(base + "/")
+        with ProcessPoolExecutor(max_workers=clientes) as executor:
+            totais = list(executor.map(
+                _gerar_carga, [base + path] * clientes, [duracao] * clientes
+            ))
+        return sum(totais) / duracao
+    finally:
+        servidor.send_signal(signal.SIGTERM)
+        servidor.wait(timeout=60)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--max-workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--path", default="/")
+    parser.add_argument("--clientes", type=int, default=(os.cpu_count() or 1) * 2)
+    parser.add_argument("--duracao", type=float, default=10.0)
+    parser.add_argument("--porta", type=int, default=8765)
+    args = parser.parse_args()
+
+    contagens = []
+    n = 1
+    while n < args.max_workers:
+        contagens.append(n)
+        n *= 2
+    contagens.append(args.max_workers)
+
+    print(f"{'workers':>8} {'req/s':>10} {'speedup':>8}")
+    base = None
+    for workers in contagens:
+        rps = medir(workers, args.porta, args.path, args.clientes, args.duracao)
+        base = base or rps
+        print(f"{workers:>8} {rps:>10.0f} {rps / base:>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
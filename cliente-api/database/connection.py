@@ -2,7 +2,7 @@
 Configuracao da conexao com o banco de dados PostgreSQL
 """
 import os
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, text
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 
@@ -13,30 +13,148 @@ DB_HOST = os.getenv("DB_HOST", "localhost")
 DB_PORT = os.getenv("DB_PORT", "5432")
 DB_NAME = os.getenv("DB_NAME", "clientes_db")
 
-# URL de conexao com o PostgreSQL
-DATABASE_URL = f"postgresql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
-
-# Engine do SQLAlchemy
-engine = create_engine(
-    DATABASE_URL,
-    pool_pre_ping=True,
-    pool_size=10,
-    max_overflow=20
+# URL de conexao com o PostgreSQL (DATABASE_URL sobrescreve as variaveis acima)
+DATABASE_URL = os.getenv(
+    "DATABASE_URL",
+    f"postgresql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
 )
 
-# Session factory
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# Quantidade de conexoes abertas no startup para aquecer o pool (0 desativa)
+DB_POOL_WARM = int(os.getenv("DB_POOL_WARM", "0"))
+
+# Tamanho do pool por processo
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+
+# Orcamento global de conexoes dividido entre os workers (0 desativa o limite)
+DB_CONNECTION_BUDGET = int(os.getenv("DB_CONNECTION_BUDGET", "0"))
+
+# Execucoes de uma mesma consulta ate ela ser preparada no servidor
+# (apenas com o driver psycopg 3, ver criar_engine)
+DB_PREPARE_THRESHOLD = int(os.getenv("DB_PREPARE_THRESHOLD", "5"))
+
+# Quantidade de processos servindo a aplicacao (definida pelo gunicorn.conf.py)
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", "1"))
+
+# Jobs em segundo plano (services/job_service.py): cada processo com
+# JOBS_HABILITADOS abre uma engine de jobs com JOBS_MAX_WORKERS conexoes
+# por banco, descontadas do orcamento de conexoes do worker
+JOBS_MAX_WORKERS = int(os.getenv("JOBS_MAX_WORKERS", "2"))
+JOBS_HABILITADOS = os.getenv("JOBS_HABILITADOS", "1") == "1"
+DB_CONEXOES_JOBS = JOBS_MAX_WORKERS if JOBS_HABILITADOS else 0
+
+# Engine do SQLAlchemy, criada sob demanda por get_engine()
+_engine = None
+
+# Session factory (o bind e feito em get_db, apos a engine existir)
+SessionLocal = sessionmaker(autocommit=False, autoflush=False)
 
 # Base para os models
 Base = declarative_base()
 
 
+def calcular_pool(
+    orcamento: int,
+    workers: int,
+    pool_size: int = DB_POOL_SIZE,
+    max_overflow: int = DB_MAX_OVERFLOW,
+    reservadas: int = 0
+) -> tuple:
+    """
+    Calcula (pool_size, max_overflow) de cada worker
+
+    Com orcamento > 0, cada um dos `workers` processos recebe no maximo
+    orcamento // workers conexoes, para que o total nao ultrapasse o
+    max_connections do PostgreSQL. Dessas, `reservadas` ficam com a engine
+    de jobs e o restante vai para o pool das requisicoes (pool + overflow).
+    Sem orcamento, os valores configurados sao usados sem alteracao.
+
+    Um orcamento que nao deixa ao menos uma conexao de requisicao por
+    worker gera ValueError: o total ultrapassaria o limite configurado.
+    """
+    if orcamento <= 0:
+        return pool_size, max_overflow
+    por_worker = orcamento // max(1, workers) - reservadas
+    if por_worker < 1:
+        raise ValueError(
+            f"Orcamento de {orcamento} conexoes insuficiente para {workers} workers "
+            f"(cada um precisa de {reservadas} para jobs e ao menos 1 para requisicoes)"
+        )
+    pool = min(pool_size, por_worker)
+    overflow = min(max_overflow, por_worker - pool)
+    return pool, overflow
+
+
+def criar_engine(
+    url: str = DATABASE_URL,
+    pool_size: int = DB_POOL_SIZE,
+    max_overflow: int = DB_MAX_OVERFLOW
+):
+    """
+    Cria uma engine para a URL informada
+
+    O driver do banco (ex: psycopg2) so e importado aqui, fora do import
+    da aplicacao. Para SQLite o pool padrao do SQLAlchemy e mantido.
+
+    O psycopg2 nao suporta prepared statements no servidor. Com o driver
+    psycopg 3 (postgresql+psycopg://), consultas executadas ao menos
+    DB_PREPARE_THRESHOLD vezes em uma conexao passam a ser preparadas.
+    """
+    if url.startswith("sqlite"):
+        return create_engine(url, connect_args={"check_same_thread": False})
+    connect_args = {}
+    if url.startswith("postgresql+psycopg:"):
+        connect_args["prepare_threshold"] = DB_PREPARE_THRESHOLD
+    return create_engine(
+        url,
+        pool_pre_ping=True,
+        pool_size=pool_size,
+        max_overflow=max_overflow,
+        connect_args=connect_args
+    )
+
+
+def get_engine():
+    """Retorna a engine da aplicacao, criando-a no primeiro uso"""
+    global _engine
+    if _engine is None:
+        pool_size, max_overflow = calcular_pool(
+            DB_CONNECTION_BUDGET, WEB_CONCURRENCY, reservadas=DB_CONEXOES_JOBS
+        )
+        _engine = criar_engine(pool_size=pool_size, max_overflow=max_overflow)
+    return _engine
+
+
+def dispose_engine():
+    """Fecha as conexoes do pool e descarta a engine atual"""
+    global _engine
+    if _engine is not None:
+        _engine.dispose()
+        _engine = None
+
+
+def aquecer_pool(engine, quantidade: int = DB_POOL_WARM):
+    """
+    Abre `quantidade` conexoes simultaneas e devolve todas ao pool,
+    evitando que as primeiras requisicoes paguem o custo do handshake
+    """
+    conexoes = []
+    try:
+        for _ in range(quantidade):
+            conexao = engine.connect()
+            conexao.execute(text("SELECT 1"))
+            conexoes.append(conexao)
+    finally:
+        for conexao in conexoes:
+            conexao.close()
+
+
 def get_db():
     """
     Dependency para obter sessao do banco de dados
     Garante que a sessao sera fechada apos o uso
     """
-    db = SessionLocal()
+    db = SessionLocal(bind=get_engine())
     try:
         yield db
     finally:
@@ -45,7 +163,10 @@ def get_db():
 
 def init_db():
     """
-    Inicializa o banco de dados criando todas as tabelas
+    Verifica se o schema do banco esta na versao esperada pela aplicacao
+
+    A criacao e a evolucao das tabelas sao feitas pelas migracoes
+    (python migrate.py), executadas uma unica vez por deploy.
     """
-    from models.cliente import Cliente
-    Base.metadata.create_all(bind=engine)
+    from database.migrations import verificar_versao
+    verificar_versao(get_engine())
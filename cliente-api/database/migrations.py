@@ -0,0 +1,271 @@
+﻿"""
+Migracoes versionadas do schema do banco de dados
+
+Cada migracao e uma funcao que recebe uma conexao em transacao e aplica
+um passo do schema. As migracoes sao executadas uma unica vez por deploy
+(python migrate.py); no startup a aplicacao apenas le a versao gravada
+em `schema_version`, sem consultar o catalogo do banco.
+
+As migracoes descrevem o schema como ele era naquela versao, e nao a
+partir dos models atuais, para que o historico continue reproduzivel.
+"""
+from datetime import datetime, timezone
+
+from sqlalchemy import (
+    MetaData, Table, Column, ForeignKey, Index, Integer, String, Date, DateTime, Float,
+    JSON, select, func, insert, inspect, text
+)
+from sqlalchemy.exc import DBAPIError
+
+_metadata = MetaData()
+
+# Tabela de controle com uma linha por migracao aplicada
+schema_version = Table(
+    "schema_version",
+    _metadata,
+    Column("versao", Integer, primary_key=True, autoincrement=False),
+    Column("descricao", String(255), nullable=False),
+    Column("aplicada_em", DateTime(timezone=True), server_default=func.now()),
+)
+
+
+class SchemaDesatualizadoError(RuntimeError):
+    """O banco nao esta na versao de schema esperada pela aplicacao"""
+
+
+def _v1_criar_clientes(conexao):
+    """Cria a tabela clientes"""
+    metadata = MetaData()
+    Table(
+        "clientes",
+        metadata,
+        Column("id", Integer, primary_key=True, index=True, autoincrement=True),
+        Column("nome", String(255), nullable=False, index=True),
+        Column("email", String(255), nullable=False, unique=True, index=True),
+        Column("telefone", String(20), nullable=True),
+        Column("criado_em", DateTime(timezone=True), server_default=func.now()),
+        Column("atualizado_em", DateTime(timezone=True)),
+    )
+    metadata.create_all(conexao)
+
+
+def _v2_criar_estatisticas(conexao):
+    """Cria as tabelas de estatisticas e calcula os agregados existentes"""
+    from collections import Counter
+
+    # Regras de agregacao desta versao (copiadas aqui para nao depender
+    # do codigo atual de services/estatisticas_service.py)
+    def dia_utc(momento):
+        if momento is None:
+            return datetime.now(timezone.utc).date()
+        if momento.tzinfo is not None:
+            momento = momento.astimezone(timezone.utc)
+        return momento.date()
+
+    def dominio_do_email(email):
+        return email.rsplit("@", 1)[-1].strip().lower()
+
+    metadata = MetaData()
+    por_dia = Table(
+        "clientes_estatisticas_dia",
+        metadata,
+        Column("dia", Date, primary_key=True),
+        Column("total", Integer, nullable=False, default=0),
+    )
+    por_dominio = Table(
+        "clientes_estatisticas_dominio",
+        metadata,
+        Column("dominio", String(255), primary_key=True),
+        Column("total", Integer, nullable=False, default=0),
+    )
+    clientes = Table(
+        "clientes",
+        metadata,
+        Column("email", String(255)),
+        Column("criado_em", DateTime(timezone=True)),
+    )
+    metadata.create_all(conexao, tables=[por_dia, por_dominio])
+
+    dias, dominios = Counter(), Counter()
+    # Opcao no statement: na conexao ela valeria tambem para os INSERTs
+    # seguintes (cursor de servidor no PostgreSQL)
+    resultado = conexao.execute(
+        select(clientes.c.email, clientes.c.criado_em).execution_options(stream_results=True)
+    )
+    for email, criado_em in resultado:
+        dias[dia_utc(criado_em)] += 1
+        dominios[dominio_do_email(email)] += 1
+
+    if dias:
+        conexao.execute(
+            insert(por_dia),
+            [{"dia": dia, "total": total} for dia, total in dias.items()]
+        )
+    if dominios:
+        conexao.execute(
+            insert(por_dominio),
+            [{"dominio": dominio, "total": total} for dominio, total in dominios.items()]
+        )
+
+
+def _v3_criar_indice_clientes(conexao):
+    """Cria o indice global de emails usado com sharding"""
+    metadata = MetaData()
+    Table(
+        "clientes_indice",
+        metadata,
+        Column("id", Integer, primary_key=True, autoincrement=True),
+        Column("email", String(255), nullable=False, unique=True, index=True),
+    )
+    metadata.create_all(conexao)
+
+
+def _v4_criar_jobs(conexao):
+    """Cria a tabela de jobs em segundo plano"""
+    metadata = MetaData()
+    Table(
+        "jobs",
+        metadata,
+        Column("id", String(32), primary_key=True),
+        Column("tipo", String(50), nullable=False),
+        Column("status", String(20), nullable=False, index=True),
+        Column("payload", JSON, nullable=True),
+        Column("checkpoint", JSON, nullable=True),
+        Column("total", Integer, nullable=True),
+        Column("processados", Integer, nullable=False),
+        Column("erros", Integer, nullable=False),
+        Column("ultimos_erros", JSON, nullable=True),
+        Column("segundos_execucao", Float, nullable=False),
+        Column("dono", String(255), nullable=True),
+        Column("heartbeat_em", DateTime(timezone=True), nullable=True),
+        Column("criado_em", DateTime(timezone=True), server_default=func.now()),
+        Column("iniciado_em", DateTime(timezone=True), nullable=True),
+        Column("finalizado_em", DateTime(timezone=True), nullable=True),
+    )
+    metadata.create_all(conexao)
+
+
+def _v5_indices_timestamps_clientes(conexao):
+    """Indexa criado_em e atualizado_em para as leituras incrementais"""
+    metadata = MetaData()
+    clientes = Table(
+        "clientes",
+        metadata,
+        Column("criado_em", DateTime(timezone=True)),
+        Column("atualizado_em", DateTime(timezone=True)),
+    )
+    Index("ix_clientes_criado_em", clientes.c.criado_em).create(conexao)
+    Index("ix_clientes_atualizado_em", clientes.c.atualizado_em).create(conexao)
+
+
+def _v6_versao_clientes(conexao):
+    """Adiciona a coluna versao (controle de concorrencia otimista) em clientes"""
+    # Bancos criados a partir do model atual (create_all) ja tem a coluna
+    colunas = {coluna["name"] for coluna in inspect(conexao).get_columns("clientes")}
+    if "versao" not in colunas:
+        conexao.execute(
+            text("ALTER TABLE clientes ADD COLUMN versao INTEGER NOT NULL DEFAULT 1")
+        )
+
+
+def _v7_criar_lotes_jobs(conexao):
+    """Cria a tabela com as linhas de entrada dos jobs, gravadas em lotes"""
+    metadata = MetaData()
+    Table("jobs", metadata, Column("id", String(32), primary_key=True))
+    lotes = Table(
+        "jobs_lotes",
+        metadata,
+        Column(
+            "job_id", String(32), ForeignKey("jobs.id", ondelete="CASCADE"), primary_key=True
+        ),
+        Column("inicio", Integer, primary_key=True, autoincrement=False),
+        Column("linhas", JSON, nullable=False),
+    )
+    lotes.create(conexao)
+
+
+def _v8_criar_agregados_jobs(conexao):
+    """Cria a tabela com os agregados parciais dos jobs de recalculo"""
+    metadata = MetaData()
+    Table("jobs", metadata, Column("id", String(32), primary_key=True))
+    agregados = Table(
+        "jobs_agregados",
+        metadata,
+        Column("id", Integer, primary_key=True, autoincrement=True),
+        Column(
+            "job_id", String(32), ForeignKey("jobs.id", ondelete="CASCADE"),
+            nullable=False, index=True
+        ),
+        Column("grupo", String(20), nullable=False),
+        Column("chave", String(255), nullable=False),
+        Column("total", Integer, nullable=False),
+    )
+    agregados.create(conexao)
+
+
+# Lista ordenada de (versao, descricao, funcao)
+MIGRACOES = [
+    (1, "cria tabela clientes", _v1_criar_clientes),
+    (2, "cria tabelas de estatisticas de clientes", _v2_criar_estatisticas),
+    (3, "cria indice global de emails para sharding", _v3_criar_indice_clientes),
+    (4, "cria tabela de jobs em segundo plano", _v4_criar_jobs),
+    (5, "indexa criado_em e atualizado_em de clientes", _v5_indices_timestamps_clientes),
+    (6, "adiciona versao de clientes", _v6_versao_clientes),
+    (7, "cria tabela de lotes de entrada dos jobs", _v7_criar_lotes_jobs),
+    (8, "cria tabela de agregados parciais dos jobs", _v8_criar_agregados_jobs),
+]
+
+VERSAO_ATUAL = MIGRACOES[-1][0]
+
+
+def versao_do_banco(conexao) -> int:
+    """Retorna a maior versao aplicada (0 se nenhuma migracao foi aplicada)"""
+    versao = conexao.execute(select(func.max(schema_version.c.versao))).scalar()
+    return versao or 0
+
+
+def aplicar_migracoes(engine) -> list:
+    """
+    Aplica as migracoes pendentes, cada uma em sua propria transacao
+
+    Retorna a lista de versoes aplicadas nesta execucao.
+    """
+    with engine.begin() as conexao:
+        _metadata.create_all(conexao)
+        atual = versao_do_banco(conexao)
+
+    aplicadas = []
+    for versao, descricao, migracao in MIGRACOES:
+        if versao <= atual:
+            continue
+        with engine.begin() as conexao:
+            migracao(conexao)
+            conexao.execute(
+                insert(schema_version).values(versao=versao, descricao=descricao)
+            )
+        aplicadas.append(versao)
+    return aplicadas
+
+
+def verificar_versao(engine) -> int:
+    """
+    Confere se o banco esta pelo menos na versao esperada pela aplicacao
+
+    Executa uma unica consulta em `schema_version`. Versoes mais novas que
+    VERSAO_ATUAL sao aceitas para permitir deploys graduais.
+    """
+    try:
+        with engine.connect() as conexao:
+            versao = versao_do_banco(conexao)
+    except DBAPIError as e:
+        raise SchemaDesatualizadoError(
+            "Nao foi possivel ler a versao do schema. "
+            "Execute 'python migrate.py' antes de iniciar a aplicacao"
+        ) from e
+
+    if versao < VERSAO_ATUAL:
+        raise SchemaDesatualizadoError(
+            f"Schema na versao {versao}, esperado {VERSAO_ATUAL}. "
+            "Execute 'python migrate.py' antes de iniciar a aplicacao"
+        )
+    return versao
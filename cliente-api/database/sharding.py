@@ -0,0 +1,124 @@
+﻿"""
+Roteamento de clientes entre multiplos bancos (shards)
+
+Com DB_SHARDS configurado, a tabela clientes e distribuida entre os bancos
+listados, por hash do id. O banco principal (DATABASE_URL) passa a atuar
+como coordenador: guarda o indice global de emails (clientes_indice), que
+gera os ids e garante a unicidade do email entre todos os shards, alem das
+estatisticas e do controle de versao do schema.
+
+Exemplo:
+    DB_SHARDS=postgresql://.../clientes_0,postgresql://.../clientes_1
+"""
+import hashlib
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Optional
+
+from sqlalchemy.orm import Session, sessionmaker
+
+from database.connection import (
+    criar_engine, calcular_pool, DB_CONNECTION_BUDGET, DB_CONEXOES_JOBS, WEB_CONCURRENCY
+)
+
+# URLs dos shards, separadas por virgula (vazio desativa o sharding)
+DB_SHARDS = [url.strip() for url in os.getenv("DB_SHARDS", "").split(",") if url.strip()]
+
+_router = None
+
+
+def shard_do_id(cliente_id: int, quantidade: int) -> int:
+    """
+    Retorna o indice do shard de um cliente
+
+    Usa um hash estavel do id (independente do processo), de forma que
+    todos os workers concordem sobre a localizacao de cada cliente. Alterar
+    a quantidade de shards exige redistribuir os dados.
+    """
+    digest = hashlib.blake2b(int(cliente_id).to_bytes(8, "big", signed=True), digest_size=8)
+    return int.from_bytes(digest.digest(), "big") % quantidade
+
+
+class ShardRouter:
+    """
+    Mapa de shards: uma engine e um pool de conexoes por banco
+
+    Sem `pool_size`, os pools seguem o orcamento de conexoes das
+    requisicoes (calcular_pool); o JobRunner cria o seu proprio roteador,
+    com pools do tamanho do seu pool de threads.
+    """
+
+    def __init__(self, urls: List[str], pool_size: Optional[int] = None, max_overflow: int = 0):
+        if not urls:
+            raise ValueError("Informe ao menos um shard")
+        if pool_size is None:
+            pool_size, max_overflow = calcular_pool(
+                DB_CONNECTION_BUDGET, WEB_CONCURRENCY, reservadas=DB_CONEXOES_JOBS
+            )
+        self.urls = list(urls)
+        self.engines = [
+            criar_engine(url, pool_size=pool_size, max_overflow=max_overflow)
+            for url in self.urls
+        ]
+        self._sessoes = [
+            sessionmaker(autocommit=False, autoflush=False, bind=engine)
+            for engine in self.engines
+        ]
+        # Uma thread por conexao de cada shard: consultas de requisicoes
+        # concorrentes rodam em paralelo ate o limite dos pools
+        self._executor = ThreadPoolExecutor(
+            max_workers=(pool_size + max_overflow) * len(self.urls),
+            thread_name_prefix="shard"
+        )
+
+    @property
+    def quantidade(self) -> int:
+        return len(self.urls)
+
+    def shard_do_id(self, cliente_id: int) -> int:
+        """Indice do shard que guarda o cliente"""
+        return shard_do_id(cliente_id, self.quantidade)
+
+    def sessao(self, indice: int) -> Session:
+        """Abre uma sessao no shard informado (o chamador deve fechar)"""
+        return self._sessoes[indice]()
+
+    def executar_em_todos(self, funcao: Callable[[Session], list]) -> list:
+        """
+        Executa `funcao(sessao)` em todos os shards em paralelo (scatter-gather)
+
+        Retorna a lista de resultados na ordem dos shards. Cada chamada usa
+        sua propria sessao, fechada ao final. O pool de threads e
+        compartilhado pelas requisicoes e tem uma thread por conexao dos
+        pools dos shards.
+        """
+        def executar(indice):
+            db = self.sessao(indice)
+            try:
+                return funcao(db)
+            finally:
+                db.close()
+
+        return list(self._executor.map(executar, range(self.quantidade)))
+
+    def dispose(self):
+        """Fecha os pools de todos os shards"""
+        self._executor.shutdown(wait=True)
+        for engine in self.engines:
+            engine.dispose()
+
+
+def get_shard_router():
+    """Retorna o roteador de shards, ou None se DB_SHARDS nao estiver configurado"""
+    global _router
+    if _router is None and DB_SHARDS:
+        _router = ShardRouter(DB_SHARDS)
+    return _router
+
+
+def dispose_shards():
+    """Fecha as conexoes de todos os shards e descarta o roteador"""
+    global _router
+    if _router is not None:
+        _router.dispose()
+        _router = None
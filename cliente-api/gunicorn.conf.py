@@ -0,0 +1,47 @@
+"""
+Configuracao do gunicorn para execucao em producao
+
+Sobe WEB_CONCURRENCY processos (padrao: um por CPU disponivel), cada um
+com seu proprio event loop uvicorn, engine e pool de conexoes. O pool de
+cada worker e dimensionado em database/connection.py a partir de
+DB_CONNECTION_BUDGET / WEB_CONCURRENCY.
+
+Uso:
+    gunicorn -c gunicorn.conf.py main:app
+"""
+import os
+
+
+def _cpus_disponiveis() -> int:
+    """CPUs que o processo pode usar (respeita cpuset/affinity do container)"""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+bind = os.getenv("BIND", "0.0.0.0:8000")
+workers = int(os.getenv("WEB_CONCURRENCY", _cpus_disponiveis()))
+worker_class = "uvicorn.workers.UvicornWorker"
+
+# Os workers herdam o ambiente do master: assim cada um sabe em quantos
+# processos o orcamento de conexoes deve ser dividido
+os.environ["WEB_CONCURRENCY"] = str(workers)
+
+# Reciclagem: cada worker e substituido apos ~MAX_REQUESTS requisicoes
+# (o jitter evita que todos reiniciem ao mesmo tempo)
+max_requests = int(os.getenv("MAX_REQUESTS", "10000"))
+max_requests_jitter = int(os.getenv("MAX_REQUESTS_JITTER", "1000"))
+
+# Drain: em SIGTERM/SIGHUP os workers param de aceitar conexoes e tem ate
+# GRACEFUL_TIMEOUT segundos para concluir as requisicoes em andamento
+graceful_timeout = int(os.getenv("GRACEFUL_TIMEOUT", "30"))
+timeout = int(os.getenv("WORKER_TIMEOUT", "60"))
+keepalive = int(os.getenv("KEEPALIVE", "5"))
+
+# A aplicacao e importada em cada worker (apos o fork), para que nenhuma
+# conexao do pool seja compartilhada entre processos
+preload_app = False
+
+accesslog = os.getenv("ACCESS_LOG", None)
+errorlog = "-"
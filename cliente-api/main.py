@@ -2,29 +2,92 @@
 Sistema de Cadastro de Clientes - API REST
 Desenvolvido com FastAPI e PostgreSQL
 """
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, HTTPException, Depends, Query
 from sqlalchemy.orm import Session
 from typing import List, Optional
-import uvicorn
 
 from models.cliente import Cliente
-from schemas.cliente_schema import ClienteCreate, ClienteResponse
-from database.connection import get_db, init_db
-from services.cliente_service import ClienteService
+from schemas.cliente_schema import (
+    ClienteCreate, ClienteResponse, ClienteUpdate, ClienteUpdateLoteRequest
+)
+from schemas.estatisticas_schema import EstatisticasResponse
+from schemas.job_schema import ImportacaoClientesRequest, JobResponse
+from database.connection import (
+    get_db, init_db, get_engine, dispose_engine, aquecer_pool, DB_POOL_WARM,
+    SessionLocal
+)
+from database.sharding import get_shard_router, dispose_shards
+from database.migrations import verificar_versao
+from services.cliente_service import ClienteService, ConflitoVersaoError
+from services.cliente_sharded_service import criar_cliente_service
+from services.diretorio_clientes import (
+    ClienteSnapshotService, get_diretorio, iniciar_diretorio, parar_diretorio
+)
+from services.estatisticas_service import EstatisticasService
+from services.job_service import (
+    JobService, JobFechadoError, get_job_runner, iniciar_job_runner, parar_job_runner
+)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Ciclo de vida da aplicacao
+
+    No startup a engine e criada, a versao do schema e conferida (uma
+    unica consulta) e o pool e opcionalmente aquecido. As tabelas nao sao
+    criadas aqui: use `python migrate.py` antes de subir os workers.
+    Com DB_SHARDS configurado, a verificacao e feita em cada shard.
+    Com SNAPSHOT_HABILITADO, o diretorio de clientes em memoria e
+    carregado antes de o worker aceitar requisicoes.
+    """
+    init_db()
+    engines = [get_engine()]
+    router = get_shard_router()
+    if router is not None:
+        for engine in router.engines:
+            verificar_versao(engine)
+        engines += router.engines
+    if DB_POOL_WARM > 0:
+        for engine in engines:
+            aquecer_pool(engine, DB_POOL_WARM)
+    if router is None:
+        fontes = {"principal": lambda: SessionLocal(bind=get_engine())}
+    else:
+        fontes = {
+            f"shard {i}": (lambda i=i: router.sessao(i))
+            for i in range(router.quantidade)
+        }
+    iniciar_diretorio(fontes)
+    iniciar_job_runner()
+    yield
+    parar_job_runner()
+    parar_diretorio()
+    dispose_shards()
+    dispose_engine()
+
+
+def get_cliente_service(db: Session = Depends(get_db)) -> ClienteService:
+    """
+    Dependency que retorna o service de clientes (com sharding, se
+    configurado), servindo as leituras do diretorio em memoria quando ativo
+    """
+    service = criar_cliente_service(db)
+    diretorio = get_diretorio()
+    if diretorio is not None:
+        return ClienteSnapshotService(service, diretorio)
+    return service
+
 
 app = FastAPI(
     title="Sistema de Cadastro de Clientes",
     description="API para gerenciamento de clientes",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 
-@app.on_event("startup")
-def startup_event():
-    """Inicializa o banco de dados ao iniciar a aplicacao"""
-    init_db()
-
-
 @app.get("/")
 def root():
     """Endpoint raiz - health check"""
@@ -37,7 +100,7 @@ def root():
 @app.post("/clientes", response_model=ClienteResponse, status_code=201)
 def criar_cliente(
     cliente: ClienteCreate,
-    db: Session = Depends(get_db)
+    service: ClienteService = Depends(get_cliente_service)
 ):
     """
     Cadastra um novo cliente no sistema
@@ -46,8 +109,6 @@ def criar_cliente(
     - **email**: Email valido (obrigatorio)
     - **telefone**: Telefone de contato (opcional)
     """
-    service = ClienteService(db)
-    
     try:
         novo_cliente = service.criar_cliente(cliente)
         return novo_cliente
@@ -60,15 +121,13 @@ def criar_cliente(
 @app.get("/clientes", response_model=List[ClienteResponse])
 def listar_clientes(
     nome: Optional[str] = Query(None, description="Filtrar clientes por nome"),
-    db: Session = Depends(get_db)
+    service: ClienteService = Depends(get_cliente_service)
 ):
     """
     Lista todos os clientes cadastrados
     
     - **nome**: Parametro opcional para buscar clientes por nome (busca parcial)
     """
-    service = ClienteService(db)
-    
     if nome:
         clientes = service.buscar_por_nome(nome)
     else:
@@ -77,17 +136,61 @@ def listar_clientes(
     return clientes
 
 
+@app.patch("/clientes", response_model=List[ClienteResponse])
+def atualizar_clientes_em_lote(
+    lote: ClienteUpdateLoteRequest,
+    service: ClienteService = Depends(get_cliente_service)
+):
+    """
+    Atualiza varios clientes de uma vez (tudo ou nada)
+
+    - **clientes**: lista de itens com **id**, **versao** e os campos a alterar
+
+    Se algum cliente nao existir ou tiver sido alterado desde a versao
+    informada, nenhuma alteracao e gravada e a resposta e 409 com a lista
+    de conflitos.
+    """
+    try:
+        return service.atualizar_em_lote(lote.clientes)
+    except ConflitoVersaoError as e:
+        raise HTTPException(
+            status_code=409, detail={"mensagem": str(e), "conflitos": e.conflitos}
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@app.get("/clientes/stats", response_model=EstatisticasResponse)
+def estatisticas_clientes(
+    dias: int = Query(30, ge=1, le=366, description="Quantidade de dias em por_dia"),
+    semanas: int = Query(12, ge=1, le=104, description="Quantidade de semanas em por_semana"),
+    dominios: int = Query(20, ge=1, le=1000, description="Quantidade de dominios em por_dominio"),
+    db: Session = Depends(get_db)
+):
+    """
+    Estatisticas de cadastro de clientes
+
+    Servidas a partir de agregados mantidos a cada cadastro, com ate
+    STATS_CACHE_TTL segundos de atraso.
+
+    - **total**: total de clientes cadastrados
+    - **por_dia** / **por_semana**: cadastros por dia e por semana (UTC)
+    - **por_dominio**: dominios de email com mais cadastros
+    """
+    service = EstatisticasService(db)
+    return service.obter_estatisticas(dias, semanas, dominios)
+
+
 @app.get("/clientes/{id}", response_model=ClienteResponse)
 def consultar_cliente(
     id: int,
-    db: Session = Depends(get_db)
+    service: ClienteService = Depends(get_cliente_service)
 ):
     """
     Consulta um cliente especifico pelo ID
     
     - **id**: ID do cliente a ser consultado
     """
-    service = ClienteService(db)
     cliente = service.buscar_por_id(id)
     
     if not cliente:
@@ -96,5 +199,118 @@ def consultar_cliente(
     return cliente
 
 
+@app.patch("/clientes/{id}", response_model=ClienteResponse)
+def atualizar_cliente(
+    id: int,
+    dados: ClienteUpdate,
+    service: ClienteService = Depends(get_cliente_service)
+):
+    """
+    Atualiza parcialmente um cliente
+
+    - **versao**: versao do cliente retornada na ultima leitura (obrigatorio)
+    - **nome** / **email** / **telefone**: apenas os campos enviados sao alterados
+
+    Retorna 409 se o cliente foi alterado por outra requisicao desde a
+    versao informada.
+    """
+    try:
+        cliente = service.atualizar_cliente(id, dados)
+    except ConflitoVersaoError as e:
+        raise HTTPException(
+            status_code=409, detail={"mensagem": str(e), "conflitos": e.conflitos}
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    if not cliente:
+        raise HTTPException(status_code=404, detail=f"Cliente com ID {id} nao encontrado")
+
+    return cliente
+
+
+def _enfileirar_job(db: Session, tipo: str, payload: Optional[dict] = None,
+                    total: Optional[int] = None, linhas: Optional[list] = None):
+    """Registra o job e agenda sua execucao"""
+    job = JobService(db).criar_job(tipo, payload, total, linhas)
+    _agendar_job(job)
+    return job
+
+
+def _agendar_job(job):
+    """Agenda a execucao do job no runner deste processo, se houver"""
+    runner = get_job_runner()
+    if runner is not None:
+        runner.submeter(job.id)
+
+
+@app.post("/jobs/importacao-clientes", response_model=JobResponse, status_code=202)
+def importar_clientes(
+    importacao: ImportacaoClientesRequest,
+    db: Session = Depends(get_db)
+):
+    """
+    Agenda a importacao de uma lista de clientes em segundo plano
+
+    Retorna imediatamente o job criado; acompanhe o progresso em
+    GET /jobs/{id}. Cada cliente e validado como no POST /clientes.
+
+    Cada requisicao aceita ate MAX_CLIENTES_POR_REQUISICAO clientes. Para
+    importacoes maiores, envie `finalizar=false` e as demais partes em
+    POST /jobs/{id}/lotes.
+    """
+    if importacao.finalizar:
+        return _enfileirar_job(db, "importacao_clientes", linhas=importacao.clientes)
+    return JobService(db).criar_job("importacao_clientes", linhas=importacao.clientes, aberto=True)
+
+
+@app.post("/jobs/{id}/lotes", response_model=JobResponse, status_code=202)
+def adicionar_lote_importacao(
+    id: str,
+    lote: ImportacaoClientesRequest,
+    db: Session = Depends(get_db)
+):
+    """
+    Acrescenta uma parte a uma importacao aberta (`finalizar=false`)
+
+    A parte com `finalizar=true` (padrao) agenda a execucao do job. Um job
+    ja finalizado retorna 409.
+    """
+    try:
+        job = JobService(db).adicionar_linhas(id, lote.clientes, lote.finalizar)
+    except JobFechadoError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    if not job:
+        raise HTTPException(status_code=404, detail=f"Job com ID {id} nao encontrado")
+    if lote.finalizar:
+        _agendar_job(job)
+    return job
+
+
+@app.post("/jobs/recalculo-estatisticas", response_model=JobResponse, status_code=202)
+def recalcular_estatisticas(db: Session = Depends(get_db)):
+    """Agenda o recalculo (backfill) das estatisticas de clientes"""
+    return _enfileirar_job(db, "recalculo_estatisticas")
+
+
+@app.get("/jobs/{id}", response_model=JobResponse)
+def consultar_job(
+    id: str,
+    db: Session = Depends(get_db)
+):
+    """
+    Consulta o progresso de um job
+
+    - **processados** / **total**: linhas processadas
+    - **linhas_por_segundo**: vazao media durante a execucao
+    - **erros** / **ultimos_erros**: quantidade e mensagens dos erros mais recentes
+    """
+    job = JobService(db).buscar_por_id(id)
+    if not job:
+        raise HTTPException(status_code=404, detail=f"Job com ID {id} nao encontrado")
+    return job
+
+
 if __name__ == "__main__":
+    import uvicorn
     uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
@@ -0,0 +1,57 @@
+﻿"""
+Aplica as migracoes pendentes do schema do banco de dados
+
+Com DB_SHARDS configurado, as migracoes sao aplicadas no banco principal
+(coordenador) e em cada shard.
+
+Uso:
+    python migrate.py            # aplica as migracoes pendentes
+    python migrate.py --status   # mostra a versao atual do banco
+"""
+import sys
+
+from sqlalchemy.exc import DBAPIError
+
+from database.connection import get_engine, dispose_engine
+from database.sharding import get_shard_router, dispose_shards
+from database.migrations import aplicar_migracoes, versao_do_banco, VERSAO_ATUAL
+
+
+def _bancos():
+    """Lista (nome, engine) de todos os bancos a migrar"""
+    bancos = [("principal", get_engine())]
+    router = get_shard_router()
+    if router is not None:
+        bancos += [(f"shard {i}", engine) for i, engine in enumerate(router.engines)]
+    return bancos
+
+
+def main(argv=None) -> int:
+    argv = sys.argv[1:] if argv is None else argv
+    codigo = 0
+    try:
+        for nome, engine in _bancos():
+            if "--status" in argv:
+                try:
+                    with engine.connect() as conexao:
+                        versao = versao_do_banco(conexao)
+                except DBAPIError:
+                    versao = 0
+                print(f"[{nome}] Schema na versao {versao} (aplicacao espera {VERSAO_ATUAL})")
+                if versao < VERSAO_ATUAL:
+                    codigo = 1
+                continue
+
+            aplicadas = aplicar_migracoes(engine)
+            if aplicadas:
+                print(f"[{nome}] Migracoes aplicadas: {', '.join(map(str, aplicadas))}")
+            else:
+                print(f"[{nome}] Schema ja esta na versao {VERSAO_ATUAL}")
+        return codigo
+    finally:
+        dispose_shards()
+        dispose_engine()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
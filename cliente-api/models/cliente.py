@@ -18,6 +18,8 @@ class Cliente(Base):
     telefone = Column(String(20), nullable=True)
     criado_em = Column(DateTime(timezone=True), server_default=func.now())
     atualizado_em = Column(DateTime(timezone=True), onupdate=func.now())
+    # Incrementada a cada atualizacao (controle de concorrencia otimista)
+    versao = Column(Integer, nullable=False, default=1, server_default="1")
 
     def __repr__(self):
         return f"<Cliente(id={self.id}, nome='{self.nome}', email='{self.email}')>"
@@ -0,0 +1,19 @@
+﻿"""
+Model ClienteIndice - Indice global de emails usado com sharding
+"""
+from sqlalchemy import Column, Integer, String
+from database.connection import Base
+
+
+class ClienteIndice(Base):
+    """
+    Indice global (no banco coordenador) que gera o id de cada cliente e
+    garante a unicidade do email entre todos os shards
+    """
+    __tablename__ = "clientes_indice"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    email = Column(String(255), nullable=False, unique=True, index=True)
+
+    def __repr__(self):
+        return f"<ClienteIndice(id={self.id}, email='{self.email}')>"
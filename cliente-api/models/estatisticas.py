@@ -0,0 +1,31 @@
+﻿"""
+Models de estatisticas pre-agregadas de clientes
+"""
+from sqlalchemy import Column, Integer, String, Date
+from database.connection import Base
+
+
+class ClienteEstatisticaDia(Base):
+    """
+    Quantidade de cadastros por dia (UTC), incrementada a cada novo cliente
+    """
+    __tablename__ = "clientes_estatisticas_dia"
+
+    dia = Column(Date, primary_key=True)
+    total = Column(Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f"<ClienteEstatisticaDia(dia={self.dia}, total={self.total})>"
+
+
+class ClienteEstatisticaDominio(Base):
+    """
+    Quantidade de cadastros por dominio de email, incrementada a cada novo cliente
+    """
+    __tablename__ = "clientes_estatisticas_dominio"
+
+    dominio = Column(String(255), primary_key=True)
+    total = Column(Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f"<ClienteEstatisticaDominio(dominio='{self.dominio}', total={self.total})>"
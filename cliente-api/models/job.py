@@ -0,0 +1,82 @@
+﻿"""
+Model Job - Tarefas de longa duracao executadas em segundo plano
+"""
+from sqlalchemy import Column, ForeignKey, Integer, String, DateTime, Float, JSON
+from sqlalchemy.sql import func
+from database.connection import Base
+
+
+class Job(Base):
+    """
+    Model que representa um job (importacao, backfill) e seu progresso
+
+    `checkpoint` guarda o ponto de retomada gravado ao final de cada lote;
+    `dono` e `heartbeat_em` formam o lease que impede que dois workers
+    executem o mesmo job ao mesmo tempo.
+    """
+    __tablename__ = "jobs"
+
+    id = Column(String(32), primary_key=True)
+    tipo = Column(String(50), nullable=False)
+    status = Column(String(20), nullable=False, default="pendente", index=True)
+    payload = Column(JSON, nullable=True)
+    checkpoint = Column(JSON, nullable=True)
+    total = Column(Integer, nullable=True)
+    processados = Column(Integer, nullable=False, default=0)
+    erros = Column(Integer, nullable=False, default=0)
+    ultimos_erros = Column(JSON, nullable=True)
+    segundos_execucao = Column(Float, nullable=False, default=0.0)
+    dono = Column(String(255), nullable=True)
+    heartbeat_em = Column(DateTime(timezone=True), nullable=True)
+    criado_em = Column(DateTime(timezone=True), server_default=func.now())
+    iniciado_em = Column(DateTime(timezone=True), nullable=True)
+    finalizado_em = Column(DateTime(timezone=True), nullable=True)
+
+    @property
+    def linhas_por_segundo(self) -> float:
+        """Vazao media do job, considerando apenas o tempo em execucao"""
+        if not self.segundos_execucao:
+            return 0.0
+        return round(self.processados / self.segundos_execucao, 2)
+
+    def __repr__(self):
+        return f"<Job(id='{self.id}', tipo='{self.tipo}', status='{self.status}')>"
+
+
+class JobLote(Base):
+    """
+    Lote de linhas de entrada de um job (ex: clientes de uma importacao)
+
+    A entrada e gravada em lotes de JOBS_LOTE linhas, e nao no payload do
+    job, para que o runner carregue um lote por vez. `inicio` e o numero
+    da primeira linha do lote.
+    """
+    __tablename__ = "jobs_lotes"
+
+    job_id = Column(String(32), ForeignKey("jobs.id", ondelete="CASCADE"), primary_key=True)
+    inicio = Column(Integer, primary_key=True, autoincrement=False)
+    linhas = Column(JSON, nullable=False)
+
+    def __repr__(self):
+        return f"<JobLote(job_id='{self.job_id}', inicio={self.inicio})>"
+
+
+class JobAgregado(Base):
+    """
+    Contagem parcial de um job de recalculo (ex: clientes por dominio)
+
+    Cada lote processado grava apenas as contagens das suas linhas; o total
+    de uma chave e a soma das suas linhas na tabela.
+    """
+    __tablename__ = "jobs_agregados"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    job_id = Column(
+        String(32), ForeignKey("jobs.id", ondelete="CASCADE"), nullable=False, index=True
+    )
+    grupo = Column(String(20), nullable=False)
+    chave = Column(String(255), nullable=False)
+    total = Column(Integer, nullable=False)
+
+    def __repr__(self):
+        return f"<JobAgregado(job_id='{self.job_id}', grupo='{self.grupo}', chave='{self.chave}')>"
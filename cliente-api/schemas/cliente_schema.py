@@ -1,8 +1,8 @@
 ﻿"""
 Schemas Pydantic para validacao e serializacao de dados
 """
-from pydantic import BaseModel, EmailStr, Field, field_validator
-from typing import Optional
+from pydantic import BaseModel, EmailStr, Field, field_validator, model_validator
+from typing import List, Optional
 from datetime import datetime
 
 
@@ -31,6 +31,78 @@ class ClienteCreate(BaseModel):
         return v
 
 
+class ClienteUpdate(BaseModel):
+    """
+    Schema para atualizacao parcial de cliente
+
+    Apenas os campos enviados sao alterados. `versao` e a versao lida do
+    cliente: se ele tiver sido alterado desde entao, a atualizacao e
+    recusada com 409.
+    """
+    nome: Optional[str] = Field(None, min_length=1, max_length=255, description="Nome do cliente")
+    email: Optional[EmailStr] = Field(None, description="Email valido do cliente")
+    telefone: Optional[str] = Field(None, max_length=20, description="Telefone do cliente")
+    versao: int = Field(..., ge=1, description="Versao do cliente lida antes da alteracao")
+
+    @field_validator('nome')
+    @classmethod
+    def validar_nome(cls, v: Optional[str]) -> str:
+        """Valida se o nome nao e vazio (nem nulo) apos remover espacos"""
+        if not v or not v.strip():
+            raise ValueError('Nome nao pode ser vazio')
+        return v.strip()
+
+    @field_validator('email')
+    @classmethod
+    def validar_email(cls, v: Optional[str]) -> str:
+        """O email pode ser alterado, mas nao removido"""
+        if v is None:
+            raise ValueError('Email nao pode ser vazio')
+        return v
+
+    @field_validator('telefone')
+    @classmethod
+    def validar_telefone(cls, v: Optional[str]) -> Optional[str]:
+        """Valida e formata o telefone (nulo remove o telefone)"""
+        if v:
+            v = v.strip()
+            if not v:
+                return None
+        return v
+
+    @model_validator(mode='after')
+    def validar_campos(self):
+        """Exige ao menos um campo alem da versao"""
+        if not self.campos_alterados():
+            raise ValueError('Informe ao menos um campo para atualizar')
+        return self
+
+    def campos_alterados(self) -> dict:
+        """Campos enviados na requisicao, exceto id e versao"""
+        return self.model_dump(include=self.model_fields_set - {"id", "versao"})
+
+
+class ClienteUpdateLote(ClienteUpdate):
+    """Item de uma atualizacao em lote"""
+    id: int = Field(..., description="ID do cliente a ser atualizado")
+
+
+class ClienteUpdateLoteRequest(BaseModel):
+    """Schema para atualizacao em lote (tudo ou nada)"""
+    clientes: List[ClienteUpdateLote] = Field(
+        ..., min_length=1, max_length=1000, description="Atualizacoes a aplicar"
+    )
+
+    @field_validator('clientes')
+    @classmethod
+    def validar_ids_unicos(cls, v: List[ClienteUpdateLote]) -> List[ClienteUpdateLote]:
+        """Cada cliente pode aparecer uma unica vez no lote"""
+        ids = [item.id for item in v]
+        if len(set(ids)) != len(ids):
+            raise ValueError('Cada cliente deve aparecer uma unica vez no lote')
+        return v
+
+
 class ClienteResponse(BaseModel):
     """Schema para resposta de cliente"""
     id: int
@@ -39,5 +111,6 @@ class ClienteResponse(BaseModel):
     telefone: Optional[str]
     criado_em: datetime
     atualizado_em: Optional[datetime]
+    versao: int = 1
 
     model_config = {"from_attributes": True}
@@ -0,0 +1,33 @@
+﻿"""
+Schemas Pydantic para as estatisticas de clientes
+"""
+from pydantic import BaseModel
+from typing import List
+from datetime import date, datetime
+
+
+class CadastrosPorDia(BaseModel):
+    """Cadastros em um dia (UTC)"""
+    dia: date
+    total: int
+
+
+class CadastrosPorSemana(BaseModel):
+    """Cadastros em uma semana, identificada pela segunda-feira"""
+    semana: date
+    total: int
+
+
+class CadastrosPorDominio(BaseModel):
+    """Cadastros por dominio de email"""
+    dominio: str
+    total: int
+
+
+class EstatisticasResponse(BaseModel):
+    """Schema para resposta de estatisticas de clientes"""
+    total: int
+    por_dia: List[CadastrosPorDia]
+    por_semana: List[CadastrosPorSemana]
+    por_dominio: List[CadastrosPorDominio]
+    gerado_em: datetime
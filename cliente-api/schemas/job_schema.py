@@ -0,0 +1,48 @@
+﻿"""
+Schemas Pydantic para os jobs em segundo plano
+"""
+from pydantic import BaseModel, Field, field_validator
+from typing import Any, Dict, List, Optional
+from datetime import datetime
+
+# Clientes por requisicao; importacoes maiores sao enviadas em partes
+MAX_CLIENTES_POR_REQUISICAO = 10000
+
+
+class ImportacaoClientesRequest(BaseModel):
+    """
+    Schema para submissao de uma importacao de clientes (ou de uma parte)
+
+    Cada item e validado com ClienteCreate durante a execucao do job; itens
+    invalidos sao contabilizados como erro sem interromper a importacao.
+    Com `finalizar=false` o job fica aberto, recebendo as proximas partes
+    em POST /jobs/{id}/lotes, e so e executado quando uma parte o finaliza.
+    """
+    clientes: List[Dict[str, Any]] = Field(
+        ..., min_length=1, max_length=MAX_CLIENTES_POR_REQUISICAO,
+        description="Clientes a importar"
+    )
+    finalizar: bool = Field(True, description="Ultima parte da importacao")
+
+
+class JobResponse(BaseModel):
+    """Schema para resposta de job"""
+    id: str
+    tipo: str
+    status: str
+    total: Optional[int]
+    processados: int
+    erros: int
+    linhas_por_segundo: float
+    ultimos_erros: List[str] = []
+    criado_em: Optional[datetime]
+    iniciado_em: Optional[datetime]
+    finalizado_em: Optional[datetime]
+
+    model_config = {"from_attributes": True}
+
+    @field_validator('ultimos_erros', mode='before')
+    @classmethod
+    def validar_ultimos_erros(cls, v: Optional[List[str]]) -> List[str]:
+        """Jobs sem erros sao retornados com lista vazia"""
+        return v or []
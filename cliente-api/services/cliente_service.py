@@ -1,12 +1,164 @@
 ﻿"""
 Service Layer - Logica de negocio para operacoes com Cliente
 """
+from functools import lru_cache
+from operator import attrgetter
+from sqlalchemy import select, update, bindparam, func, values, column, Integer
 from sqlalchemy.orm import Session
 from sqlalchemy.exc import IntegrityError
-from typing import List, Optional
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
 
 from models.cliente import Cliente
-from schemas.cliente_schema import ClienteCreate
+from schemas.cliente_schema import ClienteCreate, ClienteUpdate, ClienteUpdateLote
+from services.estatisticas_service import EstatisticasService
+
+# Consultas frequentes construidas uma unica vez, no import do modulo. Os
+# valores sao passados como bind params na execucao, de forma que a chave
+# de cache e o SQL compilado sao reaproveitados a cada chamada.
+SELECT_TODOS = select(Cliente).order_by(Cliente.nome)
+SELECT_POR_ID = select(Cliente).where(Cliente.id == bindparam("cliente_id"))
+SELECT_POR_EMAIL = select(Cliente).where(Cliente.email == bindparam("email")).limit(1)
+SELECT_POR_NOME = (
+    select(Cliente)
+    .where(Cliente.nome.ilike(bindparam("filtro")))
+    .order_by(Cliente.nome)
+)
+# Usada apos UPDATEs em lote: sobrescreve objetos ja carregados na sessao
+SELECT_POR_IDS = (
+    select(Cliente)
+    .where(Cliente.id.in_(bindparam("ids", expanding=True)))
+    .order_by(Cliente.id)
+    .execution_options(populate_existing=True)
+)
+SELECT_VERSOES = (
+    select(Cliente.id, Cliente.versao)
+    .where(Cliente.id.in_(bindparam("ids", expanding=True)))
+)
+SELECT_EMAILS = (
+    select(Cliente.id, Cliente.email)
+    .where(Cliente.email.in_(bindparam("emails", expanding=True)))
+)
+# Email atual de clientes prestes a trocar de email, com as linhas travadas
+# ate o fim da transacao (as estatisticas sao ajustadas a partir dele). So
+# fora do PostgreSQL: o SQLite nao aceita no RETURNING colunas do FROM.
+SELECT_EMAILS_PARA_ATUALIZAR = (
+    select(Cliente.id, Cliente.email)
+    .where(Cliente.id.in_(bindparam("ids", expanding=True)))
+    .order_by(Cliente.id)
+    .with_for_update()
+)
+
+# Atualizacao com controle de concorrencia otimista: o UPDATE so afeta a
+# linha se a versao ainda for a lida pelo cliente, e devolve a linha nova
+# (RETURNING) no mesmo comando. Os campos alterados sao acrescentados com
+# .values() a cada chamada; com synchronize_session="fetch", a linha
+# retornada tambem atualiza o objeto que ja estiver na sessao.
+UPDATE_VERSIONADO = (
+    update(Cliente)
+    .where(
+        Cliente.id == bindparam("cliente_id"),
+        Cliente.versao == bindparam("versao_esperada")
+    )
+    .values(versao=Cliente.versao + 1, atualizado_em=func.now())
+    .returning(Cliente)
+    .execution_options(synchronize_session="fetch")
+)
+# Troca de email no PostgreSQL: o email anterior vem no mesmo comando, de
+# uma subconsulta que trava a linha (UPDATE ... FROM (SELECT ... FOR UPDATE)
+# ... RETURNING clientes.*, anterior.email)
+_ANTERIOR = (
+    select(Cliente.id, Cliente.email)
+    .where(Cliente.id == bindparam("cliente_id"))
+    .with_for_update()
+    .subquery("anterior")
+)
+UPDATE_VERSIONADO_COM_EMAIL_ANTERIOR = (
+    update(Cliente)
+    .where(
+        Cliente.id == _ANTERIOR.c.id,
+        Cliente.versao == bindparam("versao_esperada")
+    )
+    .values(versao=Cliente.versao + 1, atualizado_em=func.now())
+    .returning(Cliente, _ANTERIOR.c.email)
+    .execution_options(synchronize_session="fetch")
+)
+
+
+@lru_cache(maxsize=None)
+def _update_em_lote(campos: tuple):
+    """
+    UPDATE versionado para executemany, com um bind param por campo
+
+    Um statement por combinacao de campos alterados (no maximo 7). Usado
+    fora do PostgreSQL (ver _update_em_lote_valores).
+    """
+    tabela = Cliente.__table__
+    return (
+        update(tabela)
+        .where(
+            tabela.c.id == bindparam("cliente_id"),
+            tabela.c.versao == bindparam("versao_esperada")
+        )
+        .values({
+            **{campo: bindparam(f"novo_{campo}") for campo in campos},
+            "versao": tabela.c.versao + 1,
+            "atualizado_em": func.now(),
+        })
+    )
+
+
+def _update_em_lote_valores(campos: tuple, parametros: List[dict]):
+    """
+    UPDATE versionado de um grupo inteiro em um unico comando (PostgreSQL)
+
+    UPDATE clientes SET ... FROM (VALUES ...) v WHERE id e versao conferem
+    RETURNING clientes.*: as linhas retornadas sao os clientes atualizados.
+    Se o grupo troca o email, o FROM inclui tambem as linhas atuais travadas
+    (SELECT ... FOR UPDATE) e o email anterior vem na segunda coluna. O
+    executemany do psycopg2 faria uma ida ao banco por linha.
+    """
+    tabela = Cliente.__table__
+    nomes = ("cliente_id", "versao_esperada") + tuple(f"novo_{campo}" for campo in campos)
+    tipos = (Integer(), Integer()) + tuple(tabela.c[campo].type for campo in campos)
+    linhas = values(
+        *(column(nome, tipo) for nome, tipo in zip(nomes, tipos)), name="v"
+    ).data([tuple(p[nome] for nome in nomes) for p in parametros])
+    comando = (
+        update(Cliente)
+        .where(
+            Cliente.id == linhas.c.cliente_id,
+            Cliente.versao == linhas.c.versao_esperada
+        )
+        .values({
+            **{campo: linhas.c[f"novo_{campo}"] for campo in campos},
+            "versao": Cliente.versao + 1,
+            "atualizado_em": func.now(),
+        })
+        .execution_options(synchronize_session="fetch")
+    )
+    if "email" not in campos:
+        return comando.returning(Cliente)
+    anterior = (
+        select(Cliente.id, Cliente.email)
+        .where(Cliente.id.in_([p["cliente_id"] for p in parametros]))
+        .with_for_update()
+        .subquery("anterior")
+    )
+    return comando.where(Cliente.id == anterior.c.id).returning(Cliente, anterior.c.email)
+
+
+class ConflitoVersaoError(Exception):
+    """
+    Um ou mais clientes foram alterados desde a versao informada
+
+    `conflitos` lista dicts com id, versao_informada e versao_atual
+    (None se o cliente nao existe mais).
+    """
+
+    def __init__(self, conflitos: List[dict]):
+        self.conflitos = conflitos
+        ids = ", ".join(str(c["id"]) for c in conflitos)
+        super().__init__(f"Cliente(s) {ids} alterado(s) por outra requisicao; releia e tente novamente")
 
 
 class ClienteService:
@@ -17,19 +169,31 @@ class ClienteService:
     def __init__(self, db: Session):
         self.db = db
 
-    def criar_cliente(self, cliente_data: ClienteCreate) -> Cliente:
-        """
-        Cria um novo cliente no banco de dados
-        """
+    def validar_cliente(self, cliente_data: ClienteCreate):
+        """Valida os campos obrigatorios do cliente"""
         if not cliente_data.nome or not cliente_data.nome.strip():
             raise ValueError("Nome e obrigatorio e nao pode ser vazio")
         
         if not cliente_data.email or not cliente_data.email.strip():
             raise ValueError("Email e obrigatorio e nao pode ser vazio")
+
+    def criar_cliente(
+        self,
+        cliente_data: ClienteCreate,
+        ao_confirmar: Optional[Callable[[Session, Cliente], None]] = None
+    ) -> Cliente:
+        """
+        Cria um novo cliente no banco de dados
+
+        `ao_confirmar(db, cliente)`, se informado, e executado na mesma
+        transacao, logo antes do commit (ex: checkpoint de um job de
+        importacao).
+        """
+        self.validar_cliente(cliente_data)
         
-        cliente_existente = self.db.query(Cliente).filter(
-            Cliente.email == cliente_data.email
-        ).first()
+        cliente_existente = self.db.execute(
+            SELECT_POR_EMAIL, {"email": cliente_data.email}
+        ).scalar()
         
         if cliente_existente:
             raise ValueError(f"Email {cliente_data.email} ja esta cadastrado")
@@ -42,6 +206,12 @@ class ClienteService:
         
         try:
             self.db.add(novo_cliente)
+            self.db.flush()
+            EstatisticasService(self.db).registrar_cadastro(
+                novo_cliente.email, novo_cliente.criado_em
+            )
+            if ao_confirmar is not None:
+                ao_confirmar(self.db, novo_cliente)
             self.db.commit()
             self.db.refresh(novo_cliente)
             return novo_cliente
@@ -51,17 +221,243 @@ class ClienteService:
 
     def listar_todos(self) -> List[Cliente]:
         """Lista todos os clientes cadastrados"""
-        return self.db.query(Cliente).order_by(Cliente.nome).all()
+        return self.db.execute(SELECT_TODOS).scalars().all()
 
     def buscar_por_id(self, cliente_id: int) -> Optional[Cliente]:
         """Busca um cliente especifico pelo ID"""
-        return self.db.query(Cliente).filter(Cliente.id == cliente_id).first()
+        return self.db.execute(SELECT_POR_ID, {"cliente_id": cliente_id}).scalar()
+
+    def buscar_por_email(self, email: str) -> Optional[Cliente]:
+        """Busca um cliente especifico pelo email"""
+        return self.db.execute(
+            SELECT_POR_EMAIL, {"email": email.strip().lower()}
+        ).scalar()
 
     def buscar_por_nome(self, nome: str) -> List[Cliente]:
         """Busca clientes cujo nome contenha o valor informado"""
         if not nome or not nome.strip():
             return []
         filtro = f"%{nome.strip()}%"
-        return self.db.query(Cliente).filter(
-            Cliente.nome.ilike(filtro)
-        ).order_by(Cliente.nome).all()
+        return self.db.execute(SELECT_POR_NOME, {"filtro": filtro}).scalars().all()
+
+    @staticmethod
+    def _valores_atualizacao(dados: ClienteUpdate) -> dict:
+        """Campos alterados, normalizados como no cadastro"""
+        valores = dados.campos_alterados()
+        if "email" in valores:
+            valores["email"] = valores["email"].strip().lower()
+        return valores
+
+    def atualizar_cliente(self, cliente_id: int, dados: ClienteUpdate) -> Optional[Cliente]:
+        """
+        Atualiza parcialmente um cliente em um unico UPDATE ... RETURNING
+
+        Retorna None se o cliente nao existe e levanta ConflitoVersaoError
+        se a versao informada estiver desatualizada. A linha atual so e
+        lida nesses casos, para diferenciar um do outro.
+
+        Uma troca de email move o cliente entre os dominios das estatisticas
+        na mesma transacao, a partir do email anterior (ver _update_versionado).
+        """
+        valores = self._valores_atualizacao(dados)
+        cliente, anterior = self._update_versionado(cliente_id, dados.versao, valores)
+        if cliente is None:
+            return self._recusar_atualizacao(cliente_id, dados.versao)
+
+        if anterior is not None:
+            EstatisticasService(self.db).registrar_trocas_de_email(
+                self._trocas_de_email({cliente.id: anterior}, {cliente.id: cliente.email})
+            )
+        # Desanexa antes do commit para que os valores retornados pelo
+        # UPDATE nao expirem (o que faria um novo SELECT)
+        self.db.expunge(cliente)
+        self.db.commit()
+        return cliente
+
+    def atualizar_em_lote(self, itens: List[ClienteUpdateLote]) -> List[Cliente]:
+        """
+        Atualiza varios clientes em uma unica transacao (tudo ou nada)
+
+        Os itens sao agrupados pelos campos alterados e cada grupo e
+        enviado em um unico comando (ver _executar_lote). Se algum cliente
+        nao existir ou estiver em outra versao, nada e gravado e
+        ConflitoVersaoError lista os conflitos. As trocas de email ajustam as
+        estatisticas na mesma transacao.
+        """
+        try:
+            atualizados, anteriores, clientes = self._executar_lote(itens)
+        except IntegrityError:
+            self.db.rollback()
+            raise ValueError(self._mensagem_email_duplicado(itens, SELECT_EMAILS))
+
+        if atualizados != len(itens):
+            self.db.rollback()
+            raise ConflitoVersaoError(
+                self._verificar_versoes({item.id: item.versao for item in itens})
+            )
+
+        EstatisticasService(self.db).registrar_trocas_de_email(
+            self._trocas_de_email(anteriores, self._novos_emails(itens))
+        )
+        clientes = self._desanexar_atualizados([item.id for item in itens], clientes)
+        self.db.commit()
+        return clientes
+
+    def _postgresql(self) -> bool:
+        """A sessao esta ligada a um banco PostgreSQL"""
+        return self.db.get_bind().dialect.name == "postgresql"
+
+    def _update_versionado(
+        self, cliente_id: int, versao: int, valores: dict
+    ) -> Tuple[Optional[Cliente], Optional[str]]:
+        """
+        Executa o UPDATE versionado de um cliente, sem commit
+
+        Retorna (cliente atualizado, email anterior); o cliente e None se o
+        id e a versao nao conferem, e o email anterior so e lido se o email
+        for alterado. No PostgreSQL ele vem do proprio UPDATE; nos demais
+        bancos, de um SELECT ... FOR UPDATE antes. Um email ja cadastrado
+        desfaz a transacao e gera ValueError.
+        """
+        parametros = {"cliente_id": cliente_id, "versao_esperada": versao}
+        try:
+            if "email" not in valores:
+                return self.db.execute(
+                    UPDATE_VERSIONADO.values(**valores), parametros
+                ).scalar(), None
+            if self._postgresql():
+                linha = self.db.execute(
+                    UPDATE_VERSIONADO_COM_EMAIL_ANTERIOR.values(**valores), parametros
+                ).first()
+                return (linha[0], linha[1]) if linha else (None, None)
+            anterior = self._emails_anteriores([cliente_id]).get(cliente_id)
+            return self.db.execute(
+                UPDATE_VERSIONADO.values(**valores), parametros
+            ).scalar(), anterior
+        except IntegrityError:
+            self.db.rollback()
+            raise ValueError(f"Email {valores['email']} ja esta cadastrado")
+
+    def _recusar_atualizacao(self, cliente_id: int, versao: int) -> None:
+        """
+        Desfaz a transacao de um UPDATE que nao encontrou o cliente na versao
+
+        Retorna None se o cliente nao existe; caso contrario levanta
+        ConflitoVersaoError com a versao atual.
+        """
+        self.db.rollback()
+        conflitos = self._verificar_versoes({cliente_id: versao})
+        if conflitos and conflitos[0]["versao_atual"] is None:
+            return None
+        raise ConflitoVersaoError(conflitos)
+
+    def _emails_anteriores(self, ids: List[int]) -> Dict[int, str]:
+        """Emails atuais (id -> email), travando as linhas ate o commit"""
+        return dict(self.db.execute(SELECT_EMAILS_PARA_ATUALIZAR, {"ids": ids}).all())
+
+    @staticmethod
+    def _novos_emails(itens: Iterable[ClienteUpdateLote]) -> Dict[int, str]:
+        """Novo email (normalizado) de cada item que altera o email"""
+        return {
+            item.id: item.email.strip().lower() for item in itens if item.email is not None
+        }
+
+    @staticmethod
+    def _trocas_de_email(anteriores: Dict[int, str], novos: Dict[int, str]) -> List[tuple]:
+        """(email anterior, email novo) dos clientes cujo email realmente mudou"""
+        return [
+            (anteriores[cliente_id], email)
+            for cliente_id, email in novos.items()
+            if cliente_id in anteriores and anteriores[cliente_id] != email
+        ]
+
+    def _desanexar_atualizados(
+        self, ids: List[int], clientes: Optional[List[Cliente]]
+    ) -> List[Cliente]:
+        """
+        Desanexa da sessao os clientes atualizados, ordenados por id, para
+        que os valores nao expirem no commit (o que faria um SELECT por
+        cliente). Sem as linhas do RETURNING (clientes None), le os clientes
+        em uma consulta.
+        """
+        if clientes is None:
+            clientes = self.db.execute(SELECT_POR_IDS, {"ids": ids}).scalars().all()
+        for cliente in clientes:
+            self.db.expunge(cliente)
+        return sorted(clientes, key=attrgetter("id"))
+
+    def _executar_lote(
+        self, itens: List[ClienteUpdateLote]
+    ) -> Tuple[int, Dict[int, str], Optional[List[Cliente]]]:
+        """
+        Executa os UPDATEs versionados do lote, sem commit
+
+        Retorna (quantidade atualizada, emails anteriores dos clientes que
+        alteram o email, clientes atualizados). No PostgreSQL cada grupo de
+        campos e um unico UPDATE ... FROM (VALUES ...) RETURNING, que devolve
+        as linhas novas e o email anterior. Nos demais bancos os emails
+        anteriores sao lidos antes (SELECT ... FOR UPDATE), cada grupo e um
+        executemany e os clientes nao sao retornados (None). Com drivers que
+        nao informam o rowcount de um executemany, cada item e executado
+        separadamente.
+        """
+        grupos = {}
+        for item in itens:
+            valores = self._valores_atualizacao(item)
+            campos = tuple(sorted(valores))
+            parametros = {f"novo_{campo}": valor for campo, valor in valores.items()}
+            parametros.update(cliente_id=item.id, versao_esperada=item.versao)
+            grupos.setdefault(campos, []).append(parametros)
+
+        if self._postgresql():
+            anteriores, clientes = {}, []
+            for campos, parametros in grupos.items():
+                for linha in self.db.execute(_update_em_lote_valores(campos, parametros)):
+                    clientes.append(linha[0])
+                    if "email" in campos:
+                        anteriores[linha[0].id] = linha[1]
+            return len(clientes), anteriores, clientes
+
+        novos = self._novos_emails(itens)
+        anteriores = self._emails_anteriores(list(novos)) if novos else {}
+        dialeto = self.db.get_bind().dialect
+        atualizados = 0
+        for campos, parametros in grupos.items():
+            if dialeto.supports_sane_multi_rowcount:
+                atualizados += self.db.execute(_update_em_lote(campos), parametros).rowcount
+            else:
+                for linha in parametros:
+                    atualizados += self.db.execute(_update_em_lote(campos), linha).rowcount
+        return atualizados, anteriores, None
+
+    def _verificar_versoes(self, versoes: dict) -> List[dict]:
+        """
+        Compara as versoes informadas (id -> versao) com as atuais
+
+        Usado apenas quando uma atualizacao falha. Retorna os conflitos.
+        """
+        atuais = dict(self.db.execute(SELECT_VERSOES, {"ids": list(versoes)}).all())
+        return [
+            {"id": cliente_id, "versao_informada": versao, "versao_atual": atuais.get(cliente_id)}
+            for cliente_id, versao in versoes.items()
+            if atuais.get(cliente_id) != versao
+        ]
+
+    def _mensagem_email_duplicado(self, itens: List[ClienteUpdateLote], consulta) -> str:
+        """
+        Identifica o email que violou a restricao unique em um lote
+
+        `consulta` retorna (id, email) dos donos atuais dos emails.
+        """
+        novos = {}
+        for item in itens:
+            if item.email is not None:
+                email = item.email.strip().lower()
+                if email in novos:
+                    return f"Email {email} ja esta cadastrado"
+                novos[email] = item.id
+        if novos:
+            for cliente_id, email in self.db.execute(consulta, {"emails": list(novos)}):
+                if novos[email] != cliente_id:
+                    return f"Email {email} ja esta cadastrado"
+        return "Erro ao atualizar clientes: email ja cadastrado"
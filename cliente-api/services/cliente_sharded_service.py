@@ -0,0 +1,375 @@
+﻿"""
+Service Layer - Operacoes com Cliente distribuidas entre shards
+"""
+import heapq
+from collections import defaultdict
+from datetime import datetime, timezone
+from functools import lru_cache
+from operator import attrgetter
+from typing import Callable, Dict, List, Optional
+
+from sqlalchemy import select, update, delete, bindparam
+from sqlalchemy.orm import Session
+from sqlalchemy.exc import IntegrityError
+
+from database.sharding import ShardRouter, get_shard_router
+from models.cliente import Cliente
+from models.cliente_indice import ClienteIndice
+from schemas.cliente_schema import ClienteCreate, ClienteUpdate, ClienteUpdateLote
+from services.cliente_service import ClienteService, ConflitoVersaoError
+from services.estatisticas_service import EstatisticasService
+
+SELECT_ID_POR_EMAIL = select(ClienteIndice.id).where(ClienteIndice.email == bindparam("email"))
+SELECT_EMAIL_INDICE = (
+    select(ClienteIndice.email).where(ClienteIndice.id == bindparam("cliente_id"))
+)
+DELETE_INDICE = delete(ClienteIndice).where(ClienteIndice.id == bindparam("cliente_id"))
+SELECT_EMAILS_INDICE = (
+    select(ClienteIndice.id, ClienteIndice.email)
+    .where(ClienteIndice.email.in_(bindparam("emails", expanding=True)))
+)
+SELECT_EMAILS_INDICE_POR_IDS = (
+    select(ClienteIndice.id, ClienteIndice.email)
+    .where(ClienteIndice.id.in_(bindparam("ids", expanding=True)))
+)
+SELECT_EMAILS_POR_IDS = (
+    select(Cliente.id, Cliente.email)
+    .where(Cliente.id.in_(bindparam("ids", expanding=True)))
+)
+UPDATE_EMAIL_INDICE = (
+    update(ClienteIndice.__table__)
+    .where(ClienteIndice.__table__.c.id == bindparam("cliente_id"))
+    .values(email=bindparam("novo_email"))
+)
+
+# Collation de cada dialeto que ordena pelos code points, como o Python
+COLLATION_BINARIA = {"postgresql": "C", "sqlite": "BINARY"}
+
+
+@lru_cache(maxsize=None)
+def _consultas_por_nome(dialeto: str) -> tuple:
+    """
+    (SELECT_TODOS, SELECT_POR_NOME) ordenados pela collation binaria
+
+    O merge dos shards compara nomes como o Python; a collation padrao do
+    PostgreSQL (ex: en_US.UTF-8) ignora maiusculas e colocaria "ana" antes
+    de "Bruno", deixando as listas fora da ordem esperada pelo merge.
+    """
+    nome = Cliente.nome.collate(COLLATION_BINARIA[dialeto])
+    return (
+        select(Cliente).order_by(nome),
+        select(Cliente).where(Cliente.nome.ilike(bindparam("filtro"))).order_by(nome),
+    )
+
+
+def _listar_ordenado(db: Session, filtro: Optional[str] = None) -> List[Cliente]:
+    """Clientes de um shard na ordem binaria de nome (opcionalmente filtrados)"""
+    todos, por_nome = _consultas_por_nome(db.get_bind().dialect.name)
+    if filtro is None:
+        return db.execute(todos).scalars().all()
+    return db.execute(por_nome, {"filtro": filtro}).scalars().all()
+
+
+def criar_cliente_service(db: Session) -> ClienteService:
+    """
+    Retorna o service de clientes adequado a configuracao
+
+    Sem DB_SHARDS, o ClienteService usa apenas o banco principal.
+    """
+    router = get_shard_router()
+    if router is None:
+        return ClienteService(db)
+    return ClienteShardedService(db, router)
+
+
+class ClienteShardedService(ClienteService):
+    """
+    ClienteService com os clientes distribuidos entre shards
+
+    `db` e a sessao do banco coordenador, onde ficam o indice global de
+    emails e as estatisticas. Consultas por id ou email acessam um unico
+    shard; listagens consultam todos em paralelo e combinam os resultados
+    mantendo a ordenacao por nome.
+    """
+
+    def __init__(self, db: Session, router: ShardRouter):
+        super().__init__(db)
+        self.router = router
+
+    def criar_cliente(
+        self,
+        cliente_data: ClienteCreate,
+        ao_confirmar: Optional[Callable[[Session, Cliente], None]] = None
+    ) -> Cliente:
+        """
+        Cria um novo cliente no shard definido pelo seu id
+
+        O id e gerado pelo indice global, cuja restricao unique garante que
+        o email nao exista em nenhum shard. A reserva no indice e as
+        estatisticas sao confirmadas no coordenador antes da gravacao no
+        shard; se o shard falhar, a reserva e desfeita. Uma queda entre os
+        dois commits deixa apenas uma reserva sem cliente no shard (nunca um
+        email duplicado), completada por concluir_cadastro.
+        `ao_confirmar(db, cliente)` roda na transacao do coordenador, antes
+        do seu commit.
+        """
+        self.validar_cliente(cliente_data)
+        novo_cliente = Cliente(
+            nome=cliente_data.nome.strip(),
+            email=cliente_data.email.strip().lower(),
+            telefone=cliente_data.telefone.strip() if cliente_data.telefone else None,
+            criado_em=datetime.now(timezone.utc)
+        )
+
+        indice = ClienteIndice(email=novo_cliente.email)
+        try:
+            self.db.add(indice)
+            self.db.flush()
+        except IntegrityError:
+            self.db.rollback()
+            raise ValueError(f"Email {cliente_data.email} ja esta cadastrado")
+
+        try:
+            novo_cliente.id = indice.id
+            EstatisticasService(self.db).registrar_cadastro(
+                novo_cliente.email, novo_cliente.criado_em
+            )
+            if ao_confirmar is not None:
+                ao_confirmar(self.db, novo_cliente)
+            self.db.commit()
+        except Exception:
+            self.db.rollback()
+            raise
+        return self._gravar_no_shard(novo_cliente)
+
+    def concluir_cadastro(self, cliente_id: int, cliente_data: ClienteCreate) -> Optional[Cliente]:
+        """
+        Grava no shard um cliente reservado no indice global que nao chegou
+        ao shard (queda entre os dois commits de criar_cliente)
+
+        Retorna None se a reserva nao existe (ou e de outro email) ou se o
+        cliente ja esta no shard.
+        """
+        email = self.db.execute(SELECT_EMAIL_INDICE, {"cliente_id": cliente_id}).scalar()
+        if email != cliente_data.email.strip().lower() or self.buscar_por_id(cliente_id):
+            return None
+        return self._gravar_no_shard(Cliente(
+            id=cliente_id,
+            nome=cliente_data.nome.strip(),
+            email=email,
+            telefone=cliente_data.telefone.strip() if cliente_data.telefone else None,
+            criado_em=datetime.now(timezone.utc)
+        ))
+
+    def _gravar_no_shard(self, cliente: Cliente) -> Cliente:
+        """Grava um cliente ja reservado no indice; se o shard falhar, desfaz a reserva"""
+        shard = self.router.sessao(self.router.shard_do_id(cliente.id))
+        try:
+            shard.add(cliente)
+            shard.commit()
+            shard.refresh(cliente)
+            return cliente
+        except Exception as erro:
+            shard.rollback()
+            self._desfazer_reserva(cliente)
+            if isinstance(erro, IntegrityError):
+                raise ValueError(f"Erro ao criar cliente: {str(erro)}")
+            raise
+        finally:
+            shard.close()
+
+    def _desfazer_reserva(self, cliente: Cliente):
+        """Remove do indice global e das estatisticas um cliente nao gravado no shard"""
+        self.db.execute(DELETE_INDICE, {"cliente_id": cliente.id})
+        EstatisticasService(self.db).remover_cadastro(cliente.email, cliente.criado_em)
+        self.db.commit()
+
+    def buscar_por_id(self, cliente_id: int) -> Optional[Cliente]:
+        """Busca um cliente pelo ID, consultando apenas o seu shard"""
+        shard = self.router.sessao(self.router.shard_do_id(cliente_id))
+        try:
+            return ClienteService(shard).buscar_por_id(cliente_id)
+        finally:
+            shard.close()
+
+    def buscar_por_email(self, email: str) -> Optional[Cliente]:
+        """Busca um cliente pelo email: indice global + um unico shard"""
+        cliente_id = self.db.execute(
+            SELECT_ID_POR_EMAIL, {"email": email.strip().lower()}
+        ).scalar()
+        if cliente_id is None:
+            return None
+        return self.buscar_por_id(cliente_id)
+
+    def listar_todos(self) -> List[Cliente]:
+        """Lista os clientes de todos os shards, ordenados por nome"""
+        return self._combinar(self.router.executar_em_todos(_listar_ordenado))
+
+    def buscar_por_nome(self, nome: str) -> List[Cliente]:
+        """Busca clientes por nome em todos os shards, ordenados por nome"""
+        if not nome or not nome.strip():
+            return []
+        filtro = f"%{nome.strip()}%"
+        return self._combinar(
+            self.router.executar_em_todos(lambda db: _listar_ordenado(db, filtro))
+        )
+
+    def atualizar_cliente(self, cliente_id: int, dados: ClienteUpdate) -> Optional[Cliente]:
+        """
+        Atualiza um cliente no seu shard com controle de versao
+
+        O UPDATE roda no shard sem commit. Se o email mudou, o indice global
+        (restricao unique entre todos os shards) e as estatisticas sao
+        gravados e confirmados no coordenador, e so entao o shard confirma;
+        se o indice recusar o email, o shard e desfeito. Um conflito de
+        versao nao libera o email antigo nem reserva o novo. Se o commit do
+        shard falhar depois do indice, o indice volta ao email do shard.
+        """
+        valores = self._valores_atualizacao(dados)
+        shard = self.router.sessao(self.router.shard_do_id(cliente_id))
+        indice_confirmado = False
+        try:
+            service = ClienteService(shard)
+            cliente, anterior = service._update_versionado(cliente_id, dados.versao, valores)
+            if cliente is None:
+                return service._recusar_atualizacao(cliente_id, dados.versao)
+
+            anteriores = {cliente.id: anterior} if anterior is not None else {}
+            if self._trocas_de_email(anteriores, {cliente.id: cliente.email}):
+                self._confirmar_emails(
+                    anteriores, {cliente.id: cliente.email},
+                    lambda: f"Email {cliente.email} ja esta cadastrado"
+                )
+                indice_confirmado = True
+            shard.expunge(cliente)
+            shard.commit()
+            return cliente
+        except Exception:
+            shard.rollback()
+            if indice_confirmado:
+                self._ressincronizar_indice([cliente_id])
+            raise
+        finally:
+            shard.close()
+
+    def atualizar_em_lote(self, itens: List[ClienteUpdateLote]) -> List[Cliente]:
+        """
+        Atualiza varios clientes, distribuidos entre os shards
+
+        Cada shard executa os UPDATEs dos seus clientes sem commit (ver
+        ClienteService._executar_lote). Um conflito de versao ou email
+        duplicado em qualquer shard desfaz todos, sem nada gravado. Depois
+        os emails alterados e as estatisticas sao confirmados no
+        coordenador e, por fim, cada shard confirma.
+
+        Nao ha commit em duas fases: os shards confirmam um apos o outro.
+        Se o commit de um shard falhar depois de outros terem confirmado,
+        os clientes desses outros shards ficam atualizados, o erro e
+        propagado e o indice volta a refletir os emails gravados nos shards.
+        """
+        novos = self._novos_emails(itens)
+        por_shard = defaultdict(list)
+        for item in itens:
+            por_shard[self.router.shard_do_id(item.id)].append(item)
+        sessoes = {indice: self.router.sessao(indice) for indice in por_shard}
+        indice_confirmado = False
+        try:
+            anteriores = {}
+            retornados = {}
+            conflitos = []
+            for indice, grupo in por_shard.items():
+                service = ClienteService(sessoes[indice])
+                try:
+                    atualizados, anteriores_shard, retornados[indice] = (
+                        service._executar_lote(grupo)
+                    )
+                except IntegrityError:
+                    raise ValueError(
+                        self._mensagem_email_duplicado(itens, SELECT_EMAILS_INDICE)
+                    )
+                if atualizados != len(grupo):
+                    sessoes[indice].rollback()
+                    conflitos += service._verificar_versoes(
+                        {item.id: item.versao for item in grupo}
+                    )
+                anteriores.update(anteriores_shard)
+            if conflitos:
+                raise ConflitoVersaoError(conflitos)
+
+            if self._trocas_de_email(anteriores, novos):
+                self._confirmar_emails(
+                    anteriores, novos,
+                    lambda: self._mensagem_email_duplicado(itens, SELECT_EMAILS_INDICE)
+                )
+                indice_confirmado = True
+            clientes = []
+            for indice, grupo in por_shard.items():
+                clientes += ClienteService(sessoes[indice])._desanexar_atualizados(
+                    [item.id for item in grupo], retornados[indice]
+                )
+            for sessao in sessoes.values():
+                sessao.commit()
+        except Exception:
+            for sessao in sessoes.values():
+                sessao.rollback()
+            if indice_confirmado:
+                self._ressincronizar_indice(list(novos))
+            raise
+        finally:
+            for sessao in sessoes.values():
+                sessao.close()
+        return sorted(clientes, key=attrgetter("id"))
+
+    def _confirmar_emails(
+        self, anteriores: Dict[int, str], novos: Dict[int, str], mensagem_duplicado
+    ):
+        """
+        Grava no coordenador os emails que mudaram (indice global e
+        estatisticas por dominio) e confirma
+
+        Uma violacao da restricao unique do indice vira ValueError com
+        `mensagem_duplicado()`, sem nada gravado.
+        """
+        alterados = [
+            {"cliente_id": cliente_id, "novo_email": email}
+            for cliente_id, email in novos.items()
+            if anteriores.get(cliente_id, email) != email
+        ]
+        try:
+            self.db.execute(UPDATE_EMAIL_INDICE, alterados)
+            EstatisticasService(self.db).registrar_trocas_de_email(
+                self._trocas_de_email(anteriores, novos)
+            )
+            self.db.commit()
+        except IntegrityError:
+            self.db.rollback()
+            raise ValueError(mensagem_duplicado())
+
+    def _ressincronizar_indice(self, ids: List[int]):
+        """
+        Copia para o indice global o email atual dos clientes nos shards,
+        desfazendo nas estatisticas as trocas que nao foram gravadas
+        """
+        por_shard = defaultdict(list)
+        for cliente_id in ids:
+            por_shard[self.router.shard_do_id(cliente_id)].append(cliente_id)
+        gravados = {}
+        for indice, grupo in por_shard.items():
+            shard = self.router.sessao(indice)
+            try:
+                gravados.update(shard.execute(SELECT_EMAILS_POR_IDS, {"ids": grupo}).all())
+            finally:
+                shard.close()
+        no_indice = dict(self.db.execute(SELECT_EMAILS_INDICE_POR_IDS, {"ids": ids}).all())
+        if self._trocas_de_email(no_indice, gravados):
+            self._confirmar_emails(
+                no_indice, gravados, lambda: "Indice de emails divergente dos shards"
+            )
+
+    @staticmethod
+    def _combinar(resultados: List[List[Cliente]]) -> List[Cliente]:
+        """
+        Merge k-way das listas de cada shard, ja ordenadas por nome na
+        collation binaria (ver _consultas_por_nome)
+        """
+        return list(heapq.merge(*resultados, key=attrgetter("nome")))
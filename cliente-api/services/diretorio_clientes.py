@@ -0,0 +1,488 @@
+﻿"""
+Diretorio de clientes em memoria para nos de leitura
+
+Mantem um snapshot colunar da tabela clientes no processo: cada coluna e
+um array (ids e timestamps) ou uma lista de strings, com um indice
+ordenado por nome e indices hash por id e email. O snapshot e carregado
+no startup e atualizado incrementalmente a partir de criado_em e
+atualizado_em, de forma que listagens e buscas nao acessam o banco.
+
+Leituras nao bloqueiam umas as outras: cada consulta roda sem trava e
+confere, por um contador de geracao, se alguma escrita aconteceu no meio;
+so nesse caso e repetida com a trava de leitura, que bloqueia apenas as
+escritas. As linhas lidas do banco sao buscadas fora de qualquer trava.
+
+Limitacoes:
+- clientes removidos diretamente no banco so saem do snapshot no restart
+  do worker;
+- escritas de outros processos aparecem em ate SNAPSHOT_INTERVALO segundos
+  se confirmadas ate SNAPSHOT_MARGEM_SEGUNDOS apos o timestamp gravado (no
+  PostgreSQL, now() e o inicio da transacao). Transacoes mais longas (ex:
+  um PATCH em lote grande ou uma espera por trava) so aparecem na proxima
+  releitura completa: o atraso maximo e SNAPSHOT_RECONCILIACAO segundos.
+"""
+import os
+import sys
+import threading
+import time
+from array import array
+from bisect import bisect_left, insort
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from math import isnan
+from typing import Callable, Iterable, List, Optional, TypeVar
+
+from sqlalchemy import select, or_
+from sqlalchemy.orm import Session
+
+from models.cliente import Cliente
+from schemas.cliente_schema import ClienteCreate, ClienteUpdate, ClienteUpdateLote
+from services.cliente_service import ClienteService
+
+# Ativa o diretorio em memoria neste processo
+SNAPSHOT_HABILITADO = os.getenv("SNAPSHOT_HABILITADO", "0") == "1"
+
+# Intervalo (segundos) entre as atualizacoes incrementais
+SNAPSHOT_INTERVALO = float(os.getenv("SNAPSHOT_INTERVALO", "5"))
+
+# Margem (segundos) relida a cada atualizacao, para cobrir transacoes que
+# confirmaram com timestamp anterior ao ultimo lido
+SNAPSHOT_MARGEM_SEGUNDOS = float(os.getenv("SNAPSHOT_MARGEM_SEGUNDOS", "5"))
+
+# Intervalo (segundos) entre releituras completas da tabela, que aplicam
+# as escritas confirmadas depois da margem
+SNAPSHOT_RECONCILIACAO = float(os.getenv("SNAPSHOT_RECONCILIACAO", "300"))
+
+COLUNAS = (
+    Cliente.id, Cliente.nome, Cliente.email, Cliente.telefone,
+    Cliente.criado_em, Cliente.atualizado_em, Cliente.versao
+)
+
+# Linhas aplicadas por aquisicao da trava de escrita durante a sincronizacao
+LINHAS_POR_ESCRITA = 10000
+
+_diretorio = None
+_SEM_DATA = float("nan")
+T = TypeVar("T")
+
+
+def _para_epoch(momento: Optional[datetime]) -> float:
+    """Converte um timestamp (naive = UTC) para segundos desde a epoch"""
+    if momento is None:
+        return _SEM_DATA
+    if momento.tzinfo is None:
+        momento = momento.replace(tzinfo=timezone.utc)
+    return momento.timestamp()
+
+
+def _de_epoch(valor: float) -> Optional[datetime]:
+    if isnan(valor):
+        return None
+    return datetime.fromtimestamp(valor, timezone.utc)
+
+
+class _TravaLeituraEscrita:
+    """
+    Varias leituras simultaneas ou uma unica escrita
+
+    Escritas tem preferencia: com uma escrita aguardando, novas leituras
+    esperam, para que a sincronizacao nao seja adiada indefinidamente.
+    """
+
+    def __init__(self):
+        self._condicao = threading.Condition(threading.Lock())
+        self._leitores = 0
+        self._escrevendo = False
+        self._escritas_aguardando = 0
+
+    @contextmanager
+    def leitura(self):
+        with self._condicao:
+            while self._escrevendo or self._escritas_aguardando:
+                self._condicao.wait()
+            self._leitores += 1
+        try:
+            yield
+        finally:
+            with self._condicao:
+                self._leitores -= 1
+                if not self._leitores:
+                    self._condicao.notify_all()
+
+    @contextmanager
+    def escrita(self):
+        with self._condicao:
+            self._escritas_aguardando += 1
+            while self._escrevendo or self._leitores:
+                self._condicao.wait()
+            self._escritas_aguardando -= 1
+            self._escrevendo = True
+        try:
+            yield
+        finally:
+            with self._condicao:
+                self._escrevendo = False
+                self._condicao.notify_all()
+
+
+class ClienteRegistro:
+    """Cliente materializado a partir do snapshot (compativel com ClienteResponse)"""
+    __slots__ = ("id", "nome", "email", "telefone", "criado_em", "atualizado_em", "versao")
+
+    def __init__(self, id, nome, email, telefone, criado_em, atualizado_em, versao):
+        self.id = id
+        self.nome = nome
+        self.email = email
+        self.telefone = telefone
+        self.criado_em = criado_em
+        self.atualizado_em = atualizado_em
+        self.versao = versao
+
+
+class DiretorioClientes:
+    """
+    Snapshot colunar e indexado da tabela clientes
+
+    Cada cliente ocupa uma posicao `p` em todas as colunas. `_ordem_nome`
+    guarda as posicoes ordenadas por (nome, id); `_por_id` e `_por_email`
+    mapeiam a chave para a posicao. Posicoes nunca sao reaproveitadas, de
+    forma que uma leitura sem trava nunca acessa uma posicao inexistente.
+
+    `_geracao` e impar durante uma escrita e muda a cada escrita (seqlock):
+    uma leitura sem trava que observa a mesma geracao, par, antes e depois
+    viu um estado consistente.
+    """
+
+    def __init__(self):
+        self._trava = _TravaLeituraEscrita()
+        self._geracao = 0
+        self._ids = array("q")
+        self._nomes: List[str] = []
+        self._nomes_busca: List[str] = []
+        self._emails: List[str] = []
+        self._telefones: List[Optional[str]] = []
+        self._criado_em = array("d")
+        self._atualizado_em = array("d")
+        self._versoes = array("q")
+        self._por_id = {}
+        self._por_email = {}
+        self._ordem_nome = array("q")
+        self._marcas = {}
+        self.carregado = False
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    # Escrita
+
+    @contextmanager
+    def _escrita(self):
+        with self._trava.escrita():
+            self._geracao += 1
+            try:
+                yield
+            finally:
+                self._geracao += 1
+
+    def carregar_linhas(self, linhas: Iterable[tuple], carga_completa: bool = False):
+        """
+        Aplica linhas (id, nome, email, telefone, criado_em, atualizado_em, versao)
+
+        Clientes ja presentes sao atualizados no lugar; novos sao anexados
+        ao final das colunas. Em atualizacoes pequenas o indice por nome e
+        mantido com insercao ordenada; em uma carga completa ele e
+        reconstruido uma unica vez ao final.
+
+        `linhas` e consumido com a trava de escrita: passe linhas ja lidas,
+        nunca um cursor do banco.
+        """
+        with self._escrita():
+            for linha in linhas:
+                self._aplicar_linha(linha, reordenar=not carga_completa)
+            if carga_completa:
+                self._ordenar()
+
+    def _ordenar(self):
+        """Reconstroi o indice por (nome, id)"""
+        chaves = list(zip(self._nomes, self._ids))
+        self._ordem_nome = array("q", sorted(range(len(chaves)), key=chaves.__getitem__))
+
+    def aplicar(self, clientes: Iterable[Cliente]):
+        """Aplica clientes (ORM) escritos por este processo"""
+        self.carregar_linhas(
+            (c.id, c.nome, c.email, c.telefone, c.criado_em, c.atualizado_em, c.versao)
+            for c in clientes
+        )
+
+    def _chave_ordem(self, posicao: int):
+        return (self._nomes[posicao], self._ids[posicao])
+
+    def _aplicar_linha(self, linha: tuple, reordenar: bool):
+        """
+        Insere ou atualiza um cliente; linhas com versao anterior a do
+        snapshot (ex: lidas do banco antes de uma escrita local) sao ignoradas
+        """
+        cliente_id, nome, email, telefone, criado_em, atualizado_em, versao = linha
+        posicao = self._por_id.get(cliente_id)
+        if posicao is not None and versao < self._versoes[posicao]:
+            return
+        nome = sys.intern(nome)
+        nome_busca = sys.intern(nome.lower())
+
+        if posicao is None:
+            posicao = len(self._ids)
+            self._ids.append(cliente_id)
+            self._nomes.append(nome)
+            self._nomes_busca.append(nome_busca)
+            self._emails.append(email)
+            self._telefones.append(telefone)
+            self._criado_em.append(_para_epoch(criado_em))
+            self._atualizado_em.append(_para_epoch(atualizado_em))
+            self._versoes.append(versao)
+            self._por_id[cliente_id] = posicao
+            self._por_email[email] = posicao
+            if reordenar:
+                insort(self._ordem_nome, posicao, key=self._chave_ordem)
+            return
+
+        if reordenar and self._nomes[posicao] != nome:
+            indice = bisect_left(
+                self._ordem_nome, self._chave_ordem(posicao), key=self._chave_ordem
+            )
+            del self._ordem_nome[indice]
+            self._nomes[posicao] = nome
+            insort(self._ordem_nome, posicao, key=self._chave_ordem)
+        else:
+            self._nomes[posicao] = nome
+        self._nomes_busca[posicao] = nome_busca
+
+        if self._emails[posicao] != email:
+            self._por_email.pop(self._emails[posicao], None)
+            self._emails[posicao] = email
+            self._por_email[email] = posicao
+        self._telefones[posicao] = telefone
+        self._criado_em[posicao] = _para_epoch(criado_em)
+        self._atualizado_em[posicao] = _para_epoch(atualizado_em)
+        self._versoes[posicao] = versao
+
+    # Sincronizacao com o banco
+
+    def sincronizar(self, fonte: str, db: Session, completa: bool = False):
+        """
+        Carrega do banco os clientes criados/alterados desde a ultima leitura
+
+        Na primeira chamada para a `fonte` (banco ou shard), ou com
+        `completa`, le a tabela inteira. Nas demais, rele apenas as linhas
+        com criado_em ou atualizado_em a partir da marca anterior menos a
+        margem.
+
+        As linhas sao buscadas no banco fora da trava e aplicadas em partes
+        de LINHAS_POR_ESCRITA, cada uma com a trava de escrita.
+        """
+        primeira = fonte not in self._marcas
+        consulta = select(*COLUNAS).order_by(Cliente.id)
+        marca = self._marcas.get(fonte)
+        if marca is not None and not completa:
+            desde = marca - timedelta(seconds=SNAPSHOT_MARGEM_SEGUNDOS)
+            consulta = consulta.where(
+                or_(Cliente.criado_em >= desde, Cliente.atualizado_em >= desde)
+            )
+
+        nova_marca = marca
+        resultado = db.execute(consulta.execution_options(yield_per=LINHAS_POR_ESCRITA))
+        for parte in resultado.partitions():
+            for linha in parte:
+                for momento in (linha.criado_em, linha.atualizado_em):
+                    if momento is not None and (nova_marca is None or momento > nova_marca):
+                        nova_marca = momento
+            with self._escrita():
+                for linha in parte:
+                    self._aplicar_linha(linha, reordenar=not primeira)
+        if primeira:
+            with self._escrita():
+                self._ordenar()
+        self._marcas[fonte] = nova_marca
+
+    # Leitura
+
+    def _registro(self, posicao: int) -> ClienteRegistro:
+        return ClienteRegistro(
+            self._ids[posicao],
+            self._nomes[posicao],
+            self._emails[posicao],
+            self._telefones[posicao],
+            _de_epoch(self._criado_em[posicao]),
+            _de_epoch(self._atualizado_em[posicao]),
+            self._versoes[posicao],
+        )
+
+    def _ler(self, leitura: Callable[[], T]) -> T:
+        """
+        Executa `leitura()` sobre um estado consistente do snapshot
+
+        Tenta sem trava; se uma escrita comecou ou terminou no meio, repete
+        com a trava de leitura.
+        """
+        geracao = self._geracao
+        if geracao % 2 == 0:
+            resultado = leitura()
+            if self._geracao == geracao:
+                return resultado
+        with self._trava.leitura():
+            return leitura()
+
+    def listar(self) -> List[ClienteRegistro]:
+        """Todos os clientes, ordenados por nome"""
+        def ler():
+            registro = self._registro
+            return [registro(p) for p in self._ordem_nome]
+        return self._ler(ler)
+
+    def buscar_por_id(self, cliente_id: int) -> Optional[ClienteRegistro]:
+        def ler():
+            posicao = self._por_id.get(cliente_id)
+            return None if posicao is None else self._registro(posicao)
+        return self._ler(ler)
+
+    def buscar_por_email(self, email: str) -> Optional[ClienteRegistro]:
+        email = email.strip().lower()
+
+        def ler():
+            posicao = self._por_email.get(email)
+            return None if posicao is None else self._registro(posicao)
+        return self._ler(ler)
+
+    def buscar_por_nome(self, nome: str) -> List[ClienteRegistro]:
+        """Clientes cujo nome contem `nome` (sem diferenciar maiusculas), ordenados por nome"""
+        termo = nome.strip().lower()
+        if not termo:
+            return []
+
+        def ler():
+            registro, nomes_busca = self._registro, self._nomes_busca
+            return [registro(p) for p in self._ordem_nome if termo in nomes_busca[p]]
+        return self._ler(ler)
+
+
+class ClienteSnapshotService(ClienteService):
+    """
+    ClienteService que responde consultas a partir do DiretorioClientes
+
+    Escritas sao delegadas ao service do banco (com ou sem sharding) e
+    aplicadas ao diretorio em seguida, para que o proprio processo leia o
+    que acabou de gravar.
+    """
+
+    def __init__(self, service: ClienteService, diretorio: DiretorioClientes):
+        super().__init__(service.db)
+        self.service = service
+        self.diretorio = diretorio
+
+    def criar_cliente(self, cliente_data: ClienteCreate) -> Cliente:
+        cliente = self.service.criar_cliente(cliente_data)
+        self.diretorio.aplicar([cliente])
+        return cliente
+
+    def atualizar_cliente(self, cliente_id: int, dados: ClienteUpdate) -> Optional[Cliente]:
+        cliente = self.service.atualizar_cliente(cliente_id, dados)
+        if cliente is not None:
+            self.diretorio.aplicar([cliente])
+        return cliente
+
+    def atualizar_em_lote(self, itens: List[ClienteUpdateLote]) -> List[Cliente]:
+        clientes = self.service.atualizar_em_lote(itens)
+        self.diretorio.aplicar(clientes)
+        return clientes
+
+    def listar_todos(self) -> List[ClienteRegistro]:
+        return self.diretorio.listar()
+
+    def buscar_por_id(self, cliente_id: int) -> Optional[ClienteRegistro]:
+        return self.diretorio.buscar_por_id(cliente_id)
+
+    def buscar_por_email(self, email: str) -> Optional[ClienteRegistro]:
+        return self.diretorio.buscar_por_email(email)
+
+    def buscar_por_nome(self, nome: str) -> List[ClienteRegistro]:
+        if not nome or not nome.strip():
+            return []
+        return self.diretorio.buscar_por_nome(nome)
+
+
+class AtualizadorDiretorio:
+    """
+    Carrega o diretorio no startup e o atualiza periodicamente em uma thread
+    """
+
+    def __init__(self, diretorio: DiretorioClientes, fontes: dict):
+        self.diretorio = diretorio
+        self.fontes = fontes
+        self._parar = threading.Event()
+        self._thread = None
+        self._ultima_completa = None
+
+    def sincronizar(self):
+        """Atualizacao incremental, ou completa a cada SNAPSHOT_RECONCILIACAO segundos"""
+        agora = time.monotonic()
+        completa = (
+            self._ultima_completa is None
+            or agora - self._ultima_completa >= SNAPSHOT_RECONCILIACAO
+        )
+        for nome, abrir_sessao in self.fontes.items():
+            db = abrir_sessao()
+            try:
+                self.diretorio.sincronizar(nome, db, completa=completa)
+            finally:
+                db.close()
+        if completa:
+            self._ultima_completa = agora
+        self.diretorio.carregado = True
+
+    def iniciar(self):
+        self.sincronizar()
+        self._thread = threading.Thread(target=self._executar, name="diretorio", daemon=True)
+        self._thread.start()
+
+    def _executar(self):
+        while not self._parar.wait(SNAPSHOT_INTERVALO):
+            try:
+                self.sincronizar()
+            except Exception:
+                # Mantem o snapshot anterior e tenta novamente no proximo ciclo
+                continue
+
+    def parar(self):
+        self._parar.set()
+        if self._thread is not None:
+            self._thread.join()
+
+
+_atualizador = None
+
+
+def get_diretorio() -> Optional[DiretorioClientes]:
+    """Retorna o diretorio deste processo, se habilitado e carregado"""
+    return _diretorio if _diretorio is not None and _diretorio.carregado else None
+
+
+def iniciar_diretorio(fontes: dict) -> Optional[DiretorioClientes]:
+    """
+    Carrega o diretorio (se SNAPSHOT_HABILITADO) a partir das `fontes`:
+    dict nome -> funcao que abre uma sessao no banco ou shard
+    """
+    global _diretorio, _atualizador
+    if not SNAPSHOT_HABILITADO or _diretorio is not None:
+        return _diretorio
+    _diretorio = DiretorioClientes()
+    _atualizador = AtualizadorDiretorio(_diretorio, fontes)
+    _atualizador.iniciar()
+    return _diretorio
+
+
+def parar_diretorio():
+    """Interrompe as atualizacoes e descarta o diretorio"""
+    global _diretorio, _atualizador
+    if _atualizador is not None:
+        _atualizador.parar()
+    _diretorio = None
+    _atualizador = None
@@ -0,0 +1,182 @@
+﻿"""
+Service Layer - Estatisticas de clientes a partir de agregados pre-calculados
+"""
+import os
+import threading
+import time
+from collections import Counter
+from datetime import date, datetime, timedelta, timezone
+from typing import Iterable, Optional, Tuple
+
+from sqlalchemy import select, func, update, insert
+from sqlalchemy.orm import Session
+
+from models.estatisticas import ClienteEstatisticaDia, ClienteEstatisticaDominio
+
+# Tempo maximo (segundos) que uma resposta de estatisticas fica em cache no
+# processo. Os agregados em si sao atualizados na mesma transacao do
+# cadastro; este e o unico atraso entre um cadastro e o /clientes/stats.
+# 0 desativa o cache.
+STATS_CACHE_TTL = float(os.getenv("STATS_CACHE_TTL", "5"))
+
+_cache = {}
+_cache_lock = threading.Lock()
+
+
+def dominio_do_email(email: str) -> str:
+    """Retorna o dominio (parte apos o @) de um email, em minusculas"""
+    return email.rsplit("@", 1)[-1].strip().lower()
+
+
+def dia_utc(momento: Optional[datetime]) -> date:
+    """Converte o timestamp de cadastro para o dia em UTC"""
+    if momento is None:
+        return datetime.now(timezone.utc).date()
+    if momento.tzinfo is not None:
+        momento = momento.astimezone(timezone.utc)
+    return momento.date()
+
+
+def limpar_cache():
+    """Descarta as respostas de estatisticas em cache"""
+    with _cache_lock:
+        _cache.clear()
+
+
+class EstatisticasService:
+    """
+    Classe responsavel pelas estatisticas de cadastro de clientes
+
+    Os totais por dia e por dominio sao mantidos incrementalmente em
+    tabelas pequenas, sem COUNT(*) sobre a tabela clientes.
+    """
+
+    def __init__(self, db: Session):
+        self.db = db
+
+    def registrar_cadastro(self, email: str, criado_em: Optional[datetime]):
+        """
+        Incrementa os agregados de um novo cliente
+
+        Nao faz commit: deve ser chamado na mesma transacao que insere o
+        cliente, para que os agregados nunca divirjam da tabela clientes.
+        """
+        self._incrementar(ClienteEstatisticaDia, "dia", dia_utc(criado_em))
+        self._incrementar(ClienteEstatisticaDominio, "dominio", dominio_do_email(email))
+
+    def remover_cadastro(self, email: str, criado_em: Optional[datetime]):
+        """Desfaz registrar_cadastro (cadastro que nao chegou a ser gravado)"""
+        self._incrementar(ClienteEstatisticaDia, "dia", dia_utc(criado_em), -1)
+        self._incrementar(ClienteEstatisticaDominio, "dominio", dominio_do_email(email), -1)
+
+    def registrar_trocas_de_email(self, trocas: Iterable[Tuple[str, str]]):
+        """
+        Move cada cliente do dominio do email anterior para o do novo
+
+        `trocas` sao pares (email anterior, email novo). Nao faz commit: deve
+        ser chamado na mesma transacao que altera os emails.
+        """
+        saldos = Counter()
+        for anterior, novo in trocas:
+            saldos[dominio_do_email(anterior)] -= 1
+            saldos[dominio_do_email(novo)] += 1
+        # Ordem fixa de dominios: transacoes concorrentes travam as linhas
+        # na mesma sequencia
+        for dominio, saldo in sorted(saldos.items()):
+            if saldo:
+                self._incrementar(ClienteEstatisticaDominio, "dominio", dominio, saldo)
+
+    def _incrementar(self, model, coluna: str, valor, quantidade: int = 1):
+        """Executa um upsert `total = total + quantidade` para a chave informada"""
+        tabela = model.__table__
+        dialeto = self.db.get_bind().dialect.name
+
+        if dialeto in ("postgresql", "sqlite"):
+            if dialeto == "postgresql":
+                from sqlalchemy.dialects.postgresql import insert as upsert
+            else:
+                from sqlalchemy.dialects.sqlite import insert as upsert
+            stmt = upsert(tabela).values({coluna: valor, "total": quantidade})
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[coluna],
+                set_={"total": tabela.c.total + quantidade}
+            )
+            self.db.execute(stmt)
+            return
+
+        resultado = self.db.execute(
+            update(tabela)
+            .where(tabela.c[coluna] == valor)
+            .values(total=tabela.c.total + quantidade)
+        )
+        if resultado.rowcount == 0:
+            self.db.execute(insert(tabela).values({coluna: valor, "total": quantidade}))
+
+    def obter_estatisticas(self, dias: int = 30, semanas: int = 12, dominios: int = 20) -> dict:
+        """
+        Retorna total de clientes, cadastros por dia/semana e por dominio
+
+        A resposta pode ter ate STATS_CACHE_TTL segundos de atraso.
+        """
+        chave = (dias, semanas, dominios)
+        agora = time.monotonic()
+        if STATS_CACHE_TTL > 0:
+            with _cache_lock:
+                em_cache = _cache.get(chave)
+            if em_cache and em_cache[0] > agora:
+                return em_cache[1]
+
+        resultado = self._calcular(dias, semanas, dominios)
+
+        if STATS_CACHE_TTL > 0:
+            with _cache_lock:
+                _cache[chave] = (agora + STATS_CACHE_TTL, resultado)
+        return resultado
+
+    def _calcular(self, dias: int, semanas: int, dominios: int) -> dict:
+        hoje = datetime.now(timezone.utc).date()
+        inicio_dias = hoje - timedelta(days=dias - 1)
+        inicio_semanas = hoje - timedelta(days=hoje.weekday() + 7 * (semanas - 1))
+
+        total = self.db.execute(
+            select(func.coalesce(func.sum(ClienteEstatisticaDia.total), 0))
+        ).scalar()
+
+        linhas = self.db.execute(
+            select(ClienteEstatisticaDia.dia, ClienteEstatisticaDia.total)
+            .where(ClienteEstatisticaDia.dia >= min(inicio_dias, inicio_semanas))
+            .order_by(ClienteEstatisticaDia.dia)
+        ).all()
+
+        por_dia = [
+            {"dia": dia, "total": quantidade}
+            for dia, quantidade in linhas if dia >= inicio_dias
+        ]
+
+        por_semana = {}
+        for dia, quantidade in linhas:
+            if dia < inicio_semanas:
+                continue
+            semana = dia - timedelta(days=dia.weekday())
+            por_semana[semana] = por_semana.get(semana, 0) + quantidade
+
+        por_dominio = self.db.execute(
+            select(ClienteEstatisticaDominio.dominio, ClienteEstatisticaDominio.total)
+            .where(ClienteEstatisticaDominio.total > 0)
+            .order_by(ClienteEstatisticaDominio.total.desc(), ClienteEstatisticaDominio.dominio)
+            .limit(dominios)
+        ).all()
+
+        return {
+            "total": total,
+            "por_dia": por_dia,
+            "por_semana": [
+                {"semana": semana, "total": quantidade}
+                for semana, quantidade in sorted(por_semana.items())
+            ],
+            "por_dominio": [
+                {"dominio": dominio, "total": quantidade}
+                for dominio, quantidade in por_dominio
+            ],
+            "gerado_em": datetime.now(timezone.utc),
+        }
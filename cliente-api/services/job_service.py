@@ -0,0 +1,531 @@
+﻿"""
+Service Layer - Jobs em segundo plano (importacoes e backfills)
+
+Os jobs sao gravados na tabela `jobs` e executados por um JobRunner, com
+um pool limitado de threads e engines proprias (JOBS_MAX_WORKERS conexoes
+no banco principal e em cada shard), fora do threadpool e dos pools de
+conexoes das requisicoes.
+O progresso e salvo ao final de cada lote; se o processo cair, outro
+worker retoma o job a partir do ultimo checkpoint apos o lease expirar.
+A entrada de uma importacao fica em jobs_lotes, um lote por linha da
+tabela, e nao no payload do job.
+"""
+import os
+import socket
+import threading
+import time
+import uuid
+from collections import Counter
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta, timezone
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from sqlalchemy import select, update, delete, insert, func, or_, and_
+from sqlalchemy.orm import Session, sessionmaker
+
+from database.connection import (
+    DATABASE_URL, JOBS_HABILITADOS, JOBS_MAX_WORKERS, criar_engine
+)
+from database.sharding import DB_SHARDS, ShardRouter
+from models.cliente import Cliente
+from models.estatisticas import ClienteEstatisticaDia, ClienteEstatisticaDominio
+from models.job import Job, JobAgregado, JobLote
+from schemas.cliente_schema import ClienteCreate
+from services.cliente_service import ClienteService
+from services.cliente_sharded_service import ClienteShardedService
+from services.estatisticas_service import dia_utc, dominio_do_email, limpar_cache
+
+# JOBS_MAX_WORKERS (jobs em paralelo por processo) e JOBS_HABILITADOS ficam
+# em database/connection.py: as conexoes dos jobs entram no orcamento do pool
+
+# Linhas processadas entre dois checkpoints
+JOBS_LOTE = int(os.getenv("JOBS_LOTE", "500"))
+
+# Sem heartbeat por este tempo, o job e considerado abandonado e retomado
+JOBS_LEASE_SEGUNDOS = int(os.getenv("JOBS_LEASE_SEGUNDOS", "60"))
+
+# Quantidade maxima de mensagens de erro guardadas por job
+MAX_ERROS_GUARDADOS = 100
+
+_runner = None
+
+
+class JobInterrompido(Exception):
+    """O runner esta parando ou o job foi assumido por outro worker"""
+
+
+class JobFechadoError(Exception):
+    """O job nao esta mais aberto para receber linhas de entrada"""
+
+
+def _agora() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+class JobService:
+    """
+    Classe responsavel pelo cadastro e consulta de jobs
+    """
+
+    def __init__(self, db: Session):
+        self.db = db
+
+    def criar_job(self, tipo: str, payload: Optional[dict] = None, total: Optional[int] = None,
+                  linhas: Optional[List[Any]] = None, aberto: bool = False) -> Job:
+        """
+        Registra um novo job como pendente
+
+        `linhas` (entrada de uma importacao) e gravada em jobs_lotes, em
+        lotes de JOBS_LOTE linhas, na mesma transacao do job. Um job
+        `aberto` nao e executado ate receber a ultima parte da entrada
+        (adicionar_linhas).
+        """
+        if tipo not in TIPOS_JOB:
+            raise ValueError(f"Tipo de job desconhecido: {tipo}")
+        if linhas is not None:
+            total = len(linhas)
+        job = Job(
+            id=uuid.uuid4().hex,
+            tipo=tipo,
+            status="aberto" if aberto else "pendente",
+            payload=payload,
+            checkpoint={},
+            total=total,
+            processados=0,
+            erros=0,
+            segundos_execucao=0.0
+        )
+        self.db.add(job)
+        if linhas:
+            self.db.flush()
+            self._gravar_lotes(job.id, 0, linhas)
+        self.db.commit()
+        self.db.refresh(job)
+        return job
+
+    def adicionar_linhas(self, job_id: str, linhas: List[Any], finalizar: bool = True
+                         ) -> Optional[Job]:
+        """
+        Acrescenta uma parte da entrada a um job aberto
+
+        Com `finalizar`, o job passa a pendente e pode ser executado.
+        Retorna None se o job nao existe e levanta JobFechadoError se ele
+        ja foi finalizado.
+        """
+        total = self.db.execute(
+            update(Job)
+            .where(Job.id == job_id, Job.status == "aberto")
+            .values(
+                total=Job.total + len(linhas),
+                status="pendente" if finalizar else "aberto"
+            )
+            .returning(Job.total)
+            .execution_options(synchronize_session=False)
+        ).scalar()
+        if total is None:
+            self.db.rollback()
+            job = self.buscar_por_id(job_id)
+            if job is None:
+                return None
+            raise JobFechadoError(f"Job {job_id} nao esta aberto (status {job.status})")
+        self._gravar_lotes(job_id, total - len(linhas), linhas)
+        self.db.commit()
+        return self.buscar_por_id(job_id)
+
+    def _gravar_lotes(self, job_id: str, inicio: int, linhas: List[Any]):
+        """Grava as linhas em lotes de JOBS_LOTE, numeradas a partir de `inicio`"""
+        self.db.execute(insert(JobLote), [
+            {"job_id": job_id, "inicio": inicio + n, "linhas": linhas[n:n + JOBS_LOTE]}
+            for n in range(0, len(linhas), JOBS_LOTE)
+        ])
+
+    def buscar_por_id(self, job_id: str) -> Optional[Job]:
+        """Busca um job pelo ID"""
+        return self.db.get(Job, job_id)
+
+
+class ContextoJob:
+    """
+    Estado de uma execucao de job, passado para a funcao do tipo do job
+    """
+
+    def __init__(self, runner: "JobRunner", db: Session, job: Job):
+        self.runner = runner
+        self.db = db
+        self.job_id = job.id
+        self.payload = job.payload or {}
+        self.checkpoint = dict(job.checkpoint or {})
+        self._ultimo_registro = time.monotonic()
+
+    def cliente_service(self) -> ClienteService:
+        """Service de clientes que usa as conexoes do runner, inclusive nos shards"""
+        if self.runner.router is None:
+            return ClienteService(self.db)
+        return ClienteShardedService(self.db, self.runner.router)
+
+    def registrar_linha(self, db: Session, checkpoint: dict, processados: int, erros: int = 0):
+        """
+        Avanca checkpoint e contadores na transacao em andamento em `db`
+
+        Nao faz commit: e chamado logo antes do commit que grava a linha,
+        para que a linha e o checkpoint sejam confirmados juntos. Levanta
+        JobInterrompido se outro worker tiver assumido o job.
+        """
+        resultado = db.execute(
+            update(Job)
+            .where(Job.id == self.job_id, Job.dono == self.runner.dono)
+            .values(
+                checkpoint=checkpoint,
+                processados=Job.processados + processados,
+                erros=Job.erros + erros
+            )
+            .execution_options(synchronize_session=False)
+        )
+        if resultado.rowcount != 1:
+            raise JobInterrompido()
+        self.checkpoint = checkpoint
+
+    def salvar_progresso(self, checkpoint: dict, processados: int, erros: List[str] = (),
+                         novos_erros: Optional[int] = None):
+        """
+        Grava checkpoint, contadores e heartbeat do lote concluido
+
+        `erros` sao as mensagens guardadas em ultimos_erros; `novos_erros`
+        (padrao: len(erros)) e quanto somar ao contador, excluindo erros ja
+        contabilizados por registrar_linha.
+
+        Levanta JobInterrompido se o runner estiver parando ou se outro
+        worker tiver assumido o job; o lote ja salvo nao e perdido.
+        """
+        agora = time.monotonic()
+        decorrido = agora - self._ultimo_registro
+        self._ultimo_registro = agora
+
+        job = self.db.get(Job, self.job_id, populate_existing=True)
+        if job is None or job.dono != self.runner.dono:
+            self.db.rollback()
+            raise JobInterrompido()
+        job.checkpoint = checkpoint
+        job.processados += processados
+        job.erros += len(erros) if novos_erros is None else novos_erros
+        if erros:
+            job.ultimos_erros = ((job.ultimos_erros or []) + list(erros))[-MAX_ERROS_GUARDADOS:]
+        job.segundos_execucao += decorrido
+        job.heartbeat_em = _agora()
+        self.db.commit()
+        self.checkpoint = checkpoint
+
+        if self.runner.parando:
+            raise JobInterrompido()
+
+
+class JobRunner:
+    """
+    Executa jobs em um pool limitado de threads com engine propria
+    """
+
+    def __init__(self, url: str = DATABASE_URL, max_workers: int = JOBS_MAX_WORKERS,
+                 shards: Optional[List[str]] = None):
+        self.engine = criar_engine(url, pool_size=max_workers, max_overflow=0)
+        shards = DB_SHARDS if shards is None else shards
+        self.router = ShardRouter(shards, pool_size=max_workers) if shards else None
+        self.SessionJobs = sessionmaker(autocommit=False, autoflush=False, bind=self.engine)
+        self.dono = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job")
+        self._parar = threading.Event()
+        self._monitor = None
+
+    @property
+    def parando(self) -> bool:
+        return self._parar.is_set()
+
+    def iniciar(self):
+        """Retoma jobs pendentes e verifica periodicamente jobs abandonados"""
+        self.retomar_pendentes()
+        self._monitor = threading.Thread(target=self._monitorar, name="job-monitor", daemon=True)
+        self._monitor.start()
+
+    def parar(self):
+        """
+        Para o runner: jobs em execucao salvam o lote atual e voltam para
+        pendente, podendo ser retomados por outro worker imediatamente
+        """
+        self._parar.set()
+        self._executor.shutdown(wait=True, cancel_futures=True)
+        if self.router is not None:
+            self.router.dispose()
+        self.engine.dispose()
+
+    def submeter(self, job_id: str):
+        """Agenda a execucao de um job"""
+        if not self.parando:
+            self._executor.submit(self._executar, job_id)
+
+    def retomar_pendentes(self):
+        """Agenda os jobs pendentes e os que perderam o lease"""
+        limite = _agora() - timedelta(seconds=JOBS_LEASE_SEGUNDOS)
+        with self.SessionJobs() as db:
+            ids = db.execute(
+                select(Job.id).where(or_(
+                    Job.status == "pendente",
+                    and_(Job.status == "executando", Job.heartbeat_em < limite)
+                )).order_by(Job.criado_em)
+            ).scalars().all()
+        for job_id in ids:
+            self.submeter(job_id)
+
+    def _monitorar(self):
+        while not self._parar.wait(JOBS_LEASE_SEGUNDOS):
+            self.retomar_pendentes()
+
+    def _reivindicar(self, db: Session, job_id: str) -> bool:
+        """Assume o job via UPDATE condicional (lease), evitando execucao dupla"""
+        agora = _agora()
+        limite = agora - timedelta(seconds=JOBS_LEASE_SEGUNDOS)
+        resultado = db.execute(
+            update(Job)
+            .where(
+                Job.id == job_id,
+                or_(
+                    Job.status == "pendente",
+                    and_(Job.status == "executando", Job.heartbeat_em < limite)
+                )
+            )
+            .values(status="executando", dono=self.dono, heartbeat_em=agora)
+        )
+        db.commit()
+        return resultado.rowcount == 1
+
+    def _executar(self, job_id: str):
+        db = self.SessionJobs()
+        try:
+            if not self._reivindicar(db, job_id):
+                return
+            job = db.get(Job, job_id)
+            if job.iniciado_em is None:
+                job.iniciado_em = _agora()
+                db.commit()
+
+            try:
+                TIPOS_JOB[job.tipo](ContextoJob(self, db, job))
+            except JobInterrompido:
+                db.rollback()
+                self._finalizar(db, job_id, status="pendente", finalizado=False)
+                return
+            except Exception as e:
+                db.rollback()
+                self._finalizar(db, job_id, status="falhou", erro=f"{type(e).__name__}: {e}")
+                return
+            self._finalizar(db, job_id, status="concluido")
+        finally:
+            db.close()
+
+    def _finalizar(self, db: Session, job_id: str, status: str,
+                   erro: Optional[str] = None, finalizado: bool = True):
+        """Atualiza o status final, desde que o job ainda pertenca a este runner"""
+        job = db.get(Job, job_id, populate_existing=True)
+        if job is None or job.dono != self.dono:
+            return
+        job.status = status
+        job.dono = None
+        if erro:
+            job.erros += 1
+            job.ultimos_erros = ((job.ultimos_erros or []) + [erro])[-MAX_ERROS_GUARDADOS:]
+        if finalizado:
+            job.finalizado_em = _agora()
+        db.commit()
+
+
+def _lotes_importacao(contexto: ContextoJob, proxima: int) -> Iterator[Tuple[int, list]]:
+    """
+    (inicio, linhas) de cada lote de entrada a partir da linha `proxima`
+
+    Le um lote por vez de jobs_lotes.
+    """
+    consulta = select(JobLote.inicio, JobLote.linhas).where(JobLote.job_id == contexto.job_id)
+    lote = contexto.db.execute(
+        consulta.where(JobLote.inicio <= proxima).order_by(JobLote.inicio.desc()).limit(1)
+    ).first()
+    while lote is not None:
+        yield lote.inicio, lote.linhas
+        lote = contexto.db.execute(
+            consulta.where(JobLote.inicio > lote.inicio).order_by(JobLote.inicio).limit(1)
+        ).first()
+
+
+def _importar_clientes(contexto: ContextoJob):
+    """
+    Importa os clientes gravados em jobs_lotes, validando cada um com ClienteCreate
+
+    Cada cliente e confirmado na mesma transacao que avanca o checkpoint e
+    os contadores do job (ContextoJob.registrar_linha). Um job retomado
+    continua da linha seguinte a ultima gravada, sem reprocessar clientes
+    ja importados; as mensagens de erro sao gravadas ao final de cada lote.
+    Com shards, o checkpoint e confirmado com a reserva no indice global, e
+    o job retomado completa a ultima linha se ela nao chegou ao shard.
+    """
+    service = contexto.cliente_service()
+    _concluir_ultima_linha(contexto, service)
+    proxima = contexto.checkpoint.get("proxima_linha", 0)
+    for inicio, linhas in _lotes_importacao(contexto, proxima):
+        mensagens = []
+        # Linhas e erros ainda nao somados aos contadores do job
+        pendentes = erros_pendentes = 0
+        for numero, linha in enumerate(linhas, start=inicio):
+            if numero < proxima:
+                continue
+            pendentes += 1
+            try:
+                service.criar_cliente(
+                    ClienteCreate.model_validate(linha),
+                    ao_confirmar=lambda db, cliente: contexto.registrar_linha(
+                        db, {"proxima_linha": numero + 1, "cliente_id": cliente.id},
+                        pendentes, erros_pendentes
+                    )
+                )
+            except ValueError as e:
+                mensagens.append(f"linha {numero}: {e}")
+                erros_pendentes += 1
+                continue
+            pendentes = erros_pendentes = 0
+        contexto.salvar_progresso(
+            {"proxima_linha": inicio + len(linhas)}, pendentes, mensagens,
+            novos_erros=erros_pendentes
+        )
+
+    contexto.db.execute(delete(JobLote).where(JobLote.job_id == contexto.job_id))
+    contexto.db.commit()
+
+
+def _concluir_ultima_linha(contexto: ContextoJob, service: ClienteService):
+    """
+    Com shards, grava o cliente da ultima linha confirmada caso o processo
+    tenha caido entre a reserva no indice global e o commit no shard
+    """
+    cliente_id = contexto.checkpoint.get("cliente_id")
+    if cliente_id is None or not isinstance(service, ClienteShardedService):
+        return
+    numero = contexto.checkpoint["proxima_linha"] - 1
+    inicio, linhas = next(_lotes_importacao(contexto, numero))
+    service.concluir_cadastro(cliente_id, ClienteCreate.model_validate(linhas[numero - inicio]))
+
+
+@contextmanager
+def _sessao_clientes(contexto: ContextoJob, indice: int):
+    """Sessao onde estao os clientes: o proprio banco ou o shard `indice`"""
+    router = contexto.runner.router
+    if router is None:
+        yield contexto.db
+        return
+    db = router.sessao(indice)
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+def _ler_lote_clientes(db: Session, ultimo_id: int):
+    return db.execute(
+        select(Cliente.id, Cliente.email, Cliente.criado_em)
+        .where(Cliente.id > ultimo_id)
+        .order_by(Cliente.id)
+        .limit(JOBS_LOTE)
+    ).all()
+
+
+def _recalcular_estatisticas(contexto: ContextoJob):
+    """
+    Recalcula do zero as tabelas de estatisticas de clientes
+
+    Percorre os clientes por id (keyset), em cada shard. As contagens de
+    cada lote vao para jobs_agregados na mesma transacao do checkpoint, que
+    guarda apenas o cursor de cada shard. Ao final, substitui os agregados
+    em uma transacao, incluindo os clientes cadastrados durante a varredura.
+    """
+    router = contexto.runner.router
+    quantidade = router.quantidade if router else 1
+    cursores = contexto.checkpoint.get("cursores", [0] * quantidade)
+
+    def contar(linhas):
+        dias, dominios = Counter(), Counter()
+        for _, email, criado_em in linhas:
+            dias[dia_utc(criado_em).isoformat()] += 1
+            dominios[dominio_do_email(email)] += 1
+        return dias, dominios
+
+    db = contexto.db
+    for indice in range(quantidade):
+        while True:
+            with _sessao_clientes(contexto, indice) as fonte:
+                linhas = _ler_lote_clientes(fonte, cursores[indice])
+            if not linhas:
+                break
+            dias, dominios = contar(linhas)
+            db.execute(insert(JobAgregado), [
+                {"job_id": contexto.job_id, "grupo": grupo, "chave": chave, "total": total}
+                for grupo, contagens in (("dia", dias), ("dominio", dominios))
+                for chave, total in contagens.items()
+            ])
+            cursores[indice] = linhas[-1][0]
+            contexto.salvar_progresso({"cursores": cursores}, len(linhas))
+
+    totais = {"dia": Counter(), "dominio": Counter()}
+    for grupo, chave, total in db.execute(
+        select(JobAgregado.grupo, JobAgregado.chave, func.sum(JobAgregado.total))
+        .where(JobAgregado.job_id == contexto.job_id)
+        .group_by(JobAgregado.grupo, JobAgregado.chave)
+    ):
+        totais[grupo][chave] = total
+    for indice in range(quantidade):
+        with _sessao_clientes(contexto, indice) as fonte:
+            while linhas := _ler_lote_clientes(fonte, cursores[indice]):
+                dias, dominios = contar(linhas)
+                totais["dia"].update(dias)
+                totais["dominio"].update(dominios)
+                cursores[indice] = linhas[-1][0]
+
+    db.execute(delete(ClienteEstatisticaDia))
+    db.execute(delete(ClienteEstatisticaDominio))
+    if totais["dia"]:
+        db.execute(insert(ClienteEstatisticaDia), [
+            {"dia": date.fromisoformat(dia), "total": total}
+            for dia, total in totais["dia"].items()
+        ])
+    if totais["dominio"]:
+        db.execute(insert(ClienteEstatisticaDominio), [
+            {"dominio": dominio, "total": total}
+            for dominio, total in totais["dominio"].items()
+        ])
+    db.execute(delete(JobAgregado).where(JobAgregado.job_id == contexto.job_id))
+    db.commit()
+    limpar_cache()
+
+
+# Tipos de job disponiveis: nome -> funcao(contexto)
+TIPOS_JOB: Dict[str, Callable[[ContextoJob], None]] = {
+    "importacao_clientes": _importar_clientes,
+    "recalculo_estatisticas": _recalcular_estatisticas,
+}
+
+
+def get_job_runner() -> Optional[JobRunner]:
+    """Retorna o runner deste processo (None se os jobs estiverem desabilitados)"""
+    return _runner
+
+
+def iniciar_job_runner() -> Optional[JobRunner]:
+    """Cria e inicia o runner deste processo, se JOBS_HABILITADOS"""
+    global _runner
+    if _runner is None and JOBS_HABILITADOS:
+        _runner = JobRunner()
+        _runner.iniciar()
+    return _runner
+
+
+def parar_job_runner():
+    """Para o runner deste processo"""
+    global _runner
+    if _runner is not None:
+        _runner.parar()
+        _runner = None
@@ -0,0 +1,53 @@
+"""
+Fixtures compartilhadas pelos testes que usam um banco SQLite migrado
+"""
+import pytest
+from sqlalchemy.orm import sessionmaker
+
+from database.connection import criar_engine
+from database.migrations import aplicar_migracoes
+from schemas.cliente_schema import ClienteCreate
+from services.estatisticas_service import limpar_cache
+
+
+@pytest.fixture
+def url_banco(tmp_path):
+    """URL de um banco SQLite vazio em arquivo temporario"""
+    return f"sqlite:///{tmp_path / 'clientes.db'}"
+
+
+@pytest.fixture
+def engine(url_banco):
+    """Engine do banco temporario com o schema migrado"""
+    engine = criar_engine(url_banco)
+    aplicar_migracoes(engine)
+    limpar_cache()
+    yield engine
+    engine.dispose()
+
+
+@pytest.fixture
+def sessoes(engine):
+    return sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+
+@pytest.fixture
+def db_session(sessoes):
+    db = sessoes()
+    yield db
+    db.close()
+
+
+def _criar_clientes(service, nomes):
+    """Cadastra um cliente por nome, com email derivado do nome"""
+    return [
+        service.criar_cliente(ClienteCreate(
+            nome=nome, email=f"{nome.replace(' ', '').lower()}@email.com"
+        ))
+        for nome in nomes
+    ]
+
+
+@pytest.fixture
+def criar_clientes():
+    return _criar_clientes
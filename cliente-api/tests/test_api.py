@@ -199,4 +199,158 @@ def test_listar_clientes_com_nome_vazio():
 
 def test_root_endpoint_method_not_allowed():
     response = client.post("/")
-    assert response.status_code == 405
\ No newline at end of file
+    assert response.status_code == 405
+
+@patch("services.estatisticas_service.EstatisticasService.obter_estatisticas")
+def test_estatisticas_clientes(mock_obter_estatisticas):
+    mock_obter_estatisticas.return_value = {
+        "total": 3,
+        "por_dia": [{"dia": "2024-01-01", "total": 3}],
+        "por_semana": [{"semana": "2024-01-01", "total": 3}],
+        "por_dominio": [{"dominio": "example.com", "total": 3}],
+        "gerado_em": datetime(2024, 1, 1, 12, 0, 0),
+    }
+    response = client.get("/clientes/stats?dias=7")
+    assert response.status_code == 200
+    data = response.json()
+    assert data["total"] == 3
+    assert data["por_dominio"][0]["dominio"] == "example.com"
+    mock_obter_estatisticas.assert_called_once_with(7, 12, 20)
+
+def test_estatisticas_clientes_parametro_invalido():
+    response = client.get("/clientes/stats?dias=0")
+    assert response.status_code == 422
+
+@patch("services.job_service.JobService.criar_job")
+@patch("database.connection.get_db")
+def test_importar_clientes_agenda_job(mock_get_db, mock_criar_job):
+    mock_get_db.return_value = MagicMock()
+    mock_criar_job.return_value = MagicMock(
+        id="abc123", tipo="importacao_clientes", status="pendente", total=1,
+        processados=0, erros=0, linhas_por_segundo=0.0, ultimos_erros=None,
+        criado_em=datetime(2024, 1, 1, 0, 0, 0), iniciado_em=None, finalizado_em=None
+    )
+    payload = {"clientes": [{"nome": "Maria Silva", "email": "maria@example.com"}]}
+    response = client.post("/jobs/importacao-clientes", json=payload)
+    assert response.status_code == 202
+    data = response.json()
+    assert data["id"] == "abc123"
+    assert data["status"] == "pendente"
+    assert data["ultimos_erros"] == []
+    mock_criar_job.assert_called_once_with(
+        "importacao_clientes", None, None, payload["clientes"]
+    )
+
+def test_importar_clientes_lista_vazia():
+    response = client.post("/jobs/importacao-clientes", json={"clientes": []})
+    assert response.status_code == 422
+
+def test_importar_clientes_acima_do_limite_por_requisicao():
+    from schemas.job_schema import MAX_CLIENTES_POR_REQUISICAO
+    clientes = [{"nome": "Ana", "email": "ana@email.com"}] * (MAX_CLIENTES_POR_REQUISICAO + 1)
+    response = client.post("/jobs/importacao-clientes", json={"clientes": clientes})
+    assert response.status_code == 422
+
+@patch("services.job_service.JobService.adicionar_linhas")
+@patch("database.connection.get_db")
+def test_adicionar_lote_job_finalizado(mock_get_db, mock_adicionar_linhas):
+    from services.job_service import JobFechadoError
+    mock_get_db.return_value = MagicMock()
+    mock_adicionar_linhas.side_effect = JobFechadoError("Job abc123 nao esta aberto")
+    response = client.post(
+        "/jobs/abc123/lotes", json={"clientes": [{"nome": "Ana", "email": "ana@email.com"}]}
+    )
+    assert response.status_code == 409
+
+@patch("services.job_service.JobService.adicionar_linhas")
+@patch("database.connection.get_db")
+def test_adicionar_lote_job_inexistente(mock_get_db, mock_adicionar_linhas):
+    mock_get_db.return_value = MagicMock()
+    mock_adicionar_linhas.return_value = None
+    response = client.post(
+        "/jobs/naoexiste/lotes", json={"clientes": [{"nome": "Ana", "email": "ana@email.com"}]}
+    )
+    assert response.status_code == 404
+
+@patch("services.job_service.JobService.buscar_por_id")
+@patch("database.connection.get_db")
+def test_consultar_job_inexistente(mock_get_db, mock_buscar_por_id):
+    mock_get_db.return_value = MagicMock()
+    mock_buscar_por_id.return_value = None
+    response = client.get("/jobs/naoexiste")
+    assert response.status_code == 404
+    assert "nao encontrado" in response.json()["detail"].lower()
+
+
+def _cliente_atualizado(id=1, nome="Maria Souza", versao=2):
+    return ClienteResponse(
+        id=id, nome=nome, email="maria@example.com", telefone=None,
+        criado_em=datetime(2024, 1, 1, 0, 0, 0),
+        atualizado_em=datetime(2024, 1, 2, 0, 0, 0), versao=versao
+    )
+
+@patch("services.cliente_service.ClienteService.atualizar_cliente")
+@patch("database.connection.get_db")
+def test_atualizar_cliente(mock_get_db, mock_atualizar_cliente):
+    mock_get_db.return_value = MagicMock()
+    mock_atualizar_cliente.return_value = _cliente_atualizado()
+    response = client.patch("/clientes/1", json={"nome": "Maria Souza", "versao": 1})
+    assert response.status_code == 200
+    assert response.json()["versao"] == 2
+    cliente_id, dados = mock_atualizar_cliente.call_args.args
+    assert cliente_id == 1
+    assert dados.campos_alterados() == {"nome": "Maria Souza"}
+
+@patch("services.cliente_service.ClienteService.atualizar_cliente")
+@patch("database.connection.get_db")
+def test_atualizar_cliente_versao_desatualizada(mock_get_db, mock_atualizar_cliente):
+    from services.cliente_service import ConflitoVersaoError
+    mock_get_db.return_value = MagicMock()
+    mock_atualizar_cliente.side_effect = ConflitoVersaoError(
+        [{"id": 1, "versao_informada": 1, "versao_atual": 3}]
+    )
+    response = client.patch("/clientes/1", json={"nome": "Maria Souza", "versao": 1})
+    assert response.status_code == 409
+    assert response.json()["detail"]["conflitos"][0]["versao_atual"] == 3
+
+@patch("services.cliente_service.ClienteService.atualizar_cliente")
+@patch("database.connection.get_db")
+def test_atualizar_cliente_email_duplicado(mock_get_db, mock_atualizar_cliente):
+    mock_get_db.return_value = MagicMock()
+    mock_atualizar_cliente.side_effect = ValueError("Email joao@example.com ja esta cadastrado")
+    response = client.patch("/clientes/1", json={"email": "joao@example.com", "versao": 1})
+    assert response.status_code == 400
+    assert "ja esta cadastrado" in response.json()["detail"]
+
+@patch("services.cliente_service.ClienteService.atualizar_cliente")
+@patch("database.connection.get_db")
+def test_atualizar_cliente_inexistente(mock_get_db, mock_atualizar_cliente):
+    mock_get_db.return_value = MagicMock()
+    mock_atualizar_cliente.return_value = None
+    response = client.patch("/clientes/999", json={"nome": "Ninguem", "versao": 1})
+    assert response.status_code == 404
+
+def test_atualizar_cliente_sem_versao():
+    response = client.patch("/clientes/1", json={"nome": "Maria Souza"})
+    assert response.status_code == 422
+
+@patch("services.cliente_service.ClienteService.atualizar_em_lote")
+@patch("database.connection.get_db")
+def test_atualizar_clientes_em_lote(mock_get_db, mock_atualizar_em_lote):
+    mock_get_db.return_value = MagicMock()
+    mock_atualizar_em_lote.return_value = [_cliente_atualizado(1), _cliente_atualizado(2, "Joao")]
+    payload = {"clientes": [
+        {"id": 1, "versao": 1, "nome": "Maria Souza"},
+        {"id": 2, "versao": 1, "nome": "Joao"},
+    ]}
+    response = client.patch("/clientes", json=payload)
+    assert response.status_code == 200
+    assert [c["id"] for c in response.json()] == [1, 2]
+
+def test_atualizar_clientes_em_lote_ids_repetidos():
+    payload = {"clientes": [
+        {"id": 1, "versao": 1, "nome": "Maria"},
+        {"id": 1, "versao": 2, "nome": "Maria Souza"},
+    ]}
+    response = client.patch("/clientes", json=payload)
+    assert response.status_code == 422
@@ -0,0 +1,253 @@
+"""
+Testes da atualizacao de clientes com controle de concorrencia otimista
+"""
+import pytest
+from sqlalchemy import event
+from sqlalchemy.dialects import postgresql
+
+from schemas.cliente_schema import ClienteCreate, ClienteUpdate, ClienteUpdateLote
+from services.cliente_service import (
+    ClienteService, ConflitoVersaoError, UPDATE_VERSIONADO_COM_EMAIL_ANTERIOR,
+    _update_em_lote_valores
+)
+from services.estatisticas_service import EstatisticasService
+
+
+@pytest.fixture
+def cliente_service(db_session):
+    return ClienteService(db_session)
+
+
+@pytest.fixture
+def comandos(engine):
+    """Registra (sql, executemany) de cada comando enviado ao banco"""
+    registrados = []
+
+    def registrar(conexao, cursor, statement, parametros, contexto, executemany):
+        registrados.append((statement.split()[0], executemany))
+
+    event.listen(engine, "before_cursor_execute", registrar)
+    yield registrados
+    event.remove(engine, "before_cursor_execute", registrar)
+
+
+def test_atualizar_cliente_um_unico_update(cliente_service, comandos, criar_clientes):
+    """Campos enviados sao alterados e a versao incrementada em um unico comando"""
+    cliente = criar_clientes(cliente_service, ["Maria Silva"])[0]
+    assert cliente.versao == 1
+    comandos.clear()
+
+    atualizado = cliente_service.atualizar_cliente(
+        cliente.id, ClienteUpdate(nome="  Maria Souza ", telefone="11999999999", versao=1)
+    )
+
+    assert [c for c, _ in comandos] == ["UPDATE"]
+    assert atualizado.nome == "Maria Souza"
+    assert atualizado.telefone == "11999999999"
+    assert atualizado.versao == 2
+    assert atualizado.atualizado_em is not None
+    assert cliente_service.buscar_por_id(cliente.id).nome == "Maria Souza"
+
+
+def test_atualizar_cliente_troca_de_email(cliente_service, comandos, criar_clientes):
+    """
+    Fora do PostgreSQL o email anterior (para ajustar as estatisticas) e lido
+    antes do UPDATE: o SQLite nao aceita colunas do FROM no RETURNING
+    """
+    cliente = criar_clientes(cliente_service, ["Maria Silva"])[0]
+    comandos.clear()
+
+    atualizado = cliente_service.atualizar_cliente(
+        cliente.id, ClienteUpdate(nome="  Maria Souza ", email="Maria@Souza.com", versao=1)
+    )
+
+    assert [c for c, _ in comandos] == ["SELECT", "UPDATE", "INSERT", "INSERT"]
+    assert atualizado.nome == "Maria Souza"
+    assert atualizado.email == "maria@souza.com"
+    assert atualizado.versao == 2
+    assert atualizado.atualizado_em is not None
+    assert cliente_service.buscar_por_id(cliente.id).nome == "Maria Souza"
+
+
+def test_atualizar_cliente_remove_telefone(cliente_service):
+    """Telefone nulo remove o telefone; campos nao enviados sao mantidos"""
+    cliente = cliente_service.criar_cliente(
+        ClienteCreate(nome="Ana", email="ana@email.com", telefone="11999999999")
+    )
+
+    atualizado = cliente_service.atualizar_cliente(
+        cliente.id, ClienteUpdate(telefone=None, versao=1)
+    )
+
+    assert atualizado.telefone is None
+    assert atualizado.nome == "Ana"
+
+
+def test_atualizar_cliente_versao_desatualizada(cliente_service, criar_clientes):
+    """Uma versao antiga e recusada sem alterar o cliente"""
+    cliente = criar_clientes(cliente_service, ["Maria Silva"])[0]
+    cliente_service.atualizar_cliente(cliente.id, ClienteUpdate(nome="Primeira", versao=1))
+
+    with pytest.raises(ConflitoVersaoError) as erro:
+        cliente_service.atualizar_cliente(cliente.id, ClienteUpdate(nome="Segunda", versao=1))
+
+    assert erro.value.conflitos == [{"id": cliente.id, "versao_informada": 1, "versao_atual": 2}]
+    assert cliente_service.buscar_por_id(cliente.id).nome == "Primeira"
+
+
+def test_atualizar_cliente_inexistente(cliente_service):
+    assert cliente_service.atualizar_cliente(999, ClienteUpdate(nome="Ninguem", versao=1)) is None
+
+
+def test_atualizar_cliente_email_duplicado(cliente_service, criar_clientes):
+    """A restricao unique do email gera o mesmo erro do cadastro"""
+    maria, _ = criar_clientes(cliente_service, ["Maria Silva", "Joao Silva"])
+
+    with pytest.raises(ValueError, match="Email joaosilva@email.com ja esta cadastrado"):
+        cliente_service.atualizar_cliente(
+            maria.id, ClienteUpdate(email="joaosilva@email.com", versao=1)
+        )
+
+    assert cliente_service.buscar_por_id(maria.id).versao == 1
+
+
+def test_update_exige_algum_campo():
+    with pytest.raises(ValueError):
+        ClienteUpdate(versao=1)
+    with pytest.raises(ValueError):
+        ClienteUpdate(nome=None, versao=1)
+
+
+def test_atualizar_em_lote_executemany(cliente_service, comandos, criar_clientes):
+    """Fora do PostgreSQL, itens com os mesmos campos sao um unico executemany"""
+    ids = [c.id for c in criar_clientes(cliente_service, ["Ana", "Bia", "Caio"])]
+    itens = [
+        ClienteUpdateLote(id=cliente_id, versao=1, telefone=f"1100000000{i}")
+        for i, cliente_id in enumerate(ids)
+    ]
+    comandos.clear()
+
+    atualizados = cliente_service.atualizar_em_lote(itens)
+
+    assert comandos == [("UPDATE", True), ("SELECT", False)]
+    assert [c.id for c in atualizados] == ids
+    assert [c.versao for c in atualizados] == [2, 2, 2]
+    assert cliente_service.buscar_por_id(ids[2]).telefone == "11000000002"
+
+
+def test_atualizar_em_lote_conflito_nao_grava_nada(cliente_service, criar_clientes):
+    """Se um item estiver desatualizado, nenhum cliente do lote e alterado"""
+    ana, bia = criar_clientes(cliente_service, ["Ana", "Bia"])
+    cliente_service.atualizar_cliente(bia.id, ClienteUpdate(nome="Beatriz", versao=1))
+
+    with pytest.raises(ConflitoVersaoError) as erro:
+        cliente_service.atualizar_em_lote([
+            ClienteUpdateLote(id=ana.id, versao=1, nome="Ana Maria"),
+            ClienteUpdateLote(id=bia.id, versao=1, nome="Bia"),
+            ClienteUpdateLote(id=999, versao=1, nome="Ninguem"),
+        ])
+
+    assert erro.value.conflitos == [
+        {"id": bia.id, "versao_informada": 1, "versao_atual": 2},
+        {"id": 999, "versao_informada": 1, "versao_atual": None},
+    ]
+    assert cliente_service.buscar_por_id(ana.id).nome == "Ana"
+
+
+def test_atualizar_em_lote_email_duplicado(cliente_service, criar_clientes):
+    ana, bia = criar_clientes(cliente_service, ["Ana", "Bia"])
+
+    with pytest.raises(ValueError, match="Email bia@email.com ja esta cadastrado"):
+        cliente_service.atualizar_em_lote([
+            ClienteUpdateLote(id=ana.id, versao=1, email="bia@email.com"),
+        ])
+
+    assert cliente_service.buscar_por_id(ana.id).email == "ana@email.com"
+
+
+def test_atualizar_em_lote_sem_rowcount_de_executemany(
+    cliente_service, engine, comandos, monkeypatch, criar_clientes
+):
+    """Drivers sem rowcount confiavel no executemany executam um UPDATE por item"""
+    monkeypatch.setattr(engine.dialect, "supports_sane_multi_rowcount", False)
+    ana, bia = criar_clientes(cliente_service, ["Ana", "Bia"])
+    itens = [
+        ClienteUpdateLote(id=ana.id, versao=1, nome="Ana Maria"),
+        ClienteUpdateLote(id=bia.id, versao=1, nome="Beatriz"),
+    ]
+    comandos.clear()
+
+    atualizados = cliente_service.atualizar_em_lote(itens)
+
+    assert comandos == [("UPDATE", False), ("UPDATE", False), ("SELECT", False)]
+    assert [c.nome for c in atualizados] == ["Ana Maria", "Beatriz"]
+
+
+def test_atualizar_em_lote_postgresql_um_update_por_grupo():
+    """No PostgreSQL o grupo inteiro vai em um UPDATE ... FROM (VALUES ...) RETURNING"""
+    stmt = _update_em_lote_valores(("nome", "telefone"), [
+        {"cliente_id": 1, "versao_esperada": 1, "novo_nome": "Ana", "novo_telefone": None},
+        {"cliente_id": 2, "versao_esperada": 3, "novo_nome": "Bia", "novo_telefone": "11"},
+    ])
+
+    sql = " ".join(str(stmt.compile(dialect=postgresql.dialect())).split())
+
+    assert sql.startswith("UPDATE clientes SET nome=v.novo_nome, telefone=v.novo_telefone")
+    assert "FROM (VALUES (" in sql
+    assert ") AS v (cliente_id, versao_esperada, novo_nome, novo_telefone)" in sql
+    assert "WHERE clientes.id = v.cliente_id AND clientes.versao = v.versao_esperada" in sql
+    assert "FOR UPDATE" not in sql
+    assert sql.endswith(
+        "RETURNING clientes.id, clientes.nome, clientes.email, clientes.telefone, "
+        "clientes.criado_em, clientes.atualizado_em, clientes.versao"
+    )
+
+
+def test_atualizar_em_lote_postgresql_email_anterior_no_update():
+    """Uma troca de email le o email anterior (linha travada) no proprio UPDATE"""
+    stmt = _update_em_lote_valores(("email",), [
+        {"cliente_id": 1, "versao_esperada": 1, "novo_email": "ana@novo.com"},
+    ])
+
+    sql = " ".join(str(stmt.compile(dialect=postgresql.dialect())).split())
+
+    assert (
+        ") AS v (cliente_id, versao_esperada, novo_email), (SELECT clientes.id AS id, "
+        "clientes.email AS email FROM clientes WHERE clientes.id IN ("
+    ) in sql
+    assert "FOR UPDATE) AS anterior WHERE" in sql
+    assert sql.endswith("clientes.versao, anterior.email AS email_1")
+
+
+def test_atualizar_cliente_postgresql_email_anterior_no_update():
+    """No PostgreSQL a troca de email e um unico UPDATE ... FROM ... RETURNING"""
+    stmt = UPDATE_VERSIONADO_COM_EMAIL_ANTERIOR.values(email="ana@novo.com")
+
+    sql = " ".join(str(stmt.compile(dialect=postgresql.dialect())).split())
+
+    assert sql.startswith("UPDATE clientes SET email=%(email)s")
+    assert (
+        "FROM (SELECT clientes.id AS id, clientes.email AS email FROM clientes "
+        "WHERE clientes.id = %(cliente_id)s FOR UPDATE) AS anterior"
+    ) in sql
+    assert "WHERE clientes.id = anterior.id AND clientes.versao = %(versao_esperada)s" in sql
+    assert sql.endswith("clientes.versao, anterior.email AS email_1")
+
+
+def test_troca_de_email_move_o_cliente_de_dominio(cliente_service, db_session, criar_clientes):
+    """Atualizacoes individuais e em lote ajustam as estatisticas por dominio"""
+    ana, bia, caio = criar_clientes(cliente_service, ["Ana", "Bia", "Caio"])
+
+    cliente_service.atualizar_cliente(ana.id, ClienteUpdate(email="ana@empresa.com", versao=1))
+    cliente_service.atualizar_em_lote([
+        ClienteUpdateLote(id=bia.id, versao=1, email="bia@empresa.com"),
+        ClienteUpdateLote(id=caio.id, versao=1, email="CAIO@email.com"),
+    ])
+    with pytest.raises(ConflitoVersaoError):
+        cliente_service.atualizar_cliente(caio.id, ClienteUpdate(email="caio@x.com", versao=1))
+
+    estatisticas = EstatisticasService(db_session).obter_estatisticas()
+    assert estatisticas["total"] == 3
+    assert estatisticas["por_dominio"] == [
+        {"dominio": "empresa.com", "total": 2}, {"dominio": "email.com", "total": 1}
+    ]
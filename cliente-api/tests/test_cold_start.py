@@ -0,0 +1,93 @@
+"""
+Testes de tempo de inicializacao (cold start) e das migracoes de schema
+"""
+import json
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+from database.connection import criar_engine
+from database.migrations import (
+    aplicar_migracoes, verificar_versao, SchemaDesatualizadoError, VERSAO_ATUAL
+)
+
+RAIZ = Path(__file__).resolve().parent.parent
+
+# Orcamentos em segundos; podem ser ajustados por ambiente (ex: CI mais lento)
+ORCAMENTO_IMPORT = float(os.getenv("COLD_START_IMPORT_BUDGET", "3.0"))
+ORCAMENTO_STARTUP = float(os.getenv("COLD_START_STARTUP_BUDGET", "0.5"))
+
+# Modulos que nao devem ser carregados apenas por importar a aplicacao
+MODULOS_PESADOS = ("psycopg2", "uvicorn")
+
+SCRIPT_IMPORT = f"""
+import json, sys, time
+inicio = time.perf_counter()
+import main
+duracao = time.perf_counter() - inicio
+carregados = [m for m in {MODULOS_PESADOS!r} if m in sys.modules]
+print(json.dumps({{"duracao": duracao, "carregados": carregados}}))
+"""
+
+SCRIPT_STARTUP = """
+import json, time
+import main
+from fastapi.testclient import TestClient
+inicio = time.perf_counter()
+with TestClient(main.app):
+    duracao = time.perf_counter() - inicio
+print(json.dumps({"duracao": duracao}))
+"""
+
+
+def _executar(script, **env_extra):
+    env = {**os.environ, **env_extra}
+    resultado = subprocess.run(
+        [sys.executable, "-c", script],
+        cwd=RAIZ, env=env, capture_output=True, text=True, timeout=120
+    )
+    assert resultado.returncode == 0, resultado.stderr
+    return json.loads(resultado.stdout.strip().splitlines()[-1])
+
+
+def test_import_da_aplicacao_dentro_do_orcamento():
+    """Importar main nao cria engine nem carrega driver/servidor"""
+    medicao = _executar(SCRIPT_IMPORT)
+    assert medicao["carregados"] == []
+    assert medicao["duracao"] < ORCAMENTO_IMPORT, (
+        f"import levou {medicao['duracao']:.3f}s (orcamento {ORCAMENTO_IMPORT}s)"
+    )
+
+
+def test_startup_dentro_do_orcamento(tmp_path):
+    """Startup com schema migrado faz apenas a verificacao de versao"""
+    url = f"sqlite:///{tmp_path / 'cold_start.db'}"
+    migracao = subprocess.run(
+        [sys.executable, "migrate.py"],
+        cwd=RAIZ, env={**os.environ, "DATABASE_URL": url},
+        capture_output=True, text=True, timeout=120
+    )
+    assert migracao.returncode == 0, migracao.stderr
+
+    medicao = _executar(SCRIPT_STARTUP, DATABASE_URL=url)
+    assert medicao["duracao"] < ORCAMENTO_STARTUP, (
+        f"startup levou {medicao['duracao']:.3f}s (orcamento {ORCAMENTO_STARTUP}s)"
+    )
+
+
+def test_verificar_versao_sem_migracoes():
+    """Banco sem migracoes impede o startup"""
+    engine = criar_engine("sqlite:///:memory:")
+    with pytest.raises(SchemaDesatualizadoError):
+        verificar_versao(engine)
+
+
+def test_aplicar_migracoes_idempotente():
+    """Migracoes sao aplicadas uma unica vez"""
+    engine = criar_engine("sqlite:///:memory:")
+    assert aplicar_migracoes(engine) == list(range(1, VERSAO_ATUAL + 1))
+    assert aplicar_migracoes(engine) == []
+    assert verificar_versao(engine) == VERSAO_ATUAL
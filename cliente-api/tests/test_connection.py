@@ -0,0 +1,39 @@
+"""
+Testes do dimensionamento do pool de conexoes por worker
+"""
+import pytest
+
+from database.connection import calcular_pool
+
+
+def test_calcular_pool_sem_orcamento_mantem_configuracao():
+    """Sem orcamento global os valores configurados sao usados"""
+    assert calcular_pool(0, 8, pool_size=10, max_overflow=20) == (10, 20)
+
+
+def test_calcular_pool_divide_orcamento_entre_workers():
+    """Pool + overflow de todos os workers cabe no orcamento"""
+    pool, overflow = calcular_pool(100, 8, pool_size=10, max_overflow=20)
+    assert (pool, overflow) == (10, 2)
+    assert (pool + overflow) * 8 <= 100
+
+
+def test_calcular_pool_orcamento_folgado_respeita_limites():
+    """Orcamento maior que o necessario nao aumenta o pool configurado"""
+    assert calcular_pool(1000, 2, pool_size=10, max_overflow=20) == (10, 20)
+
+
+def test_calcular_pool_orcamento_insuficiente():
+    """Orcamento menor que a quantidade de workers e recusado"""
+    assert calcular_pool(8, 8, pool_size=10, max_overflow=20) == (1, 0)
+    with pytest.raises(ValueError, match="insuficiente para 8 workers"):
+        calcular_pool(2, 8, pool_size=10, max_overflow=20)
+
+
+def test_calcular_pool_desconta_conexoes_dos_jobs():
+    """As conexoes da engine de jobs saem da parte de cada worker"""
+    pool, overflow = calcular_pool(100, 8, pool_size=10, max_overflow=20, reservadas=2)
+    assert (pool, overflow) == (10, 0)
+    assert (pool + overflow + 2) * 8 <= 100
+    with pytest.raises(ValueError, match="2 para jobs"):
+        calcular_pool(16, 8, pool_size=10, max_overflow=20, reservadas=2)
@@ -0,0 +1,187 @@
+"""
+Testes do diretorio de clientes em memoria (snapshot colunar)
+"""
+import threading
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from sqlalchemy import event, update
+
+from models.cliente import Cliente
+from schemas.cliente_schema import ClienteResponse, ClienteUpdate, ClienteUpdateLote
+from services import diretorio_clientes
+from services.cliente_service import ClienteService
+from services.diretorio_clientes import (
+    AtualizadorDiretorio, ClienteSnapshotService, DiretorioClientes
+)
+
+
+def _sincronizar(sessoes):
+    diretorio = DiretorioClientes()
+    atualizador = AtualizadorDiretorio(diretorio, {"principal": sessoes})
+    atualizador.sincronizar()
+    return diretorio, atualizador
+
+
+def test_carga_inicial_ordenada_por_nome(sessoes, db_session, criar_clientes):
+    """A carga completa traz todos os clientes, ordenados por nome"""
+    criar_clientes(ClienteService(db_session), ["Pedro Alves", "Ana Souza", "Maria Silva"])
+
+    diretorio, _ = _sincronizar(sessoes)
+
+    assert diretorio.carregado
+    assert len(diretorio) == 3
+    assert [c.nome for c in diretorio.listar()] == ["Ana Souza", "Maria Silva", "Pedro Alves"]
+
+
+def test_buscas_por_id_email_e_nome(sessoes, db_session, criar_clientes):
+    """Buscas pontuais usam os indices hash; a busca por nome e parcial"""
+    maria, joao, _ = criar_clientes(
+        ClienteService(db_session), ["Maria Silva", "Joao Silva", "Ana Souza"]
+    )
+
+    diretorio, _ = _sincronizar(sessoes)
+
+    assert diretorio.buscar_por_id(maria.id).email == "mariasilva@email.com"
+    assert diretorio.buscar_por_id(9999) is None
+    assert diretorio.buscar_por_email(" JoaoSilva@email.com ").id == joao.id
+    assert [c.nome for c in diretorio.buscar_por_nome("silva")] == ["Joao Silva", "Maria Silva"]
+    assert diretorio.buscar_por_nome("xyz") == []
+
+    resposta = ClienteResponse.model_validate(diretorio.buscar_por_id(maria.id))
+    assert resposta.id == maria.id
+    assert resposta.criado_em is not None
+
+
+def test_sincronizacao_incremental(sessoes, db_session, criar_clientes):
+    """Clientes novos e alterados no banco entram no snapshot na proxima sincronizacao"""
+    service = ClienteService(db_session)
+    maria = criar_clientes(service, ["Maria Silva"])[0]
+    diretorio, atualizador = _sincronizar(sessoes)
+
+    criar_clientes(service, ["Bruno Lima"])
+    cliente = db_session.get(Cliente, maria.id)
+    cliente.nome = "Carla Mendes"
+    cliente.email = "carla@email.com"
+    db_session.commit()
+
+    atualizador.sincronizar()
+
+    assert len(diretorio) == 2
+    assert [c.nome for c in diretorio.listar()] == ["Bruno Lima", "Carla Mendes"]
+    assert diretorio.buscar_por_email("mariasilva@email.com") is None
+    assert diretorio.buscar_por_email("carla@email.com").id == maria.id
+    assert diretorio.buscar_por_nome("maria") == []
+
+
+def test_reconciliacao_completa_aplica_escrita_fora_da_margem(
+    sessoes, db_session, criar_clientes, monkeypatch
+):
+    """
+    Uma escrita confirmada depois da margem (timestamp do inicio de uma
+    transacao longa) so entra no snapshot na releitura completa
+    """
+    maria = criar_clientes(ClienteService(db_session), ["Maria Silva"])[0]
+    diretorio, atualizador = _sincronizar(sessoes)
+    inicio_da_transacao = datetime.now(timezone.utc) - timedelta(hours=1)
+    db_session.execute(
+        update(Cliente).where(Cliente.id == maria.id).values(
+            nome="Carla Mendes", versao=2,
+            criado_em=inicio_da_transacao, atualizado_em=inicio_da_transacao
+        )
+    )
+    db_session.commit()
+
+    atualizador.sincronizar()
+    assert diretorio.buscar_por_id(maria.id).nome == "Maria Silva"
+
+    monkeypatch.setattr(diretorio_clientes, "SNAPSHOT_RECONCILIACAO", 0)
+    atualizador.sincronizar()
+    assert [c.nome for c in diretorio.listar()] == ["Carla Mendes"]
+
+
+def test_carregar_linhas_incremental_mantem_ordem():
+    """Insercoes e renomeacoes incrementais preservam a ordem (nome, id)"""
+    diretorio = DiretorioClientes()
+    diretorio.carregar_linhas([
+        (1, "Bia", "bia@email.com", None, None, None, 1),
+        (2, "Davi", "davi@email.com", None, None, None, 1),
+    ], carga_completa=True)
+
+    diretorio.carregar_linhas([
+        (3, "Caio", "caio@email.com", None, None, None, 1),
+        (4, "Bia", "bia2@email.com", None, None, None, 1),
+        (2, "Ana", "davi@email.com", "1199999", None, None, 1),
+    ])
+
+    assert [(c.id, c.nome) for c in diretorio.listar()] == [
+        (2, "Ana"), (1, "Bia"), (4, "Bia"), (3, "Caio")
+    ]
+    assert diretorio.buscar_por_id(2).telefone == "1199999"
+
+
+def test_carregar_linhas_ignora_versao_anterior():
+    """Uma linha mais antiga que a do snapshot (ex: releitura atrasada) nao o sobrescreve"""
+    diretorio = DiretorioClientes()
+    diretorio.carregar_linhas([(1, "Bia", "bia@email.com", None, None, None, 2)])
+
+    diretorio.carregar_linhas([(1, "Beatriz", "beatriz@email.com", None, None, None, 1)])
+
+    registro = diretorio.buscar_por_id(1)
+    assert (registro.nome, registro.versao) == ("Bia", 2)
+    assert diretorio.buscar_por_email("beatriz@email.com") is None
+
+
+def test_sincronizar_le_o_banco_fora_da_trava(engine, sessoes, db_session, criar_clientes):
+    """Enquanto as linhas sao buscadas no banco, escritas no diretorio nao ficam bloqueadas"""
+    criar_clientes(ClienteService(db_session), ["Maria Silva"])
+    diretorio = DiretorioClientes()
+    bloqueadas = []
+
+    def escrever_durante_a_consulta(*args):
+        escrita = threading.Thread(target=diretorio.carregar_linhas, args=(
+            [(999, "Local", "local@email.com", None, None, None, 1)],
+        ))
+        escrita.start()
+        escrita.join(timeout=2)
+        bloqueadas.append(escrita.is_alive())
+
+    event.listen(engine, "before_cursor_execute", escrever_durante_a_consulta)
+    try:
+        AtualizadorDiretorio(diretorio, {"principal": sessoes}).sincronizar()
+    finally:
+        event.remove(engine, "before_cursor_execute", escrever_durante_a_consulta)
+
+    assert bloqueadas and not any(bloqueadas)
+    assert [c.nome for c in diretorio.listar()] == ["Local", "Maria Silva"]
+
+
+def test_snapshot_service_le_do_diretorio_e_aplica_escritas(sessoes, db_session, criar_clientes):
+    """Leituras vem do diretorio; o proprio cadastro fica visivel de imediato"""
+    criar_clientes(ClienteService(db_session), ["Maria Silva"])
+    diretorio, _ = _sincronizar(sessoes)
+    service = ClienteSnapshotService(ClienteService(db_session), diretorio)
+
+    novo = criar_clientes(service, ["Ana Souza"])[0]
+
+    assert service.buscar_por_id(novo.id).nome == "Ana Souza"
+    assert [c.nome for c in service.listar_todos()] == ["Ana Souza", "Maria Silva"]
+    assert service.buscar_por_nome("  ") == []
+    with pytest.raises(ValueError):
+        criar_clientes(service, ["Ana Souza"])
+
+
+def test_snapshot_service_aplica_atualizacoes(sessoes, db_session, criar_clientes):
+    """Atualizacoes feitas pelo proprio processo entram no diretorio com a nova versao"""
+    maria, ana = criar_clientes(ClienteService(db_session), ["Maria Silva", "Ana Souza"])
+    diretorio, _ = _sincronizar(sessoes)
+    service = ClienteSnapshotService(ClienteService(db_session), diretorio)
+
+    service.atualizar_cliente(maria.id, ClienteUpdate(nome="Carla Mendes", versao=1))
+    service.atualizar_em_lote([ClienteUpdateLote(id=ana.id, versao=1, email="ana@nova.com")])
+
+    assert [(c.nome, c.versao) for c in service.listar_todos()] == [
+        ("Ana Souza", 2), ("Carla Mendes", 2)
+    ]
+    assert service.buscar_por_email("ana@nova.com").id == ana.id
+    assert service.atualizar_cliente(999, ClienteUpdate(nome="Ninguem", versao=1)) is None
@@ -0,0 +1,73 @@
+"""
+Testes das estatisticas pre-agregadas de clientes
+"""
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from sqlalchemy import insert
+from sqlalchemy.orm import sessionmaker
+
+from database.connection import criar_engine
+from database.migrations import aplicar_migracoes
+from models.cliente import Cliente
+from schemas.cliente_schema import ClienteCreate
+from services.cliente_service import ClienteService
+from services.estatisticas_service import EstatisticasService, limpar_cache
+
+
+def test_estatisticas_vazias(db_session):
+    """Sem clientes os totais sao zero"""
+    stats = EstatisticasService(db_session).obter_estatisticas()
+    assert stats["total"] == 0
+    assert stats["por_dia"] == []
+    assert stats["por_dominio"] == []
+
+
+def test_estatisticas_incrementadas_no_cadastro(db_session):
+    """Cada cadastro atualiza os agregados na mesma transacao"""
+    service = ClienteService(db_session)
+    for email in ("ana@empresa.com", "bia@empresa.com", "caio@outra.com"):
+        service.criar_cliente(ClienteCreate(nome="Cliente", email=email))
+
+    stats = EstatisticasService(db_session).obter_estatisticas()
+
+    assert stats["total"] == 3
+    assert sum(d["total"] for d in stats["por_dia"]) == 3
+    assert sum(s["total"] for s in stats["por_semana"]) == 3
+    assert stats["por_dominio"] == [
+        {"dominio": "empresa.com", "total": 2},
+        {"dominio": "outra.com", "total": 1},
+    ]
+
+
+def test_estatisticas_email_duplicado_nao_conta(db_session):
+    """Cadastro rejeitado nao altera os agregados"""
+    service = ClienteService(db_session)
+    service.criar_cliente(ClienteCreate(nome="Ana", email="ana@empresa.com"))
+    with pytest.raises(ValueError):
+        service.criar_cliente(ClienteCreate(nome="Ana", email="ana@empresa.com"))
+
+    assert EstatisticasService(db_session).obter_estatisticas()["total"] == 1
+
+
+def test_migracao_calcula_agregados_existentes(url_banco):
+    """A migracao das estatisticas considera os clientes ja cadastrados"""
+    engine = criar_engine(url_banco)
+    limpar_cache()
+    Cliente.__table__.create(engine)
+    ontem = datetime.now(timezone.utc) - timedelta(days=1)
+    with engine.begin() as conexao:
+        conexao.execute(insert(Cliente.__table__), [
+            {"nome": "Ana", "email": "ana@empresa.com", "criado_em": ontem},
+            {"nome": "Bia", "email": "bia@empresa.com", "criado_em": ontem},
+        ])
+
+    aplicar_migracoes(engine)
+    db = sessionmaker(bind=engine)()
+    stats = EstatisticasService(db).obter_estatisticas()
+    db.close()
+    engine.dispose()
+
+    assert stats["total"] == 2
+    assert stats["por_dia"] == [{"dia": ontem.date(), "total": 2}]
+    assert stats["por_dominio"] == [{"dominio": "empresa.com", "total": 2}]
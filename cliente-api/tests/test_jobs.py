@@ -0,0 +1,321 @@
+"""
+Testes dos jobs em segundo plano (importacao e recalculo de estatisticas)
+"""
+import time
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from database.migrations import aplicar_migracoes
+from database.sharding import ShardRouter
+from models.cliente import Cliente
+from models.estatisticas import ClienteEstatisticaDominio
+from models.job import Job, JobAgregado, JobLote
+from schemas.cliente_schema import ClienteCreate
+from services import job_service
+from services.cliente_service import ClienteService
+from services.cliente_sharded_service import ClienteShardedService
+from services.estatisticas_service import EstatisticasService
+from services.job_service import ContextoJob, JobRunner, JobService
+
+
+@pytest.fixture(autouse=True)
+def lotes_pequenos(monkeypatch):
+    """Lotes pequenos para exercitar checkpoints"""
+    monkeypatch.setattr(job_service, "JOBS_LOTE", 2)
+
+
+@pytest.fixture
+def runner(url_banco, engine):
+    runner = JobRunner(url_banco, max_workers=1)
+    yield runner
+    runner.parar()
+
+
+def _aguardar(db, job_id, limite=10.0):
+    fim = time.monotonic() + limite
+    while time.monotonic() < fim:
+        db.expire_all()
+        job = db.get(Job, job_id)
+        if job.status in ("concluido", "falhou"):
+            return job
+        time.sleep(0.05)
+    raise AssertionError(f"Job {job_id} nao terminou em {limite}s")
+
+
+def test_importacao_clientes(db_session, runner):
+    """Importa em lotes, contabilizando linhas invalidas e duplicadas"""
+    linhas = [
+        {"nome": "Ana", "email": "ana@email.com"},
+        {"nome": "Bia", "email": "bia@email.com", "telefone": "41999999999"},
+        {"nome": "", "email": "vazio@email.com"},
+        {"nome": "Ana de novo", "email": "ana@email.com"},
+        {"nome": "Caio", "email": "invalido"},
+    ]
+    job = JobService(db_session).criar_job("importacao_clientes", linhas=linhas)
+    assert job.total == 5
+    assert db_session.query(JobLote).filter_by(job_id=job.id).count() == 3
+    runner.submeter(job.id)
+
+    job = _aguardar(db_session, job.id)
+
+    assert job.status == "concluido"
+    assert job.processados == 5
+    assert job.erros == 3
+    assert job.ultimos_erros[0].startswith("linha 2:")
+    assert job.checkpoint == {"proxima_linha": 5}
+    assert job.linhas_por_segundo > 0
+    assert [c.nome for c in ClienteService(db_session).listar_todos()] == ["Ana", "Bia"]
+    assert db_session.query(JobLote).filter_by(job_id=job.id).count() == 0
+
+
+def test_importacao_em_partes(db_session, runner):
+    """Um job aberto recebe a entrada em partes e so executa apos a ultima"""
+    service = JobService(db_session)
+    linhas = [{"nome": f"Cliente {i}", "email": f"cliente{i}@email.com"} for i in range(5)]
+    job = service.criar_job("importacao_clientes", linhas=linhas[:3], aberto=True)
+    runner.retomar_pendentes()
+
+    parte = service.adicionar_linhas(job.id, linhas[3:4], finalizar=False)
+    assert (parte.status, parte.total) == ("aberto", 4)
+    job = service.adicionar_linhas(job.id, linhas[4:])
+    assert (job.status, job.total) == ("pendente", 5)
+    assert [lote.inicio for lote in db_session.query(JobLote).filter_by(job_id=job.id)
+            .order_by(JobLote.inicio)] == [0, 2, 3, 4]
+    with pytest.raises(job_service.JobFechadoError):
+        service.adicionar_linhas(job.id, linhas[:1])
+    assert service.adicionar_linhas("naoexiste", linhas[:1]) is None
+
+    runner.submeter(job.id)
+    job = _aguardar(db_session, job.id)
+
+    assert (job.status, job.processados, job.erros) == ("concluido", 5, 0)
+    assert [c.nome for c in ClienteService(db_session).listar_todos()] == [
+        f"Cliente {i}" for i in range(5)
+    ]
+
+
+def test_importacao_retoma_do_checkpoint(db_session, runner):
+    """Job abandonado (lease expirado) e retomado do ultimo checkpoint"""
+    linhas = [{"nome": f"Cliente {i}", "email": f"cliente{i}@email.com"} for i in range(4)]
+    job = JobService(db_session).criar_job("importacao_clientes", linhas=linhas)
+    job.status = "executando"
+    job.dono = "worker-que-caiu"
+    job.heartbeat_em = datetime.now(timezone.utc) - timedelta(hours=1)
+    job.checkpoint = {"proxima_linha": 2}
+    job.processados = 2
+    db_session.commit()
+
+    runner.retomar_pendentes()
+    job = _aguardar(db_session, job.id)
+
+    assert job.status == "concluido"
+    assert job.processados == 4
+    assert [c.nome for c in ClienteService(db_session).listar_todos()] == [
+        "Cliente 2", "Cliente 3"
+    ]
+
+
+def test_importacao_checkpoint_gravado_com_cada_cliente(db_session, runner, monkeypatch):
+    """
+    Uma queda antes do fim do lote nao perde o checkpoint: o job retomado
+    nao reprocessa os clientes ja gravados nem os conta como erro
+    """
+    def queda(*args, **kwargs):
+        raise RuntimeError("processo caiu")
+
+    monkeypatch.setattr(ContextoJob, "salvar_progresso", queda)
+    linhas = [
+        {"nome": "Ana", "email": "ana@email.com"},
+        {"nome": "", "email": "vazio@email.com"},
+        {"nome": "Bia", "email": "bia@email.com"},
+        {"nome": "Caio", "email": "caio@email.com"},
+    ]
+    job = JobService(db_session).criar_job("importacao_clientes", linhas=linhas)
+    runner.submeter(job.id)
+    job = _aguardar(db_session, job.id)
+
+    assert job.status == "falhou"
+    ana = ClienteService(db_session).buscar_por_email("ana@email.com")
+    assert job.checkpoint == {"proxima_linha": 1, "cliente_id": ana.id}
+    assert job.processados == 1
+
+    # Como se o processo tivesse morrido: lease expirado, sem o erro da queda
+    monkeypatch.undo()
+    job.status = "executando"
+    job.dono = "worker-que-caiu"
+    job.heartbeat_em = datetime.now(timezone.utc) - timedelta(hours=1)
+    job.erros = 0
+    job.finalizado_em = None
+    db_session.commit()
+    runner.retomar_pendentes()
+    job = _aguardar(db_session, job.id)
+
+    assert job.status == "concluido"
+    assert job.processados == 4
+    assert job.erros == 1
+    assert [c.nome for c in ClienteService(db_session).listar_todos()] == ["Ana", "Bia", "Caio"]
+
+
+def test_importacao_com_shards_usa_o_roteador_do_runner(tmp_path, url_banco, db_session):
+    """Com shards, a importacao grava pelos pools do runner, nao pelos das requisicoes"""
+    urls = [f"sqlite:///{tmp_path / f'shard_{i}.db'}" for i in range(2)]
+    shards = ShardRouter(urls)
+    for engine in shards.engines:
+        aplicar_migracoes(engine)
+    runner = JobRunner(url_banco, max_workers=1, shards=urls)
+    try:
+        linhas = [{"nome": f"Cliente {i}", "email": f"cliente{i}@email.com"} for i in range(4)]
+        job = JobService(db_session).criar_job("importacao_clientes", linhas=linhas)
+        runner.submeter(job.id)
+        job = _aguardar(db_session, job.id)
+
+        assert job.status == "concluido"
+        assert job.erros == 0
+        assert runner.router is not None
+        por_shard = shards.executar_em_todos(lambda db: db.query(Cliente).count())
+        assert sum(por_shard) == 4
+        assert len(ClienteShardedService(db_session, shards).listar_todos()) == 4
+    finally:
+        runner.parar()
+        shards.dispose()
+
+
+def test_importacao_com_shards_retoma_reserva_sem_cliente_no_shard(
+    tmp_path, url_banco, db_session, monkeypatch
+):
+    """
+    Uma queda entre a reserva no indice global e o commit no shard deixa
+    so a reserva; o job retomado grava o cliente, sem duplicar o email
+    """
+    urls = [f"sqlite:///{tmp_path / f'shard_{i}.db'}" for i in range(2)]
+    shards = ShardRouter(urls)
+    for engine in shards.engines:
+        aplicar_migracoes(engine)
+    runner = JobRunner(url_banco, max_workers=1, shards=urls)
+    gravar_no_shard = ClienteShardedService._gravar_no_shard
+
+    def queda_na_segunda_linha(service, cliente):
+        if cliente.email == "cliente1@email.com":
+            raise RuntimeError("processo caiu")
+        return gravar_no_shard(service, cliente)
+
+    monkeypatch.setattr(ClienteShardedService, "_gravar_no_shard", queda_na_segunda_linha)
+    try:
+        linhas = [{"nome": f"Cliente {i}", "email": f"cliente{i}@email.com"} for i in range(3)]
+        job = JobService(db_session).criar_job("importacao_clientes", linhas=linhas)
+        runner.submeter(job.id)
+        job = _aguardar(db_session, job.id)
+        service = ClienteShardedService(db_session, shards)
+
+        assert job.status == "falhou"
+        assert job.checkpoint["proxima_linha"] == 2
+        assert service.buscar_por_email("cliente1@email.com") is None
+        with pytest.raises(ValueError):
+            service.criar_cliente(ClienteCreate(nome="Outro", email="cliente1@email.com"))
+
+        monkeypatch.undo()
+        job.status = "executando"
+        job.dono = "worker-que-caiu"
+        job.heartbeat_em = datetime.now(timezone.utc) - timedelta(hours=1)
+        job.erros = 0
+        job.finalizado_em = None
+        db_session.commit()
+        runner.retomar_pendentes()
+        job = _aguardar(db_session, job.id)
+
+        assert job.status == "concluido"
+        assert (job.processados, job.erros) == (3, 0)
+        assert [c.nome for c in service.listar_todos()] == ["Cliente 0", "Cliente 1", "Cliente 2"]
+        assert service.buscar_por_email("cliente1@email.com").nome == "Cliente 1"
+        assert EstatisticasService(db_session).obter_estatisticas()["total"] == 3
+    finally:
+        runner.parar()
+        shards.dispose()
+
+
+def test_job_com_lease_ativo_nao_e_executado(db_session, runner):
+    """Um job em execucao em outro worker nao e assumido"""
+    job = JobService(db_session).criar_job(
+        "importacao_clientes", linhas=[{"nome": "Ana", "email": "ana@email.com"}]
+    )
+    job.status = "executando"
+    job.dono = "outro-worker"
+    job.heartbeat_em = datetime.now(timezone.utc)
+    db_session.commit()
+
+    runner.retomar_pendentes()
+    runner.submeter(job.id)
+    time.sleep(0.3)
+
+    db_session.expire_all()
+    job = db_session.get(Job, job.id)
+    assert job.status == "executando"
+    assert job.dono == "outro-worker"
+    assert job.processados == 0
+
+
+def test_recalculo_estatisticas(db_session, runner):
+    """O backfill reconstroi os agregados a partir da tabela clientes"""
+    service = ClienteService(db_session)
+    for email in ("ana@empresa.com", "bia@empresa.com", "caio@outra.com"):
+        service.criar_cliente(ClienteCreate(nome="Cliente", email=email))
+    db_session.query(ClienteEstatisticaDominio).delete()
+    db_session.commit()
+
+    job = JobService(db_session).criar_job("recalculo_estatisticas")
+    runner.submeter(job.id)
+    job = _aguardar(db_session, job.id)
+
+    assert job.status == "concluido"
+    assert job.processados == 3
+    stats = EstatisticasService(db_session).obter_estatisticas()
+    assert stats["total"] == 3
+    assert stats["por_dominio"] == [
+        {"dominio": "empresa.com", "total": 2},
+        {"dominio": "outra.com", "total": 1},
+    ]
+
+
+def test_recalculo_retoma_dos_agregados_parciais(db_session, runner, monkeypatch):
+    """O checkpoint guarda so os cursores; as contagens ja feitas ficam em jobs_agregados"""
+    service = ClienteService(db_session)
+    for email in ("ana@empresa.com", "bia@empresa.com", "caio@outra.com", "davi@outra.com"):
+        service.criar_cliente(ClienteCreate(nome="Cliente", email=email))
+    salvar_progresso = ContextoJob.salvar_progresso
+
+    def queda_no_segundo_lote(contexto, checkpoint, *args, **kwargs):
+        if checkpoint["cursores"][0] > 2:
+            raise RuntimeError("processo caiu")
+        return salvar_progresso(contexto, checkpoint, *args, **kwargs)
+
+    monkeypatch.setattr(ContextoJob, "salvar_progresso", queda_no_segundo_lote)
+    job = JobService(db_session).criar_job("recalculo_estatisticas")
+    runner.submeter(job.id)
+    job = _aguardar(db_session, job.id)
+
+    assert job.status == "falhou"
+    assert job.checkpoint == {"cursores": [2]}
+    assert db_session.query(JobAgregado).filter_by(job_id=job.id).count() == 2
+
+    monkeypatch.undo()
+    db_session.query(ClienteEstatisticaDominio).delete()
+    db_session.commit()
+    job.status = "pendente"
+    db_session.commit()
+    runner.submeter(job.id)
+    job = _aguardar(db_session, job.id)
+
+    assert job.status == "concluido"
+    assert job.processados == 4
+    assert EstatisticasService(db_session).obter_estatisticas()["por_dominio"] == [
+        {"dominio": "empresa.com", "total": 2},
+        {"dominio": "outra.com", "total": 2},
+    ]
+    assert db_session.query(JobAgregado).filter_by(job_id=job.id).count() == 0
+
+
+def test_criar_job_tipo_desconhecido(db_session):
+    """Tipos nao registrados sao rejeitados"""
+    with pytest.raises(ValueError, match="desconhecido"):
+        JobService(db_session).criar_job("inexistente")
@@ -0,0 +1,343 @@
+"""
+Testes do ClienteService com clientes distribuidos entre shards SQLite
+"""
+import threading
+
+import pytest
+from sqlalchemy import MetaData, String
+from sqlalchemy.exc import OperationalError
+
+from database.connection import criar_engine
+from database.migrations import aplicar_migracoes
+from database.sharding import ShardRouter, shard_do_id
+from models.cliente import Cliente
+from models.cliente_indice import ClienteIndice
+from schemas.cliente_schema import ClienteCreate, ClienteUpdate, ClienteUpdateLote
+from services.cliente_service import ClienteService, ConflitoVersaoError
+from services.cliente_sharded_service import ClienteShardedService
+from services.estatisticas_service import EstatisticasService
+
+QUANTIDADE_SHARDS = 3
+
+
+@pytest.fixture
+def router(tmp_path):
+    """Tres bancos SQLite fazendo o papel de shards"""
+    router = ShardRouter([
+        f"sqlite:///{tmp_path / f'shard_{i}.db'}" for i in range(QUANTIDADE_SHARDS)
+    ])
+    for engine in router.engines:
+        aplicar_migracoes(engine)
+    yield router
+    router.dispose()
+
+
+@pytest.fixture
+def cliente_service(db_session, router):
+    """Service com o banco coordenador em um SQLite separado"""
+    return ClienteShardedService(db_session, router)
+
+
+def _contar_por_shard(router):
+    return [len(c) for c in router.executar_em_todos(lambda db: db.query(Cliente).all())]
+
+
+def test_shard_do_id_estavel_e_distribuido():
+    """O hash do id e deterministico e espalha ids sequenciais"""
+    assert shard_do_id(42, 4) == shard_do_id(42, 4)
+    contagem = [0] * 4
+    for cliente_id in range(1, 4001):
+        contagem[shard_do_id(cliente_id, 4)] += 1
+    assert all(800 < total < 1200 for total in contagem)
+
+
+def test_executar_em_todos_requisicoes_concorrentes_em_paralelo(tmp_path):
+    """Varias requisicoes consultam o mesmo shard ao mesmo tempo, ate o tamanho do pool"""
+    router = ShardRouter(
+        [f"sqlite:///{tmp_path / f'shard_{i}.db'}" for i in range(QUANTIDADE_SHARDS)],
+        pool_size=2
+    )
+    todas_juntas = threading.Barrier(2 * QUANTIDADE_SHARDS, timeout=5)
+    resultados = []
+
+    def listar():
+        resultados.append(router.executar_em_todos(lambda db: todas_juntas.wait()))
+
+    requisicoes = [threading.Thread(target=listar) for _ in range(2)]
+    try:
+        for requisicao in requisicoes:
+            requisicao.start()
+        for requisicao in requisicoes:
+            requisicao.join()
+    finally:
+        router.dispose()
+
+    assert len(resultados) == 2
+
+
+def test_criar_cliente_grava_em_um_unico_shard(cliente_service, router, criar_clientes):
+    """Cada cliente fica apenas no shard definido pelo seu id"""
+    clientes = criar_clientes(cliente_service, [f"Cliente {i}" for i in range(12)])
+
+    assert sum(_contar_por_shard(router)) == 12
+    for cliente in clientes:
+        shard = router.sessao(router.shard_do_id(cliente.id))
+        try:
+            assert shard.get(Cliente, cliente.id) is not None
+        finally:
+            shard.close()
+
+
+def test_criar_cliente_reserva_o_indice_antes_do_shard(
+    cliente_service, router, sessoes, criar_clientes, monkeypatch
+):
+    """
+    A reserva do email e confirmada no coordenador antes do commit no shard:
+    uma queda entre os dois deixa so a reserva, nunca um email duplicado
+    """
+    def queda(service, cliente):
+        with sessoes() as outra:
+            assert ClienteShardedService(outra, router).buscar_por_email(cliente.email) is None
+            assert outra.query(ClienteIndice).filter_by(email=cliente.email).count() == 1
+        raise RuntimeError("processo caiu")
+
+    monkeypatch.setattr(ClienteShardedService, "_gravar_no_shard", queda)
+    with pytest.raises(RuntimeError):
+        criar_clientes(cliente_service, ["Maria Silva"])
+    monkeypatch.undo()
+
+    assert sum(_contar_por_shard(router)) == 0
+    with pytest.raises(ValueError, match="ja esta cadastrado"):
+        criar_clientes(cliente_service, ["Maria Silva"])
+
+    reserva = cliente_service.db.query(ClienteIndice).one()
+    dados = ClienteCreate(nome="Maria Silva", email="mariasilva@email.com")
+    assert cliente_service.concluir_cadastro(reserva.id, dados).id == reserva.id
+    assert cliente_service.concluir_cadastro(reserva.id, dados) is None
+    assert cliente_service.buscar_por_email("mariasilva@email.com").nome == "Maria Silva"
+
+
+def test_criar_cliente_falha_no_shard_desfaz_a_reserva(cliente_service, router, monkeypatch):
+    """Se o shard recusar o cliente, o email e as estatisticas voltam a ficar livres"""
+    sessao = router.sessao
+
+    def sessao_sem_commit(indice):
+        shard = sessao(indice)
+
+        def falhar():
+            raise OperationalError("COMMIT", {}, Exception("conexao perdida"))
+
+        shard.commit = falhar
+        return shard
+
+    monkeypatch.setattr(router, "sessao", sessao_sem_commit)
+    with pytest.raises(OperationalError):
+        cliente_service.criar_cliente(ClienteCreate(nome="Ana", email="ana@email.com"))
+    monkeypatch.undo()
+
+    assert EstatisticasService(cliente_service.db).obter_estatisticas()["por_dominio"] == []
+    assert cliente_service.criar_cliente(
+        ClienteCreate(nome="Ana", email="ana@email.com")
+    ).nome == "Ana"
+
+
+def test_buscar_por_id_e_email(cliente_service, criar_clientes):
+    """Consultas pontuais encontram o cliente no seu shard"""
+    cliente = criar_clientes(cliente_service, ["Maria Silva"])[0]
+
+    assert cliente_service.buscar_por_id(cliente.id).email == "mariasilva@email.com"
+    assert cliente_service.buscar_por_email("MariaSilva@email.com").id == cliente.id
+    assert cliente_service.buscar_por_id(9999) is None
+    assert cliente_service.buscar_por_email("naoexiste@email.com") is None
+
+
+def test_email_unico_entre_shards(cliente_service, router, criar_clientes):
+    """O mesmo email nao pode ser cadastrado duas vezes, em nenhum shard"""
+    criar_clientes(cliente_service, ["Ana"])
+    with pytest.raises(ValueError, match="ja esta cadastrado"):
+        cliente_service.criar_cliente(ClienteCreate(nome="Outra Ana", email="ANA@email.com"))
+    assert sum(_contar_por_shard(router)) == 1
+
+
+def test_listar_todos_ordenado_por_nome(cliente_service, criar_clientes):
+    """Scatter-gather combina os shards mantendo a ordem por nome"""
+    nomes = ["Pedro", "Ana", "Maria", "Bruno", "Zeca", "Carla", "Joao"]
+    criar_clientes(cliente_service, nomes)
+
+    assert [c.nome for c in cliente_service.listar_todos()] == sorted(nomes)
+
+
+def test_listar_todos_ordem_binaria_com_collation_sem_maiusculas(
+    tmp_path, db_session, criar_clientes
+):
+    """
+    Shards cuja coluna nome ignora maiusculas (como en_US no PostgreSQL)
+    ainda sao combinados na ordem do Python
+    """
+    urls = [f"sqlite:///{tmp_path / f'nocase_{i}.db'}" for i in range(QUANTIDADE_SHARDS)]
+    tabela = Cliente.__table__.to_metadata(MetaData())
+    tabela.c.nome.type = String(255, collation="NOCASE")
+    for url in urls:
+        engine = criar_engine(url)
+        tabela.create(engine)
+        aplicar_migracoes(engine)
+        engine.dispose()
+    router = ShardRouter(urls)
+    try:
+        service = ClienteShardedService(db_session, router)
+        nomes = ["ana", "Bruno", "carla", "Zeca", "beatriz", "Diego", "eva", "Fabio"]
+        criar_clientes(service, nomes)
+
+        assert [c.nome for c in service.listar_todos()] == sorted(nomes)
+        assert [c.nome for c in service.buscar_por_nome("a")] == sorted(
+            nome for nome in nomes if "a" in nome.lower()
+        )
+    finally:
+        router.dispose()
+
+
+def test_buscar_por_nome_em_todos_os_shards(cliente_service, criar_clientes):
+    """Busca por nome considera todos os shards"""
+    criar_clientes(cliente_service, ["Joao Silva", "Maria Silva", "Pedro Costa", "Ana Silva"])
+
+    resultado = cliente_service.buscar_por_nome("silva")
+
+    assert [c.nome for c in resultado] == ["Ana Silva", "Joao Silva", "Maria Silva"]
+    assert cliente_service.buscar_por_nome("   ") == []
+
+
+def test_atualizar_email_atualiza_indice(cliente_service, criar_clientes):
+    """A troca de email vale para a busca por email e libera o email antigo"""
+    maria, joao = criar_clientes(cliente_service, ["Maria Silva", "Joao Silva"])
+
+    atualizado = cliente_service.atualizar_cliente(
+        maria.id, ClienteUpdate(email="maria@nova.com", versao=1)
+    )
+
+    assert atualizado.versao == 2
+    assert cliente_service.buscar_por_email("maria@nova.com").id == maria.id
+    assert cliente_service.buscar_por_email("mariasilva@email.com") is None
+    with pytest.raises(ValueError, match="Email joaosilva@email.com ja esta cadastrado"):
+        cliente_service.atualizar_cliente(
+            maria.id, ClienteUpdate(email="joaosilva@email.com", versao=2)
+        )
+    assert cliente_service.atualizar_cliente(9999, ClienteUpdate(email="x@y.com", versao=1)) is None
+
+
+def test_atualizar_conflito_nao_libera_email_antigo(
+    cliente_service, router, sessoes, criar_clientes, monkeypatch
+):
+    """Um conflito de versao e detectado no shard antes de o indice ser alterado"""
+    maria = criar_clientes(cliente_service, ["Maria Silva"])[0]
+    cliente_service.atualizar_cliente(maria.id, ClienteUpdate(nome="Maria", versao=1))
+    concorrente = ClienteShardedService(sessoes(), router)
+    update_versionado = ClienteService._update_versionado
+
+    def cadastrar_email_antigo(service, *args):
+        # Outra requisicao tenta cadastrar o email antigo durante a atualizacao
+        with pytest.raises(ValueError):
+            criar_clientes(concorrente, ["Maria Silva"])
+        return update_versionado(service, *args)
+
+    monkeypatch.setattr(ClienteService, "_update_versionado", cadastrar_email_antigo)
+    with pytest.raises(ConflitoVersaoError):
+        cliente_service.atualizar_cliente(
+            maria.id, ClienteUpdate(email="maria@nova.com", versao=1)
+        )
+    concorrente.db.close()
+
+    assert cliente_service.buscar_por_email("mariasilva@email.com").id == maria.id
+    assert cliente_service.buscar_por_email("maria@nova.com") is None
+    criar_clientes(cliente_service, ["Maria Nova"])
+
+
+def test_atualizar_email_reservado_no_indice_desfaz_o_shard(
+    cliente_service, sessoes, criar_clientes, monkeypatch
+):
+    """Se outra requisicao reservar o email no indice antes, o UPDATE do shard e desfeito"""
+    maria = criar_clientes(cliente_service, ["Maria Silva"])[0]
+    update_versionado = ClienteService._update_versionado
+
+    def reservar_email_novo(service, *args):
+        cliente = update_versionado(service, *args)
+        with sessoes() as outra:
+            outra.add(ClienteIndice(email="maria@nova.com"))
+            outra.commit()
+        return cliente
+
+    monkeypatch.setattr(ClienteService, "_update_versionado", reservar_email_novo)
+    with pytest.raises(ValueError, match="Email maria@nova.com ja esta cadastrado"):
+        cliente_service.atualizar_cliente(
+            maria.id, ClienteUpdate(email="maria@nova.com", versao=1)
+        )
+
+    atual = cliente_service.buscar_por_id(maria.id)
+    assert (atual.email, atual.versao) == ("mariasilva@email.com", 1)
+    assert cliente_service.buscar_por_email("mariasilva@email.com").id == maria.id
+
+
+def test_atualizar_falha_no_commit_do_shard_ressincroniza(
+    cliente_service, router, criar_clientes, monkeypatch
+):
+    """Se o shard nao confirmar, indice e estatisticas voltam ao email gravado no shard"""
+    maria = criar_clientes(cliente_service, ["Maria Silva"])[0]
+    sessao = router.sessao
+
+    def sessao_sem_commit(indice):
+        shard = sessao(indice)
+
+        def falhar():
+            raise OperationalError("COMMIT", {}, Exception("conexao perdida"))
+
+        shard.commit = falhar
+        return shard
+
+    monkeypatch.setattr(router, "sessao", sessao_sem_commit)
+    with pytest.raises(OperationalError):
+        cliente_service.atualizar_cliente(
+            maria.id, ClienteUpdate(email="maria@nova.com", versao=1)
+        )
+    monkeypatch.undo()
+
+    assert cliente_service.buscar_por_id(maria.id).email == "mariasilva@email.com"
+    assert cliente_service.buscar_por_email("mariasilva@email.com").id == maria.id
+    assert cliente_service.buscar_por_email("maria@nova.com") is None
+    por_dominio = EstatisticasService(cliente_service.db).obter_estatisticas()["por_dominio"]
+    assert por_dominio == [{"dominio": "email.com", "total": 1}]
+
+
+def test_atualizar_em_lote_entre_shards(cliente_service, criar_clientes):
+    """O lote e dividido entre os shards; um conflito em um deles desfaz todos"""
+    clientes = criar_clientes(cliente_service, [f"Cliente {i}" for i in range(6)])
+    ids = [c.id for c in clientes]
+
+    atualizados = cliente_service.atualizar_em_lote([
+        ClienteUpdateLote(id=cliente_id, versao=1, email=f"novo{cliente_id}@email.com")
+        for cliente_id in ids
+    ])
+
+    assert [c.id for c in atualizados] == ids
+    assert cliente_service.buscar_por_email(f"novo{ids[0]}@email.com").id == ids[0]
+
+    with pytest.raises(ConflitoVersaoError) as erro:
+        cliente_service.atualizar_em_lote([
+            ClienteUpdateLote(id=ids[0], versao=2, email="trocado@email.com"),
+            ClienteUpdateLote(id=ids[1], versao=1, nome="Desatualizado"),
+        ])
+
+    assert [c["id"] for c in erro.value.conflitos] == [ids[1]]
+    assert cliente_service.buscar_por_id(ids[0]).email == f"novo{ids[0]}@email.com"
+    assert cliente_service.buscar_por_email(f"novo{ids[0]}@email.com").id == ids[0]
+
+
+def test_estatisticas_no_coordenador(cliente_service, criar_clientes):
+    """Os agregados sao mantidos no banco coordenador"""
+    ana, bia = criar_clientes(cliente_service, ["Ana", "Bia"])
+    cliente_service.atualizar_cliente(ana.id, ClienteUpdate(email="ana@empresa.com", versao=1))
+    cliente_service.atualizar_em_lote([
+        ClienteUpdateLote(id=bia.id, versao=1, email="bia@empresa.com")
+    ])
+
+    stats = EstatisticasService(cliente_service.db).obter_estatisticas()
+    assert stats["total"] == 2
+    assert stats["por_dominio"] == [{"dominio": "empresa.com", "total": 2}]